@@ -1,8 +1,13 @@
 '''
 Docstring
 '''
+from contextlib import asynccontextmanager
+from asyncio import to_thread
 from fastapi import FastAPI
 from app.routers import router
+from app.api_clients import cb_client, async_cb_client, k8s_shim_client
+from app.utils import kafka_client, outbox, job_queue, host_domain,\
+    status_index
 
 # FastAPI object customization
 FASTAPI_TITLE = "hlo-fe-engine"
@@ -11,12 +16,37 @@ FASTAPI_VERSION = "0.109.0"
 FASTAPI_OPEN_API_URL = "/openapi.json"
 FASTAPI_DOCS_URL = "/"
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    '''
+    Startup and shutdown of process wide resources
+    '''
+    # Warm the CB token cache, so async CB clients never wait on the shim
+    await to_thread(k8s_shim_client.get_m2m_cb_token)
+    # Resolve the host domain once, allocations read it from memory
+    await to_thread(host_domain.start_host_domain_refresh)
+    await to_thread(status_index.start_status_subscription)
+    kafka_client.start_producer()
+    outbox.start_outbox()
+    job_queue.start_job_queue()
+    yield
+    await to_thread(job_queue.stop_job_queue)
+    host_domain.stop_host_domain_refresh()
+    await to_thread(status_index.stop_status_subscription)
+    await to_thread(outbox.stop_outbox)
+    await to_thread(kafka_client.stop_producer)
+    await async_cb_client.close_async_cb_session()
+    cb_client.close_cb_session()
+
+
 app = FastAPI(
     title=FASTAPI_TITLE,
     description=FASTAPI_DESCRIPTION,
     version=FASTAPI_VERSION,
     docs_url=FASTAPI_DOCS_URL,
-    openapi_url=FASTAPI_OPEN_API_URL
+    openapi_url=FASTAPI_OPEN_API_URL,
+    lifespan=lifespan
 )
 
 app.include_router(router=router, tags=["hlo-fe-engine"])
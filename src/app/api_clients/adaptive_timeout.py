@@ -0,0 +1,164 @@
+'''
+ Adaptive timeouts of CB operations
+ Each operation keeps an EWMA of its observed latency and of the latency deviation
+   (as TCP does for its retransmission timeout); its timeout is
+   latency + CB_TIMEOUT_DEVIATIONS * deviation, clamped to [CB_TIMEOUT_FLOOR, CB_TIMEOUT_CEILING].
+ A timed out call doubles the timeout of its operation until the next success.
+'''
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+import httpx
+import requests
+from app import config
+
+_TIMEOUT_ERRORS = (requests.exceptions.Timeout, httpx.TimeoutException)
+
+
+class AdaptiveTimeout:
+    '''
+        Timeout of one operation, derived from its observed latency
+    '''
+
+    def __init__(self,
+                 name: str,
+                 initial: float = config.CB_TIMEOUT_INITIAL,
+                 floor: float = config.CB_TIMEOUT_FLOOR,
+                 ceiling: float = config.CB_TIMEOUT_CEILING,
+                 alpha: float = config.CB_TIMEOUT_ALPHA,
+                 deviations: float = config.CB_TIMEOUT_DEVIATIONS,
+                 min_samples: int = config.CB_TIMEOUT_MIN_SAMPLES):
+        self.name = name
+        self.initial = initial
+        self.floor = floor
+        self.ceiling = ceiling
+        self.alpha = alpha
+        self.deviations = deviations
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latency = 0.0
+        self._deviation = 0.0
+        self._samples = 0
+        self._backoff = 1
+        self._timeouts = 0
+
+    def _clamp(self, seconds: float) -> float:
+        return min(max(seconds, self.floor), self.ceiling)
+
+    def value(self) -> float:
+        '''
+            Timeout in seconds for the next call
+        '''
+        with self._lock:
+            if self._samples < self.min_samples:
+                base = self.initial
+            else:
+                base = self._latency + self.deviations * self._deviation
+            return self._clamp(base * self._backoff)
+
+    def record(self, latency: float):
+        '''
+            Record latency of a call CB answered, whatever its status
+        '''
+        with self._lock:
+            if self._samples == 0:
+                self._latency = latency
+                self._deviation = latency / 2
+            else:
+                self._deviation += self.alpha * (
+                    abs(latency - self._latency) - self._deviation)
+                self._latency += self.alpha * (latency - self._latency)
+            self._samples += 1
+            self._backoff = 1
+
+    def record_timeout(self):
+        '''
+            Record a timed out call, the timeout doubles until the next answer
+        '''
+        with self._lock:
+            self._timeouts += 1
+            if self._backoff * self.floor < self.ceiling:
+                self._backoff *= 2
+
+    def stats(self) -> dict:
+        '''
+            Current timeout and latency estimates
+        '''
+        timeout = self.value()
+        with self._lock:
+            return {
+                'timeout': timeout,
+                'latency': self._latency,
+                'deviation': self._deviation,
+                'samples': self._samples,
+                'timeouts': self._timeouts,
+                'backoff': self._backoff
+            }
+
+
+class OperationTimeouts:
+    '''
+        operation name -> AdaptiveTimeout, created on first use
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timeouts: Dict[str, AdaptiveTimeout] = {}
+
+    def get(self, operation: str) -> AdaptiveTimeout:
+        '''
+            Timeout of operation
+        '''
+        timeout = self._timeouts.get(operation)
+        if timeout is None:
+            with self._lock:
+                timeout = self._timeouts.setdefault(operation,
+                                                    AdaptiveTimeout(operation))
+        return timeout
+
+    @contextmanager
+    def measure(self, operation: str) -> Iterator[float]:
+        '''
+            with cb_timeouts.measure('query_entity') as timeout:
+                response = session.get(url, timeout=timeout)
+            Yields the timeout of operation and records the latency of the wrapped call
+        '''
+        timeout = self.get(operation)
+        started_at = time.monotonic()
+        try:
+            yield timeout.value()
+        except _TIMEOUT_ERRORS:
+            timeout.record_timeout()
+            raise
+        except (requests.exceptions.ConnectionError, httpx.NetworkError):
+            # No answer, no latency sample
+            raise
+        timeout.record(time.monotonic() - started_at)
+
+    def stats(self) -> dict:
+        '''
+            Timeouts and latency estimates per operation, with their bounds
+        '''
+        with self._lock:
+            timeouts = dict(self._timeouts)
+        return {
+            'floor': config.CB_TIMEOUT_FLOOR,
+            'ceiling': config.CB_TIMEOUT_CEILING,
+            'initial': config.CB_TIMEOUT_INITIAL,
+            'operations': {
+                name: timeout.stats()
+                for name, timeout in sorted(timeouts.items())
+            }
+        }
+
+
+# Shared by CBClient and AsyncCBClient
+cb_timeouts = OperationTimeouts()
+
+
+def get_cb_timeouts_stats() -> dict:
+    '''
+        Current CB timeouts, used by the admin endpoint
+    '''
+    return cb_timeouts.stats()
@@ -0,0 +1,287 @@
+'''
+ Asyncio NGSI-LD REST API Client
+ Same surface as CBClient, to be awaited from FastAPI endpoints
+   without blocking the event loop on CB I/O
+'''
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+import httpx
+from app import config
+from app.utils.decorators import catch_httpx_exceptions
+from app.api_clients import k8s_shim_client
+from app.api_clients import entity_cache
+from app.api_clients.adaptive_timeout import cb_timeouts
+from app.api_clients.ngsild_query import NgsiLdQuery
+from app.api_clients.cb_client import cb_breaker, CB_RETRY_POLICIES,\
+    CBQueryError
+
+_async_cb_session: Optional[httpx.AsyncClient] = None
+
+
+def get_async_cb_session() -> httpx.AsyncClient:
+    '''
+        Process wide keep-alive httpx client towards CB.
+        Must be used from the application event loop
+    '''
+    global _async_cb_session
+    if _async_cb_session is None or _async_cb_session.is_closed:
+        limits = httpx.Limits(
+            max_connections=config.CB_POOL_CONNECTIONS * config.CB_POOL_MAXSIZE,
+            max_keepalive_connections=config.CB_POOL_MAXSIZE)
+        _async_cb_session = httpx.AsyncClient(limits=limits)
+    return _async_cb_session
+
+
+async def close_async_cb_session():
+    '''
+        Close pooled connections, used on application shutdown
+    '''
+    global _async_cb_session
+    if _async_cb_session is not None:
+        await _async_cb_session.aclose()
+        _async_cb_session = None
+
+
+class AsyncCBClient:
+    '''
+        Async client to query CB
+          query entities/{entity_id}
+             or
+          query entities/
+        ... ngsi-ld url params welcome
+          patch entity
+    '''
+
+    def __init__(self):
+        self.api_url = config.CB_URL
+        self.api_port = config.CB_PORT
+        self.url_version = config.URL_VERSION
+        self.session = get_async_cb_session()
+        # Cached token only, a missing one is fetched off the event loop on first request
+        self.m2m_cb_token = k8s_shim_client.cb_token_cache.peek()
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'aeriOS': 'true',
+            'Authorization': f'Bearer {self.m2m_cb_token}'
+        }
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        '''
+            Send request to CB with the m2m token
+            A 401 means the token was revoked or rotated before its expiry:
+              the cached token is dropped and the request is sent once more with a fresh one
+        '''
+        if self.m2m_cb_token is None:
+            await self._fetch_token()
+        response = await self.session.request(method, url, headers=self.headers, **kwargs)
+        if response.status_code == 401:
+            k8s_shim_client.cb_token_cache.invalidate(self.m2m_cb_token)
+            await self._fetch_token()
+            response = await self.session.request(method, url, headers=self.headers, **kwargs)
+        return response
+
+    async def _fetch_token(self):
+        '''
+            Fetching a token waits on the shim (requests and an in-flight refresh),
+            run it in a worker thread so the event loop is never blocked
+        '''
+        self.m2m_cb_token = await asyncio.to_thread(
+            k8s_shim_client.get_m2m_cb_token)
+        self.headers['Authorization'] = f'Bearer {self.m2m_cb_token}'
+
+    async def query_entity(self, entity_id,
+                           ngsild_params: str | NgsiLdQuery) -> dict:
+        '''
+            Query entity with ngsi-ld params, served from the entity cache when enabled
+            :input
+            @param entity_id: the id of the queried entity
+            @param ngsi-ld: the query params, string or NgsiLdQuery
+            :output
+            ngsi-ld object
+        '''
+        ngsild_params = str(ngsild_params)
+        cache = entity_cache.get_entity_cache()
+        if cache is None:
+            return await self._query_entity(entity_id, ngsild_params)
+        cached = cache.get_entity(entity_id, ngsild_params)
+        if cached is not None:
+            return cached
+        generation = cache.generation()
+        result = await self._query_entity(entity_id, ngsild_params)
+        cache.put_entity(entity_id, ngsild_params, result, generation)
+        return result
+
+    @catch_httpx_exceptions(retry=CB_RETRY_POLICIES['query_entity'],
+                            breaker=cb_breaker)
+    async def _query_entity(self, entity_id, ngsild_params) -> dict:
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}?{ngsild_params}'
+        with cb_timeouts.measure('query_entity') as timeout:
+            response = await self._request('get', entity_url,
+                                           timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def query_entities(self, ngsild_params: str | NgsiLdQuery):
+        '''
+            Query entities with ngsi-ld params, served from the entity cache when enabled
+            :input
+            @param ngsi-ld: the query params, string or NgsiLdQuery
+            :output
+            ngsi-ld object
+        '''
+        ngsild_params = str(ngsild_params)
+        cache = entity_cache.get_entity_cache()
+        if cache is None:
+            return await self._query_entities(ngsild_params)
+        cached = cache.get_entities(ngsild_params)
+        if cached is not None:
+            return cached
+        generation = cache.generation()
+        result = await self._query_entities(ngsild_params)
+        cache.put_entities(ngsild_params, result, generation)
+        return result
+
+    @catch_httpx_exceptions(retry=CB_RETRY_POLICIES['query_entities'],
+                            breaker=cb_breaker)
+    async def _query_entities(self, ngsild_params):
+        entity_url = f"{self.api_url}:{self.api_port}/{self.url_version}entities?{ngsild_params}"
+        with cb_timeouts.measure('query_entities') as timeout:
+            response = await self._request('get', entity_url,
+                                           timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def iter_entities(self,
+                            query: NgsiLdQuery,
+                            page_size: int = None,
+                            prefetch: bool = False) -> AsyncIterator[dict]:
+        '''
+            Iterate over all entities matching query, one page at a time
+            Pages follow limit/offset, so results are not capped by the CB default page size
+            :input
+            @param query: the query, its limit and offset are overridden
+            @param page_size: entities per page, CB_PAGE_SIZE by default
+            @param prefetch: fetch the next page while the current one is consumed
+            :output
+            ngsi-ld objects
+            Raises CBQueryError when a page can not be read, only an empty page ends the results
+        '''
+        page_size = page_size or config.CB_PAGE_SIZE
+        next_page: Optional[asyncio.Task] = None
+        try:
+            offset = 0
+            page = await self.query_entities(query.page(page_size, offset))
+            while True:
+                if page is None:
+                    raise CBQueryError(
+                        f'Query {query} failed at offset {offset}')
+                if not page:
+                    return
+                offset += page_size
+                if len(page) >= page_size and prefetch:
+                    next_page = asyncio.create_task(
+                        self.query_entities(query.page(page_size, offset)))
+                for entity in page:
+                    yield entity
+                if len(page) < page_size:
+                    return
+                if next_page is not None:
+                    page, next_page = await next_page, None
+                else:
+                    page = await self.query_entities(
+                        query.page(page_size, offset))
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    @catch_httpx_exceptions(retry=CB_RETRY_POLICIES['patch_entity'],
+                            breaker=cb_breaker)
+    async def patch_entity(self, entity_id, upd_object: dict) -> dict:
+        '''
+            Upadte entity in aeriOS contiunuum
+            :input
+            @param entity_id: the id of the queried entity
+            @param upd_object: the  json object to update the entity with
+            :output
+            status code
+        '''
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}'
+        with cb_timeouts.measure('patch_entity') as timeout:
+            response = await self._request('patch', entity_url,
+                                           content=json.dumps(upd_object),
+                                           timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
+        response.raise_for_status()
+        return response.status_code
+
+    @catch_httpx_exceptions(retry=CB_RETRY_POLICIES['patch_entity_attr'],
+                            breaker=cb_breaker)
+    async def patch_entity_attr(self, entity_id, attr,
+                                upd_object: dict) -> dict:
+        '''
+            Do NOT use this one, prefer the patch above
+            Upadte entity in aeriOS contiunuum
+            :input
+            @param entity_id: the id of the queried entity
+            @attr: the attribute to be updated
+            @param upd_object: the  json object to update the entity with
+            :output
+            status code
+        '''
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}/attrs/{attr}'
+        with cb_timeouts.measure('patch_entity') as timeout:
+            response = await self._request('patch', entity_url,
+                                           content=json.dumps(upd_object),
+                                           timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
+        response.raise_for_status()
+        return response.status_code
+
+    @catch_httpx_exceptions(retry=CB_RETRY_POLICIES['create_entity'],
+                            breaker=cb_breaker)
+    async def create_entity(self, create_object: dict) -> int:
+        '''
+            Create entity in aeriOS contiunuum
+            :input
+            @param create_object: the  json object to update the entity with
+            :output
+            status code
+        '''
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities'
+        with cb_timeouts.measure('create_entity') as timeout:
+            response = await self._request('post', entity_url,
+                                           content=json.dumps(create_object),
+                                           timeout=timeout)
+        entity_cache.invalidate_entities([create_object.get('id')],
+                                         create_object.get('type'))
+        if response.status_code == 409:
+            return 409
+        response.raise_for_status()
+        return response.status_code
+
+    @catch_httpx_exceptions(retry=CB_RETRY_POLICIES['delete_entity'],
+                            breaker=cb_breaker)
+    async def delete_entity(self, entity_id) -> int:
+        '''
+            Delete entity from aeriOS contiunuum
+            :input
+            @param entity_id: the id of the entity
+            :output
+            status code
+        '''
+        if not entity_id:
+            raise ValueError("Entity ID must be provided for deletion.")
+        if not isinstance(entity_id, str):
+            raise TypeError("Entity ID must be a string.")
+        if not entity_id.startswith("urn:ngsi-ld:"):
+            entity_id = f"urn:ngsi-ld:{entity_id}"
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}'
+        with cb_timeouts.measure('delete_entity') as timeout:
+            response = await self._request('delete', entity_url,
+                                           timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.status_code
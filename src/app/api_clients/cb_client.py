@@ -2,10 +2,120 @@
  NGSI-LD REST API Client
 '''
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
 import requests
+from requests.adapters import HTTPAdapter
 from app import config
-from app.utils.decorators import catch_requests_exceptions
+from app.utils.decorators import catch_requests_exceptions, CircuitBreaker,\
+    RetryPolicy
 from app.api_clients import k8s_shim_client
+from app.api_clients import entity_cache
+from app.api_clients.adaptive_timeout import cb_timeouts
+from app.api_clients.ngsild_query import NgsiLdQuery
+
+_cb_session = None
+_cb_session_lock = threading.Lock()
+
+# One breaker for Orion-LD, shared by CBClient and AsyncCBClient
+cb_breaker = CircuitBreaker('orion-ld',
+                            error_rate=config.CB_BREAKER_ERROR_RATE,
+                            min_requests=config.CB_BREAKER_MIN_REQUESTS,
+                            window=config.CB_BREAKER_WINDOW,
+                            open_seconds=config.CB_BREAKER_OPEN_SECONDS)
+
+_idempotent_retry = RetryPolicy(attempts=config.CB_RETRY_ATTEMPTS,
+                                backoff_base=config.CB_RETRY_BACKOFF_BASE,
+                                backoff_max=config.CB_RETRY_BACKOFF_MAX)
+
+# Retry policy per CB client method, calls that are not idempotent are never retried
+CB_RETRY_POLICIES = {
+    'query_entity': _idempotent_retry,
+    'query_entities': _idempotent_retry,
+    'patch_entity': _idempotent_retry,
+    'patch_entity_attr': _idempotent_retry,
+    'create_entity': None,
+    'delete_entity': _idempotent_retry,
+    'delete_entity_attr': _idempotent_retry,
+    'batch_create': None,
+    'batch_idempotent': _idempotent_retry,
+    'subscription': None
+}
+
+
+def get_cb_session() -> requests.Session:
+    '''
+        Process wide keep-alive session towards CB.
+        Shared by all CBClient instances, so TCP/TLS handshakes
+         are paid once per pooled connection and not once per request
+    '''
+    global _cb_session
+    if _cb_session is None:
+        with _cb_session_lock:
+            if _cb_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=config.CB_POOL_CONNECTIONS,
+                                      pool_maxsize=config.CB_POOL_MAXSIZE,
+                                      pool_block=config.CB_POOL_BLOCK)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _cb_session = session
+    return _cb_session
+
+
+def close_cb_session():
+    '''
+        Close pooled connections, used on application shutdown
+    '''
+    global _cb_session
+    with _cb_session_lock:
+        if _cb_session is not None:
+            _cb_session.close()
+            _cb_session = None
+
+
+def get_cb_pool_stats() -> dict:
+    '''
+        Report connection pool usage per CB host
+        requests vs connections opened shows how often connections are reused
+    '''
+    stats = {
+        'poolConnections': config.CB_POOL_CONNECTIONS,
+        'poolMaxsize': config.CB_POOL_MAXSIZE,
+        'poolBlock': config.CB_POOL_BLOCK,
+        'hosts': []
+    }
+    session = _cb_session
+    if session is None:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['hosts'].append({
+                'host': f'{key.key_scheme}://{pool.host}:{pool.port}',
+                'requests': pool.num_requests,
+                'connectionsOpened': pool.num_connections,
+                'idleConnections': sum(1 for conn in list(pool.pool.queue)
+                                       if conn is not None) if pool.pool else 0
+            })
+    return stats
+
+
+class CBQueryError(Exception):
+    '''
+        A page of a paged query failed, the results read so far are incomplete
+    '''
+
+
+def _batch_entity_id(entity) -> str:
+    '''
+        Batch payloads are entities for create/upsert/update and plain ids for delete
+    '''
+    return entity.get('id') if isinstance(entity, dict) else entity
 
 
 class CBClient:
@@ -22,6 +132,7 @@ class CBClient:
         self.api_url = config.CB_URL
         self.api_port = config.CB_PORT
         self.url_version = config.URL_VERSION
+        self.session = get_cb_session()
         self.m2m_cb_token = k8s_shim_client.get_m2m_cb_token()
         self.headers = {
             'Content-Type': 'application/json',
@@ -30,36 +141,126 @@ class CBClient:
             'Authorization': f'Bearer {self.m2m_cb_token}'
         }
 
-    @catch_requests_exceptions
-    def query_entity(self, entity_id, ngsild_params) -> dict:
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
         '''
-            Query entity with ngsi-ld params
+            Send request to CB with the m2m token
+            A 401 means the token was revoked or rotated before its expiry:
+              the cached token is dropped and the request is sent once more with a fresh one
+        '''
+        response = self.session.request(method, url, headers=self.headers, **kwargs)
+        if response.status_code == 401:
+            self._renew_token()
+            response = self.session.request(method, url, headers=self.headers, **kwargs)
+        return response
+
+    def _renew_token(self):
+        k8s_shim_client.cb_token_cache.invalidate(self.m2m_cb_token)
+        self.m2m_cb_token = k8s_shim_client.get_m2m_cb_token()
+        self.headers['Authorization'] = f'Bearer {self.m2m_cb_token}'
+
+    def query_entity(self, entity_id,
+                     ngsild_params: str | NgsiLdQuery) -> dict:
+        '''
+            Query entity with ngsi-ld params, served from the entity cache when enabled
             :input
             @param entity_id: the id of the queried entity
-            @param ngsi-ld: the query params
+            @param ngsi-ld: the query params, string or NgsiLdQuery
             :output
             ngsi-ld object
         '''
+        ngsild_params = str(ngsild_params)
+        cache = entity_cache.get_entity_cache()
+        if cache is None:
+            return self._query_entity(entity_id, ngsild_params)
+        cached = cache.get_entity(entity_id, ngsild_params)
+        if cached is not None:
+            return cached
+        generation = cache.generation()
+        result = self._query_entity(entity_id, ngsild_params)
+        cache.put_entity(entity_id, ngsild_params, result, generation)
+        return result
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['query_entity'],
+                               breaker=cb_breaker)
+    def _query_entity(self, entity_id, ngsild_params) -> dict:
         entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}?{ngsild_params}'
-        response = requests.get(entity_url, headers=self.headers, timeout=15)
+        with cb_timeouts.measure('query_entity') as timeout:
+            response = self._request('get', entity_url, timeout=timeout)
         response.raise_for_status()
         return response.json()
 
-    @catch_requests_exceptions
-    def query_entities(self, ngsild_params):
+    def query_entities(self, ngsild_params: str | NgsiLdQuery):
         '''
-            Query entities with ngsi-ld params
+            Query entities with ngsi-ld params, served from the entity cache when enabled
             :input
-            @param ngsi-ld: the query params
+            @param ngsi-ld: the query params, string or NgsiLdQuery
             :output
             ngsi-ld object
         '''
+        ngsild_params = str(ngsild_params)
+        cache = entity_cache.get_entity_cache()
+        if cache is None:
+            return self._query_entities(ngsild_params)
+        cached = cache.get_entities(ngsild_params)
+        if cached is not None:
+            return cached
+        generation = cache.generation()
+        result = self._query_entities(ngsild_params)
+        cache.put_entities(ngsild_params, result, generation)
+        return result
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['query_entities'],
+                               breaker=cb_breaker)
+    def _query_entities(self, ngsild_params):
         entity_url = f"{self.api_url}:{self.api_port}/{self.url_version}entities?{ngsild_params}"
-        response = requests.get(entity_url, headers=self.headers, timeout=15)
+        with cb_timeouts.measure('query_entities') as timeout:
+            response = self._request('get', entity_url, timeout=timeout)
         response.raise_for_status()
         return response.json()
 
-    @catch_requests_exceptions
+    def iter_entities(self,
+                      query: NgsiLdQuery,
+                      page_size: int = None,
+                      prefetch: bool = False) -> Iterator[dict]:
+        '''
+            Iterate over all entities matching query, one page at a time
+            Pages follow limit/offset, so results are not capped by the CB default page size
+            and only one (two with prefetch) page is held in memory
+            :input
+            @param query: the query, its limit and offset are overridden
+            @param page_size: entities per page, CB_PAGE_SIZE by default
+            @param prefetch: fetch the next page while the current one is consumed
+            :output
+            ngsi-ld objects
+            Raises CBQueryError when a page can not be read, only an empty page ends the results
+        '''
+        page_size = page_size or config.CB_PAGE_SIZE
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            offset = 0
+            page = self.query_entities(query.page(page_size, offset))
+            while True:
+                if page is None:
+                    raise CBQueryError(
+                        f'Query {query} failed at offset {offset}')
+                if not page:
+                    return
+                offset += page_size
+                next_page = None
+                if len(page) >= page_size and executor is not None:
+                    next_page = executor.submit(self.query_entities,
+                                                query.page(page_size, offset))
+                yield from page
+                if len(page) < page_size:
+                    return
+                page = next_page.result() if next_page is not None \
+                    else self.query_entities(query.page(page_size, offset))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['patch_entity'],
+                               breaker=cb_breaker)
     def patch_entity(self, entity_id, upd_object: dict) -> dict:
         '''
             Upadte entity in aeriOS contiunuum
@@ -72,14 +273,16 @@ class CBClient:
         entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}'
         # print(entity_url)
         # print(upd_object)
-        response = requests.patch(entity_url,
-                                  headers=self.headers,
-                                  data=json.dumps(upd_object),
-                                  timeout=1)
+        with cb_timeouts.measure('patch_entity') as timeout:
+            response = self._request('patch', entity_url,
+                                     data=json.dumps(upd_object),
+                                     timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
         response.raise_for_status()
         return response.status_code
 
-    @catch_requests_exceptions
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['patch_entity_attr'],
+                               breaker=cb_breaker)
     def patch_entity_attr(self, entity_id, attr, upd_object: dict) -> dict:
         '''
             Do NOT use this one, prefer the patch above
@@ -92,14 +295,16 @@ class CBClient:
             
         '''
         entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}/attrs/{attr}'
-        response = requests.patch(entity_url,
-                                  headers=self.headers,
-                                  data=json.dumps(upd_object),
-                                  timeout=15)
+        with cb_timeouts.measure('patch_entity') as timeout:
+            response = self._request('patch', entity_url,
+                                     data=json.dumps(upd_object),
+                                     timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
         response.raise_for_status()
         return response.status_code
 
-    @catch_requests_exceptions
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['create_entity'],
+                               breaker=cb_breaker)
     def create_entity(self, create_object: dict) -> int:
         '''
             Create entity in aeriOS contiunuum
@@ -110,17 +315,20 @@ class CBClient:
         '''
         entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities'
 
-        response = requests.post(entity_url,
-                                 headers=self.headers,
-                                 data=json.dumps(create_object),
-                                 timeout=1)
+        with cb_timeouts.measure('create_entity') as timeout:
+            response = self._request('post', entity_url,
+                                     data=json.dumps(create_object),
+                                     timeout=timeout)
+        entity_cache.invalidate_entities([create_object.get('id')],
+                                         create_object.get('type'))
         if response.status_code == 409:
             #FIXME: Service exists, check service components status
             return 409
         response.raise_for_status()
         return response.status_code
 
-    @catch_requests_exceptions
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['delete_entity'],
+                               breaker=cb_breaker)
     def delete_entity(self, entity_id) -> int:
         '''
             Upadte entity in aeriOS contiunuum
@@ -130,12 +338,195 @@ class CBClient:
             :output
             
         '''
-        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}'
         if not entity_id:
             raise ValueError("Entity ID must be provided for deletion.")
         if not isinstance(entity_id, str):
             raise TypeError("Entity ID must be a string.")
         if not entity_id.startswith("urn:ngsi-ld:"):
             entity_id = f"urn:ngsi-ld:{entity_id}"
-        response = requests.delete(entity_url, headers=self.headers, timeout=1)
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}'
+        with cb_timeouts.measure('delete_entity') as timeout:
+            response = self._request('delete', entity_url, timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.status_code
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['delete_entity_attr'],
+                               breaker=cb_breaker)
+    def delete_entity_attr(self, entity_id, attr) -> int:
+        '''
+            Delete an attribute of an entity in aeriOS contiunuum,
+            an upsert with options=update can not remove attributes
+            :input
+            @param entity_id: the id of the entity
+            @param attr: the attribute to delete
+            :output
+            status code, 404 when the entity or attribute does not exist
+        '''
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entities/{entity_id}/attrs/{attr}'
+        with cb_timeouts.measure('delete_entity') as timeout:
+            response = self._request('delete', entity_url, timeout=timeout)
+        entity_cache.invalidate_entities([entity_id])
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.status_code
+
+    def batch_create(self, entities: List[dict]) -> dict:
+        '''
+            Create entities in aeriOS contiunuum with /entityOperations/create
+            :input
+            @param entities: list of ngsi-ld entities, chunked by CB_BATCH_SIZE
+            :output
+            {"success": [entity ids], "errors": [{"entityId": .., "error": {..}}]}
+        '''
+        return self._batch_operation('create', entities)
+
+    def batch_upsert(self, entities: List[dict], options: str = None) -> dict:
+        '''
+            Create or update entities with /entityOperations/upsert
+            :input
+            @param entities: list of ngsi-ld entities, chunked by CB_BATCH_SIZE
+            @param options: "update" to merge attributes, default replaces entities
+            :output
+            {"success": [entity ids], "errors": [{"entityId": .., "error": {..}}]}
+        '''
+        return self._batch_operation('upsert', entities, options=options)
+
+    def batch_update(self, entities: List[dict], options: str = None) -> dict:
+        '''
+            Update attributes of existing entities with /entityOperations/update
+            :input
+            @param entities: list of entity fragments with id, type and the attributes to set
+            @param options: noOverwrite to keep existing attribute values
+            :output
+            {"success": [entity ids], "errors": [{"entityId": .., "error": {..}}]}
+        '''
+        return self._batch_operation('update', entities, options=options)
+
+    def batch_delete(self, entity_ids: List[str]) -> dict:
+        '''
+            Delete entities with /entityOperations/delete
+            :input
+            @param entity_ids: list of entity ids, chunked by CB_BATCH_SIZE
+            :output
+            {"success": [entity ids], "errors": [{"entityId": .., "error": {..}}]}
+        '''
+        return self._batch_operation('delete', entity_ids)
+
+    def _batch_operation(self,
+                         operation: str,
+                         payload: list,
+                         options: str = None) -> dict:
+        '''
+            Split payload in chunks and merge per entity results of all chunks
+        '''
+        result = {'success': [], 'errors': []}
+        for start in range(0, len(payload), config.CB_BATCH_SIZE):
+            chunk = payload[start:start + config.CB_BATCH_SIZE]
+            post_chunk = self._post_batch_chunk if operation == 'create' \
+                else self._post_idempotent_batch_chunk
+            chunk_result = post_chunk(operation, chunk, options)
+            if chunk_result is None:
+                # Whole request failed, report every entity of the chunk
+                result['errors'].extend({
+                    'entityId': _batch_entity_id(entity),
+                    'error': {
+                        'title': f'Batch {operation} request failed'
+                    }
+                } for entity in chunk)
+                continue
+            result['success'].extend(chunk_result['success'])
+            result['errors'].extend(chunk_result['errors'])
+        entity_cache.invalidate_entities(
+            _batch_entity_id(entity) for entity in payload)
+        return result
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['batch_create'],
+                               breaker=cb_breaker)
+    def _post_batch_chunk(self, operation: str, chunk: list,
+                          options: Optional[str]) -> dict:
+        '''
+            POST one chunk to /entityOperations/{operation}
+        '''
+        return self._send_batch_chunk(operation, chunk, options)
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['batch_idempotent'],
+                               breaker=cb_breaker)
+    def _post_idempotent_batch_chunk(self, operation: str, chunk: list,
+                                     options: Optional[str]) -> dict:
+        '''
+            POST one chunk of an idempotent operation (update, upsert, delete),
+            retried on transient failures
+        '''
+        return self._send_batch_chunk(operation, chunk, options)
+
+    def _send_batch_chunk(self, operation: str, chunk: list,
+                          options: Optional[str]) -> dict:
+        '''
+            POST one chunk to /entityOperations/{operation}
+            207 Multi-Status carries per entity success and errors
+        '''
+        entity_url = f'{self.api_url}:{self.api_port}/{self.url_version}entityOperations/{operation}'
+        if options:
+            entity_url += f'?options={options}'
+        with cb_timeouts.measure('batch') as timeout:
+            response = self._request('post', entity_url,
+                                     data=json.dumps(chunk),
+                                     timeout=timeout)
+        if response.status_code == 207:
+            body = response.json()
+            return {
+                'success': body.get('success', []),
+                'errors': body.get('errors', [])
+            }
+        response.raise_for_status()
+        return {
+            'success': [_batch_entity_id(entity) for entity in chunk],
+            'errors': []
+        }
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['subscription'],
+                               breaker=cb_breaker)
+    def create_subscription(self, subscription: dict) -> int:
+        '''
+            Create NGSI-LD subscription, update it when it already exists
+            :input
+            @param subscription: the json subscription object, with its id
+            :output
+            status code
+        '''
+        subscription_url = f'{self.api_url}:{self.api_port}/{self.url_version}subscriptions'
+        with cb_timeouts.measure('subscription') as timeout:
+            response = self._request('post', subscription_url,
+                                     data=json.dumps(subscription),
+                                     timeout=timeout)
+        if response.status_code == 409:
+            update = {
+                key: value
+                for key, value in subscription.items() if key not in ('id', 'type')
+            }
+            with cb_timeouts.measure('subscription') as timeout:
+                response = self._request(
+                    'patch',
+                    f"{subscription_url}/{subscription['id']}",
+                    data=json.dumps(update),
+                    timeout=timeout)
+        response.raise_for_status()
+        return response.status_code
+
+    @catch_requests_exceptions(retry=CB_RETRY_POLICIES['subscription'],
+                               breaker=cb_breaker)
+    def delete_subscription(self, subscription_id: str) -> int:
+        '''
+            Delete NGSI-LD subscription
+            :input
+            @param subscription_id: the id of the subscription
+            :output
+            status code
+        '''
+        subscription_url = f'{self.api_url}:{self.api_port}/{self.url_version}subscriptions/{subscription_id}'
+        with cb_timeouts.measure('subscription') as timeout:
+            response = self._request('delete', subscription_url,
+                                     timeout=timeout)
         return response.status_code
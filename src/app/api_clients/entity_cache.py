@@ -0,0 +1,239 @@
+'''
+ Read-through cache of NGSI-LD query results
+ Shared by CBClient and AsyncCBClient, entries expire after a per entity type TTL,
+   least recently used ones are evicted and writes done by this process invalidate them
+'''
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+from urllib.parse import parse_qs
+from app import config
+
+_ENTITY = 'entity'
+_ENTITIES = 'entities'
+
+
+class _CacheEntry:
+    '''
+        Cached query result with the entity type and ids it holds
+    '''
+    __slots__ = ('value', 'expires_at', 'entity_type', 'entity_ids')
+
+    def __init__(self, value, expires_at: float, entity_type: Optional[str],
+                 entity_ids: Set[str]):
+        self.value = value
+        self.expires_at = expires_at
+        self.entity_type = entity_type
+        self.entity_ids = entity_ids
+
+
+def _result_ids(value) -> Set[str]:
+    if isinstance(value, dict):
+        return {value.get('id')} if value.get('id') else set()
+    if isinstance(value, list):
+        return {
+            entity.get('id')
+            for entity in value if isinstance(entity, dict) and entity.get('id')
+        }
+    return set()
+
+
+def _params_type(ngsild_params: str) -> Optional[str]:
+    types = parse_qs(ngsild_params or '').get('type')
+    return types[0] if types else None
+
+
+class EntityCache:
+    '''
+        LRU of query_entity / query_entities results
+        keyed by the entity id (if any) and the ngsi-ld params of the query
+    '''
+
+    def __init__(self,
+                 max_entries: int = config.CB_CACHE_MAX_ENTRIES,
+                 default_ttl: float = config.CB_CACHE_DEFAULT_TTL,
+                 ttls: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = dict(config.CB_CACHE_TTLS if ttls is None else ttls)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, _CacheEntry]" = OrderedDict()
+        # Type of entities seen in results, to find the lists a write affects
+        self._id_types: Dict[str, str] = {}
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._generation = 0
+
+    def ttl_for(self, entity_type: Optional[str]) -> float:
+        '''
+            TTL of entity type, 0 disables caching for it
+        '''
+        return self.ttls.get(entity_type, self.default_ttl)
+
+    def generation(self) -> int:
+        '''
+            Taken before a CB read and handed to put_*,
+            a result read while a write invalidated the cache is not stored
+        '''
+        with self._lock:
+            return self._generation
+
+    def get_entity(self, entity_id: str, ngsild_params: str):
+        '''
+            Cached query_entity result or None
+        '''
+        return self._get((_ENTITY, entity_id, ngsild_params))
+
+    def put_entity(self, entity_id: str, ngsild_params: str, value,
+                   generation: int):
+        '''
+            Cache query_entity result
+        '''
+        entity_type = value.get('type') if isinstance(value, dict) else None
+        self._put((_ENTITY, entity_id, ngsild_params), value, entity_type,
+                  generation)
+
+    def get_entities(self, ngsild_params: str):
+        '''
+            Cached query_entities result or None
+        '''
+        return self._get((_ENTITIES, None, ngsild_params))
+
+    def put_entities(self, ngsild_params: str, value, generation: int):
+        '''
+            Cache query_entities result
+        '''
+        self._put((_ENTITIES, None, ngsild_params), value,
+                  _params_type(ngsild_params), generation)
+
+    def invalidate(self, entity_ids: Iterable[str], entity_type: str = None):
+        '''
+            Drop entries of written entities
+            and every list that holds them or may now match them
+        '''
+        entity_ids = set(entity_ids)
+        with self._lock:
+            self._generation += 1
+            types = {entity_type} if entity_type else set()
+            unknown_type = False
+            for entity_id in entity_ids:
+                known = self._id_types.pop(entity_id, None)
+                if known:
+                    types.add(known)
+                elif not entity_type:
+                    unknown_type = True
+            for key in list(self._entries.keys()):
+                entry = self._entries[key]
+                if key[0] == _ENTITY:
+                    stale = key[1] in entity_ids
+                else:
+                    # A written attribute may change which entities a filtered list matches
+                    stale = (unknown_type or entry.entity_type is None
+                             or entry.entity_type in types
+                             or not entity_ids.isdisjoint(entry.entity_ids))
+                if stale:
+                    del self._entries[key]
+                    self._invalidations += 1
+
+    def clear(self):
+        '''
+            Drop all entries
+        '''
+        with self._lock:
+            self._generation += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._id_types.clear()
+
+    def stats(self) -> dict:
+        '''
+            Hit/miss counters and size
+        '''
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': config.CB_CACHE_ENABLED,
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRatio': self._hits / lookups if lookups else 0,
+                'invalidations': self._invalidations,
+                'defaultTtl': self.default_ttl,
+                'ttls': self.ttls
+            }
+
+    def _get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            value = entry.value
+        # Callers may modify what they get
+        return copy.deepcopy(value)
+
+    def _put(self, key: tuple, value, entity_type: Optional[str],
+             generation: int):
+        ttl = self.ttl_for(entity_type)
+        if value is None or ttl <= 0:
+            return
+        entity_ids = _result_ids(value)
+        entry = _CacheEntry(copy.deepcopy(value), time.monotonic() + ttl,
+                            entity_type, entity_ids)
+        with self._lock:
+            if generation != self._generation:
+                return
+            if entity_type:
+                for entity_id in entity_ids:
+                    self._id_types[entity_id] = entity_type
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if len(self._id_types) > 10 * self.max_entries:
+                self._id_types.clear()
+
+
+_entity_cache: Optional[EntityCache] = None
+_entity_cache_lock = threading.Lock()
+
+
+def get_entity_cache() -> Optional[EntityCache]:
+    '''
+        Process wide entity cache, None when CB_CACHE_ENABLED is false
+    '''
+    global _entity_cache
+    if not config.CB_CACHE_ENABLED:
+        return None
+    if _entity_cache is None:
+        with _entity_cache_lock:
+            if _entity_cache is None:
+                _entity_cache = EntityCache()
+    return _entity_cache
+
+
+def get_entity_cache_stats() -> dict:
+    '''
+        Cache counters, for the admin endpoint
+    '''
+    cache = get_entity_cache()
+    if cache is None:
+        return {'enabled': False}
+    return cache.stats()
+
+
+def invalidate_entities(entity_ids: Iterable[str], entity_type: str = None):
+    '''
+        Invalidate cached results after a write, no-op when the cache is disabled
+    '''
+    cache = get_entity_cache()
+    if cache is not None:
+        cache.invalidate(entity_ids, entity_type)
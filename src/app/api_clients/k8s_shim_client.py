@@ -1,22 +1,147 @@
 '''
 Module to query aeriOS service for retrieving token for m2m communication.
-Used when accessing CB, even when accessing it internally 
+Used when accessing CB, even when accessing it internally
    as this is used to propagate federation requests to other Orion-LD brokers
-Used also for accessing Deployment engine local allocation manager 
+Used also for accessing Deployment engine local allocation manager
    for submitting final pod placements
+Tokens are cached until shortly before their JWT expiry and refreshed in the background,
+   so fetching a token is not on the per-request path
 '''
+import base64
+import json
+import threading
+import time
+from typing import Callable, Optional
 import requests
 from app.utils.decorators import catch_requests_exceptions
 from app.utils.log import get_app_logger
-from app.config import TOKEN_URL
+from app.config import TOKEN_URL, TOKEN_REFRESH_MARGIN, TOKEN_DEFAULT_TTL,\
+    TOKEN_FETCH_TIMEOUT
 
 logger = get_app_logger()
 
 
+def get_token_expiry(token: str) -> Optional[float]:
+    '''
+    Read the exp claim (epoch seconds) of a JWT, signature is not verified
+    Return None if token is not a JWT or has no exp claim
+    '''
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class M2MTokenCache:
+    '''
+    Cache for an m2m token.
+    Token is refreshed by a background timer ahead of its expiry.
+    Concurrent refreshes are coalesced into one call to the shim (single-flight),
+      callers only wait when there is no valid token at all.
+    '''
+
+    def __init__(self, name: str, fetch: Callable[[], Optional[str]]):
+        self.name = name
+        self._fetch = fetch
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+        self._inflight: Optional[threading.Event] = None
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self) -> Optional[str]:
+        '''
+        Return cached token, fetch it only if missing or expired
+        '''
+        return self.peek() or self.refresh(wait=True)
+
+    def peek(self) -> Optional[str]:
+        '''
+        Return cached token if still valid, never waits on the shim
+        None means get() would have to fetch it
+        '''
+        now = time.time()
+        token = self._token
+        if token and now < self._refresh_at:
+            return token
+        if token and now < self._expires_at:
+            # Still valid but inside the refresh margin, serve it and refresh aside
+            self.refresh(wait=False)
+            return token
+        return None
+
+    def refresh(self, wait: bool = True) -> Optional[str]:
+        '''
+        Refresh the token, joining an in-flight refresh if there is one
+        '''
+        with self._lock:
+            event = self._inflight
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+        if leader:
+            if wait:
+                self._do_refresh(event)
+            else:
+                threading.Thread(target=self._do_refresh,
+                                 args=(event, ),
+                                 name=f'{self.name}-token-refresh',
+                                 daemon=True).start()
+        elif wait:
+            event.wait(TOKEN_FETCH_TIMEOUT)
+        return self._token
+
+    def invalidate(self, token: Optional[str] = None):
+        '''
+        Drop the cached token, e.g. after CB rejected it
+        With token, only drop it if it is still the cached one,
+          so concurrent 401s on the same token do not discard its fresh replacement
+        '''
+        with self._lock:
+            if token is not None and token != self._token:
+                return
+            self._token = None
+            self._expires_at = self._refresh_at = 0.0
+
+    def _do_refresh(self, event: threading.Event):
+        try:
+            token = self._fetch()
+            if token:
+                now = time.time()
+                expires_at = get_token_expiry(token) or now + TOKEN_DEFAULT_TTL
+                lifetime = max(expires_at - now, 0.0)
+                self._token = token
+                self._expires_at = expires_at
+                self._refresh_at = expires_at - min(TOKEN_REFRESH_MARGIN,
+                                                    lifetime / 2)
+                self._schedule(self._refresh_at - now)
+            else:
+                logger.error("Could not refresh %s m2m token", self.name)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Could not refresh %s m2m token: %s", self.name, e)
+        finally:
+            with self._lock:
+                self._inflight = None
+            event.set()
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, 0.0),
+                                      self.refresh,
+                                      kwargs={'wait': True})
+        self._timer.daemon = True
+        self._timer.start()
+
+
 @catch_requests_exceptions
-def get_m2m_cb_token():
+def fetch_m2m_cb_token():
     '''
-    Get m2m token for Orion-LD queries
+    Fetch m2m token for Orion-LD queries from the shim
     '''
     url = f"{TOKEN_URL}/cb"
 
@@ -38,9 +163,9 @@ def get_m2m_cb_token():
         return None
 
 
-def get_m2m_hlo_token():
+def fetch_m2m_hlo_token():
     '''
-    Get m2m token for HLO Local Allocation Engine queries
+    Fetch m2m token for HLO Local Allocation Engine queries from the shim
     '''
     url = f"{TOKEN_URL}/hlo"
 
@@ -50,9 +175,6 @@ def get_m2m_hlo_token():
     # Raise an exception for HTTP errors
     response.raise_for_status()
 
-    # Raise an exception for HTTP errors
-    response.raise_for_status()
-
     # Parse the JSON response from the server
     token_data = response.json()
     token_value = token_data.get("token")
@@ -63,3 +185,21 @@ def get_m2m_hlo_token():
     else:
         logger.info("Token value not found in response.")
         return None
+
+
+cb_token_cache = M2MTokenCache('cb', fetch_m2m_cb_token)
+hlo_token_cache = M2MTokenCache('hlo', fetch_m2m_hlo_token)
+
+
+def get_m2m_cb_token():
+    '''
+    Get (cached) m2m token for Orion-LD queries
+    '''
+    return cb_token_cache.get()
+
+
+def get_m2m_hlo_token():
+    '''
+    Get (cached) m2m token for HLO Local Allocation Engine queries
+    '''
+    return hlo_token_cache.get()
@@ -0,0 +1,104 @@
+'''
+ NGSI-LD query builder
+ Builds the url params of GET /entities and /entities/{id}:
+   type, id list, attrs projection, q filters, limit/offset, count, format and local,
+   with proper URL encoding of q values
+'''
+import json
+from typing import Iterable, List, Optional
+from urllib.parse import quote, urlencode
+
+
+class NgsiLdQuery:
+    '''
+        NGSI-LD query params
+        NgsiLdQuery(entity_type='ServiceComponent', attrs=['serviceComponentStatus'])
+            .where('service', service_id)
+    '''
+
+    def __init__(self,
+                 entity_type: Optional[str] = None,
+                 ids: Optional[Iterable[str]] = None,
+                 attrs: Optional[Iterable[str]] = None,
+                 q: Optional[str] = None,
+                 limit: Optional[int] = None,
+                 offset: Optional[int] = None,
+                 count: bool = False,
+                 format: Optional[str] = 'simplified',  # pylint: disable=redefined-builtin
+                 local: bool = False):
+        self.entity_type = entity_type
+        self.ids: List[str] = list(ids or [])
+        self.attrs: List[str] = list(attrs or [])
+        self.q_terms: List[str] = [q] if q else []
+        self.limit = limit
+        self.offset = offset
+        self.count = count
+        self.format = format
+        self.local = local
+
+    def where(self, attr: str, value, op: str = '==') -> 'NgsiLdQuery':
+        '''
+            Add q filter term, terms are ANDed
+            String values are quoted and escaped, numbers and booleans are not
+        '''
+        if isinstance(value, str):
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            value = 'true' if value else 'false'
+        self.q_terms.append(f'{attr}{op}{value}')
+        return self
+
+    def page(self, limit: int, offset: int = 0) -> 'NgsiLdQuery':
+        '''
+            Copy of the query restricted to one page
+        '''
+        query = self.copy()
+        query.limit = limit
+        query.offset = offset
+        return query
+
+    def copy(self) -> 'NgsiLdQuery':
+        '''
+            Independent copy of the query
+        '''
+        query = NgsiLdQuery(entity_type=self.entity_type,
+                            ids=self.ids,
+                            attrs=self.attrs,
+                            limit=self.limit,
+                            offset=self.offset,
+                            count=self.count,
+                            format=self.format,
+                            local=self.local)
+        query.q_terms = list(self.q_terms)
+        return query
+
+    def to_params(self) -> str:
+        '''
+            URL encoded query string, without leading ?
+        '''
+        params = []
+        if self.entity_type:
+            params.append(('type', self.entity_type))
+        if self.ids:
+            params.append(('id', ','.join(self.ids)))
+        if self.attrs:
+            params.append(('attrs', ','.join(self.attrs)))
+        if self.q_terms:
+            params.append(('q', ';'.join(self.q_terms)))
+        if self.limit is not None:
+            params.append(('limit', str(self.limit)))
+        if self.offset is not None:
+            params.append(('offset', str(self.offset)))
+        if self.count:
+            params.append(('count', 'true'))
+        if self.format:
+            params.append(('format', self.format))
+        if self.local:
+            params.append(('local', 'true'))
+        return urlencode(params, safe=':,', quote_via=quote)
+
+    def __str__(self) -> str:
+        return self.to_params()
+
+    def __repr__(self) -> str:
+        return f'NgsiLdQuery({self.to_params()})'
@@ -1,6 +1,6 @@
 """ Module with all aeriOS continumm models in pydantic"""
-from typing import List, Literal, Optional
-from pydantic import BaseModel
+from typing import Iterable, List, Literal, Optional
+from pydantic import BaseModel, field_validator
 
 
 class Area(BaseModel):
@@ -213,3 +213,51 @@ class ServiceStatusResponse(BaseModel):
     id: str
     type: str
     serviceComponentStatus: str
+
+
+class ServiceComponentSnapshot(BaseModel):
+    """
+    Status view of a Service Component, part of a ServiceSnapshot
+    """
+    id: str
+    serviceComponentStatus: Optional[str] = None
+    infrastructureElementRequirements: Optional[str] = None
+    networkPorts: List[str] = []
+
+    @field_validator("networkPorts", mode="before")
+    @classmethod
+    def normalize_ports_to_list(cls, v):
+        if v is None:
+            return []
+        if isinstance(v, str):
+            return [v]
+        return v
+
+
+class ServiceSnapshot(BaseModel):
+    """
+    In-memory view of a Service and the status of all its Service Components.
+    Fetched once (service query + components query) and reused by a whole flow,
+      so status checks cost O(1) CB round trips instead of O(components)
+    """
+    id: str
+    actionType: Optional[str] = None
+    domainHandler: Optional[str] = None
+    components: List[ServiceComponentSnapshot] = []
+
+    def component_ids(self) -> List[str]:
+        """
+        Ids of all service components
+        """
+        return [scomponent.id for scomponent in self.components]
+
+    def components_in(
+            self, statuses: Iterable[str]) -> List[ServiceComponentSnapshot]:
+        """
+        Service components currently in one of statuses
+        """
+        statuses = set(statuses)
+        return [
+            scomponent for scomponent in self.components
+            if scomponent.serviceComponentStatus in statuses
+        ]
@@ -0,0 +1,35 @@
+""" Module with allocation job models in pydantic"""
+from typing import Any, Optional
+from pydantic import BaseModel
+
+
+class JobStatusEnum:
+    """
+    Allocation job status representation
+    """
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
+class JobStatusResponse(BaseModel):
+    """
+    Response model for allocation job status
+    """
+    jobId: str
+    name: str
+    serviceId: Optional[str] = None
+    status: str
+    createdAt: float
+    startedAt: Optional[float] = None
+    finishedAt: Optional[float] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+
+
+class JobNotFound(BaseModel):
+    '''
+    Response model for unknown job id
+    '''
+    detail: str = "Job not found"
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: tosca.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+from . import hlo_pb2 as hlo__pb2
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0btosca.proto\x1a\thlo.proto\"D\n\x14ToscaFloatComparison\x12\x1a\n\rless_or_equal\x18\x01 \x01(\x01H\x00\x88\x01\x01\x42\x10\n\x0e_less_or_equal\"i\n\x15ToscaStringComparison\x12\x12\n\x05\x65qual\x18\x01 \x01(\tH\x00\x88\x01\x01\x12\x1d\n\x10greater_or_equal\x18\x02 \x01(\tH\x01\x88\x01\x01\x42\x08\n\x06_equalB\x13\n\x11_greater_or_equal\"3\n\x13ToscaBoolComparison\x12\x12\n\x05\x65qual\x18\x01 \x01(\x08H\x00\x88\x01\x01\x42\x08\n\x06_equal\"\x1c\n\nToscaPoint\x12\x0e\n\x06values\x18\x01 \x03(\x01\"-\n\tToscaArea\x12 \n\x0b\x63oordinates\x18\x01 \x03(\x0b\x32\x0b.ToscaPoint\"\xe8\x02\n\x13ToscaHostProperties\x12(\n\tcpu_usage\x18\x01 \x01(\x0b\x32\x15.ToscaFloatComparison\x12(\n\x08\x63pu_arch\x18\x02 \x01(\x0b\x32\x16.ToscaStringComparison\x12(\n\x08mem_size\x18\x03 \x01(\x0b\x32\x16.ToscaStringComparison\x12&\n\x08realtime\x18\x04 \x01(\x0b\x32\x14.ToscaBoolComparison\x12\x1d\n\x04\x61rea\x18\x05 \x01(\x0b\x32\n.ToscaAreaH\x00\x88\x01\x01\x12\x31\n\x11\x65nergy_efficiency\x18\x06 \x01(\x0b\x32\x16.ToscaStringComparison\x12%\n\x05green\x18\x07 \x01(\x0b\x32\x16.ToscaStringComparison\x12)\n\tdomain_id\x18\x08 \x01(\x0b\x32\x16.ToscaStringComparisonB\x07\n\x05_area\"?\n\x13ToscaHostCapability\x12(\n\nproperties\x18\x01 \x01(\x0b\x32\x14.ToscaHostProperties\"\x9a\x01\n\x11ToscaCapabilities\x12:\n\x0c\x63\x61pabilities\x18\x01 \x03(\x0b\x32$.ToscaCapabilities.CapabilitiesEntry\x1aI\n\x11\x43\x61pabilitiesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12#\n\x05value\x18\x02 \x01(\x0b\x32\x14.ToscaHostCapability:\x02\x38\x01\"!\n\x0fToscaStringList\x12\x0e\n\x06values\x18\x01 \x03(\t\"\xb6\x01\n\x0fToscaNodeFilter\x12\x34\n\nproperties\x18\x01 \x03(\x0b\x32 .ToscaNodeFilter.PropertiesEntry\x12(\n\x0c\x63\x61pabilities\x18\x02 \x03(\x0b\x32\x12.ToscaCapabilities\x1a\x43\n\x0fPropertiesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x1f\n\x05value\x18\x02 \x01(\x0b\x32\x10.ToscaStringList:\x02\x38\x01\"=\n\x14ToscaHostRequirement\x12%\n\x0bnode_filter\x18\x01 \x01(\x0b\x32\x10.ToscaNodeFilter\"7\n\x13ToscaPortProperties\x12\x10\n\x08protocol\x18\x01 \x03(\t\x12\x0e\n\x06source\x18\x02 \x01(\x05\"<\n\x10ToscaExposedPort\x12(\n\nproperties\x18\x01 \x01(\x0b\x32\x14.ToscaPortProperties\"\xb6\x01\n\x16ToscaNetworkProperties\x12\x31\n\x05ports\x18\x01 \x03(\x0b\x32\".ToscaNetworkProperties.PortsEntry\x12\x18\n\x0b\x65xposePorts\x18\x02 \x01(\x08H\x00\x88\x01\x01\x1a?\n\nPortsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12 \n\x05value\x18\x02 \x01(\x0b\x32\x11.ToscaExposedPort:\x02\x38\x01\x42\x0e\n\x0c_exposePorts\"F\n\x17ToscaNetworkRequirement\x12+\n\nproperties\x18\x01 \x01(\x0b\x32\x17.ToscaNetworkProperties\"u\n\x10ToscaRequirement\x12%\n\x04host\x18\x01 \x01(\x0b\x32\x15.ToscaHostRequirementH\x00\x12+\n\x07network\x18\x02 \x01(\x0b\x32\x18.ToscaNetworkRequirementH\x00\x42\r\n\x0brequirement\"\x9a\x01\n\rToscaArtifact\x12\x0c\n\x04\x66ile\x18\x01 \x01(\t\x12\x0c\n\x04type\x18\x02 \x01(\t\x12\x12\n\nrepository\x18\x03 \x01(\t\x12\x11\n\tisPrivate\x18\x04 \x01(\x08\x12\x15\n\x08username\x18\x05 \x01(\tH\x00\x88\x01\x01\x12\x15\n\x08password\x18\x06 \x01(\tH\x01\x88\x01\x01\x42\x0b\n\t_usernameB\x0b\n\t_password\"k\n\x11ToscaCreateInputs\x12*\n\x07\x63liArgs\x18\x01 \x03(\x0b\x32\x19.ServiceComponentKeyValue\x12*\n\x07\x65nvVars\x18\x02 \x03(\x0b\x32\x19.ServiceComponentKeyValue\"R\n\x14ToscaCreateOperation\x12\x16\n\x0eimplementation\x18\x01 \x01(\t\x12\"\n\x06inputs\x18\x02 \x01(\x0b\x32\x12.ToscaCreateInputs\"7\n\x0eToscaInterface\x12%\n\x06\x63reate\x18\x01 \x01(\x0b\x32\x15.ToscaCreateOperation\"\xcd\x02\n\x11ToscaNodeTemplate\x12\x0c\n\x04type\x18\x01 \x01(\t\x12\'\n\x0crequirements\x18\x02 \x03(\x0b\x32\x11.ToscaRequirement\x12\x34\n\tartifacts\x18\x03 \x03(\x0b\x32!.ToscaNodeTemplate.ArtifactsEntry\x12\x36\n\ninterfaces\x18\x04 \x03(\x0b\x32\".ToscaNodeTemplate.InterfacesEntry\x12\r\n\x05isJob\x18\x05 \x01(\x08\x1a@\n\x0e\x41rtifactsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x1d\n\x05value\x18\x02 \x01(\x0b\x32\x0e.ToscaArtifact:\x02\x38\x01\x1a\x42\n\x0fInterfacesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x1e\n\x05value\x18\x02 \x01(\x0b\x32\x0f.ToscaInterface:\x02\x38\x01\"\xd4\x01\n\x05Tosca\x12!\n\x19tosca_definitions_version\x18\x01 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t\x12\x16\n\x0eserviceOverlay\x18\x03 \x01(\x08\x12\x31\n\x0enode_templates\x18\x04 \x03(\x0b\x32\x19.Tosca.NodeTemplatesEntry\x1aH\n\x12NodeTemplatesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12!\n\x05value\x18\x02 \x01(\x0b\x32\x12.ToscaNodeTemplate:\x02\x38\x01\x62\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'tosca_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _TOSCACAPABILITIES_CAPABILITIESENTRY._options = None
+  _TOSCACAPABILITIES_CAPABILITIESENTRY._serialized_options = b'8\001'
+  _TOSCANODEFILTER_PROPERTIESENTRY._options = None
+  _TOSCANODEFILTER_PROPERTIESENTRY._serialized_options = b'8\001'
+  _TOSCANETWORKPROPERTIES_PORTSENTRY._options = None
+  _TOSCANETWORKPROPERTIES_PORTSENTRY._serialized_options = b'8\001'
+  _TOSCANODETEMPLATE_ARTIFACTSENTRY._options = None
+  _TOSCANODETEMPLATE_ARTIFACTSENTRY._serialized_options = b'8\001'
+  _TOSCANODETEMPLATE_INTERFACESENTRY._options = None
+  _TOSCANODETEMPLATE_INTERFACESENTRY._serialized_options = b'8\001'
+  _TOSCA_NODETEMPLATESENTRY._options = None
+  _TOSCA_NODETEMPLATESENTRY._serialized_options = b'8\001'
+  _TOSCAFLOATCOMPARISON._serialized_start=26
+  _TOSCAFLOATCOMPARISON._serialized_end=94
+  _TOSCASTRINGCOMPARISON._serialized_start=96
+  _TOSCASTRINGCOMPARISON._serialized_end=201
+  _TOSCABOOLCOMPARISON._serialized_start=203
+  _TOSCABOOLCOMPARISON._serialized_end=254
+  _TOSCAPOINT._serialized_start=256
+  _TOSCAPOINT._serialized_end=284
+  _TOSCAAREA._serialized_start=286
+  _TOSCAAREA._serialized_end=331
+  _TOSCAHOSTPROPERTIES._serialized_start=334
+  _TOSCAHOSTPROPERTIES._serialized_end=694
+  _TOSCAHOSTCAPABILITY._serialized_start=696
+  _TOSCAHOSTCAPABILITY._serialized_end=759
+  _TOSCACAPABILITIES._serialized_start=762
+  _TOSCACAPABILITIES._serialized_end=916
+  _TOSCACAPABILITIES_CAPABILITIESENTRY._serialized_start=843
+  _TOSCACAPABILITIES_CAPABILITIESENTRY._serialized_end=916
+  _TOSCASTRINGLIST._serialized_start=918
+  _TOSCASTRINGLIST._serialized_end=951
+  _TOSCANODEFILTER._serialized_start=954
+  _TOSCANODEFILTER._serialized_end=1136
+  _TOSCANODEFILTER_PROPERTIESENTRY._serialized_start=1069
+  _TOSCANODEFILTER_PROPERTIESENTRY._serialized_end=1136
+  _TOSCAHOSTREQUIREMENT._serialized_start=1138
+  _TOSCAHOSTREQUIREMENT._serialized_end=1199
+  _TOSCAPORTPROPERTIES._serialized_start=1201
+  _TOSCAPORTPROPERTIES._serialized_end=1256
+  _TOSCAEXPOSEDPORT._serialized_start=1258
+  _TOSCAEXPOSEDPORT._serialized_end=1318
+  _TOSCANETWORKPROPERTIES._serialized_start=1321
+  _TOSCANETWORKPROPERTIES._serialized_end=1503
+  _TOSCANETWORKPROPERTIES_PORTSENTRY._serialized_start=1424
+  _TOSCANETWORKPROPERTIES_PORTSENTRY._serialized_end=1487
+  _TOSCANETWORKREQUIREMENT._serialized_start=1505
+  _TOSCANETWORKREQUIREMENT._serialized_end=1575
+  _TOSCAREQUIREMENT._serialized_start=1577
+  _TOSCAREQUIREMENT._serialized_end=1694
+  _TOSCAARTIFACT._serialized_start=1697
+  _TOSCAARTIFACT._serialized_end=1851
+  _TOSCACREATEINPUTS._serialized_start=1853
+  _TOSCACREATEINPUTS._serialized_end=1960
+  _TOSCACREATEOPERATION._serialized_start=1962
+  _TOSCACREATEOPERATION._serialized_end=2044
+  _TOSCAINTERFACE._serialized_start=2046
+  _TOSCAINTERFACE._serialized_end=2101
+  _TOSCANODETEMPLATE._serialized_start=2104
+  _TOSCANODETEMPLATE._serialized_end=2437
+  _TOSCANODETEMPLATE_ARTIFACTSENTRY._serialized_start=2305
+  _TOSCANODETEMPLATE_ARTIFACTSENTRY._serialized_end=2369
+  _TOSCANODETEMPLATE_INTERFACESENTRY._serialized_start=2371
+  _TOSCANODETEMPLATE_INTERFACESENTRY._serialized_end=2437
+  _TOSCA._serialized_start=2440
+  _TOSCA._serialized_end=2652
+  _TOSCA_NODETEMPLATESENTRY._serialized_start=2580
+  _TOSCA_NODETEMPLATESENTRY._serialized_end=2652
+# @@protoc_insertion_point(module_scope)
@@ -57,12 +57,29 @@ aeriOS TOSCA example:
                 - Var1: 22
 '''
 
+import hashlib
+import threading
+from collections import OrderedDict
 from enum import Enum
 from typing import List, Dict, Any, Union, Optional
-from pydantic import BaseModel, Field, ValidationError  #, field_validator
+from google.protobuf.message import DecodeError
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError  #, field_validator
 import yaml
+from app.config import TOSCA_CACHE_SIZE
+from app.app_models.tosca_protobuf import tosca_protobuf_to_dict
 from app.utils.log import get_app_logger
 
+# libyaml based loader when PyYAML was built with it, pure python otherwise
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Request body media types of TOSCA documents
+TOSCA_YAML = 'application/x-yaml'
+TOSCA_JSON = 'application/json'
+TOSCA_PROTOBUF = 'application/x-protobuf'
+_PROTOBUF_MEDIA_TYPES = {
+    TOSCA_PROTOBUF, 'application/protobuf', 'application/vnd.google.protobuf'
+}
+
 
 class ServiceNotFound(BaseModel):
     '''
@@ -260,30 +277,156 @@ class TOSCA(BaseModel):
     node_templates: Dict[str, NodeTemplate]
 
 
-def validate_tosca(tosca_yaml) -> TOSCA:
+class ServiceAllocation(BaseModel):
+    '''
+    One service of a bulk allocation request,
+    TOSCA as yaml or json text, or as json object
+    '''
+    serviceId: str
+    tosca: Union[str, Dict[str, Any]]
+
+
+class BulkAllocationRequest(BaseModel):
+    '''
+    Services allocated by one request
+    '''
+    services: List[ServiceAllocation]
+
+
+_TOSCA_ADAPTER = TypeAdapter(TOSCA)
+
+
+class ToscaCache:
+    '''
+    LRU of validated TOSCA objects keyed by the sha256 of the request body,
+    so resubmitted documents are neither parsed nor validated again.
+    Cached objects are shared between requests and must not be modified.
+    '''
+
+    def __init__(self, max_entries: int = TOSCA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(tosca_body, media_type: str = TOSCA_YAML) -> str:
+        '''
+        Content hash of the request body and its media type
+        '''
+        if isinstance(tosca_body, str):
+            tosca_body = tosca_body.encode()
+        return f'{media_type}:{hashlib.sha256(tosca_body).hexdigest()}'
+
+    def get(self, key: str) -> Optional[TOSCA]:
+        '''
+        Cached TOSCA object or None
+        '''
+        with self._lock:
+            tosca_obj = self._entries.get(key)
+            if tosca_obj is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return tosca_obj
+
+    def put(self, key: str, tosca_obj: TOSCA):
+        '''
+        Cache a valid TOSCA object, evicting the least recently used one
+        '''
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tosca_obj
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Drop all cached objects
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        '''
+        Size and hit/miss counters
+        '''
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+
+tosca_cache = ToscaCache()
+
+
+def tosca_media_type(content_type: Optional[str]) -> str:
+    '''
+    TOSCA media type of a Content-Type header, yaml when missing or unknown
     '''
-    Get Tosca yaml from REST endpoint.
-    Load in yaml.
-    Validate and cretae TOSCA typed pydantic model.
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type == TOSCA_JSON or media_type.endswith('+json'):
+        return TOSCA_JSON
+    if media_type in _PROTOBUF_MEDIA_TYPES:
+        return TOSCA_PROTOBUF
+    return TOSCA_YAML
+
+
+def parse_tosca(tosca_body, media_type: str = TOSCA_YAML) -> TOSCA:
+    '''
+    Decode body of media_type and validate it as TOSCA, without the cache.
+    json is validated straight into the model, without building python dicts first.
+    Raises yaml.YAMLError, DecodeError or ValidationError
+    '''
+    if isinstance(tosca_body, dict):
+        return _TOSCA_ADAPTER.validate_python(tosca_body)
+    if media_type == TOSCA_JSON:
+        return _TOSCA_ADAPTER.validate_json(tosca_body)
+    if media_type == TOSCA_PROTOBUF:
+        return _TOSCA_ADAPTER.validate_python(
+            tosca_protobuf_to_dict(tosca_body))
+    data = yaml.load(tosca_body, Loader=_YAML_LOADER)
+    return _TOSCA_ADAPTER.validate_python(data)
+
+
+def validate_tosca(tosca_yaml, media_type: str = TOSCA_YAML) -> TOSCA:
+    '''
+    Get Tosca document (yaml, json or protobuf, or an already decoded dict) from REST endpoint.
+    Return the cached TOSCA object of an already seen body,
+    otherwise decode it, validate and cretae TOSCA typed pydantic model.
     Return TOSCA oject or None
     '''
     logger = get_app_logger()
-    # Load yaml to json
+    key = None
+    if not isinstance(tosca_yaml, dict):
+        key = tosca_cache.key(tosca_yaml, media_type)
+        tosca_obj = tosca_cache.get(key)
+        if tosca_obj is not None:
+            return tosca_obj
     try:
-        data = yaml.safe_load(tosca_yaml)
+        tosca_obj = parse_tosca(tosca_yaml, media_type)
     except yaml.YAMLError as e:
         logger.error("Error while loading yaml: %s", str(e))
         return None
-    # Validate and create Pydantic (typed) object
-    try:
-        tosca_obj = TOSCA(**data)
-        return tosca_obj
+    except DecodeError as e:
+        logger.error("Error while decoding protobuf: %s", str(e))
+        return None
     except ValidationError as e:
         logger.error('TOSCA validation error: %s', e.json())
         return None
     except Exception as e:
         logger.error('TOSCA execption: %s', str(e))
         return None
+    if key is not None:
+        tosca_cache.put(key, tosca_obj)
+    return tosca_obj
 
 
 TOSCA_YAML_EXAMPLE = """
@@ -478,3 +621,46 @@ TOSCA_EXAMPLE = {
         }
     }
 }
+
+
+if __name__ == '__main__':
+    # Benchmark TOSCA ingestion paths:
+    #   python -m app.app_models.tosca_models [tosca.yml | components] [rounds]
+    # Without a file, the document repeats the auto-component node of TOSCA_YAML_EXAMPLE
+    import copy
+    import json
+    import os
+    import sys
+    import timeit
+
+    source = sys.argv[1] if len(sys.argv) > 1 else '20'
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    if os.path.isfile(source):
+        with open(source, encoding='utf-8') as tosca_file:
+            body = tosca_file.read()
+    else:
+        example = yaml.safe_load(TOSCA_YAML_EXAMPLE)
+        node = example['node_templates']['auto-component']
+        example['node_templates'] = {
+            f'component-{index}': copy.deepcopy(node)
+            for index in range(int(source))
+        }
+        body = yaml.safe_dump(example)
+
+    def baseline():
+        '''
+        Pure python loader and model constructor
+        '''
+        return TOSCA(**yaml.safe_load(body))
+
+    json_body = json.dumps(yaml.safe_load(body))
+
+    print(f'{source}: {len(body)} bytes, {rounds} rounds, '
+          f'loader {_YAML_LOADER.__name__}')
+    for name, run in (('safe_load + TOSCA(**data)', baseline),
+                      ('loader + TypeAdapter', lambda: parse_tosca(body)),
+                      ('json TypeAdapter',
+                       lambda: parse_tosca(json_body, TOSCA_JSON)),
+                      ('validate_tosca (cached)', lambda: validate_tosca(body))):
+        seconds = timeit.timeit(run, number=rounds)
+        print(f'{name:28} {seconds / rounds * 1000:8.3f} ms')
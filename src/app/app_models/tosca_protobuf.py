@@ -0,0 +1,148 @@
+'''
+Protobuf encoding of TOSCA allocation requests (schemas/tosca.proto)
+Decodes a serialized Tosca message into the dict layout of the TOSCA yaml,
+ready to be validated by the TOSCA pydantic model.
+'''
+from typing import Dict, List
+from app.app_models.py_files import tosca_pb2
+
+
+def _optional_fields(message) -> Dict:
+    '''
+    Set fields of a message holding only optional scalars
+    '''
+    return {
+        field.name: value
+        for field, value in message.ListFields()
+    }
+
+
+def _host_properties(properties: tosca_pb2.ToscaHostProperties) -> Dict:
+    host_properties = {
+        'cpu_usage': _optional_fields(properties.cpu_usage),
+        'cpu_arch': _optional_fields(properties.cpu_arch),
+        'mem_size': _optional_fields(properties.mem_size),
+        'realtime': _optional_fields(properties.realtime),
+        'energy_efficiency': _optional_fields(properties.energy_efficiency),
+        'green': _optional_fields(properties.green),
+        'domain_id': _optional_fields(properties.domain_id)
+    }
+    if properties.HasField('area'):
+        host_properties['area'] = {
+            'coordinates':
+            [list(point.values) for point in properties.area.coordinates]
+        }
+    return host_properties
+
+
+def _node_filter(node_filter: tosca_pb2.ToscaNodeFilter) -> Dict:
+    return {
+        'properties': {
+            key: list(values.values)
+            for key, values in node_filter.properties.items()
+        } or None,
+        'capabilities': [{
+            name: {
+                'properties': _host_properties(capability.properties)
+            }
+            for name, capability in capabilities.capabilities.items()
+        } for capabilities in node_filter.capabilities] or None
+    }
+
+
+def _network_properties(properties: tosca_pb2.ToscaNetworkProperties) -> Dict:
+    network_properties = {
+        'ports': {
+            name: {
+                'properties': {
+                    'protocol': list(port.properties.protocol),
+                    'source': port.properties.source
+                }
+            }
+            for name, port in properties.ports.items()
+        }
+    }
+    if properties.HasField('exposePorts'):
+        network_properties['exposePorts'] = properties.exposePorts
+    return network_properties
+
+
+def _requirements(requirements) -> List[Dict]:
+    custom_requirements = []
+    for requirement in requirements:
+        kind = requirement.WhichOneof('requirement')
+        if kind == 'host':
+            custom_requirements.append({
+                'host': {
+                    'node_filter': _node_filter(requirement.host.node_filter)
+                }
+            })
+        elif kind == 'network':
+            custom_requirements.append({
+                'network': {
+                    'properties':
+                    _network_properties(requirement.network.properties)
+                }
+            })
+    return custom_requirements
+
+
+def _key_values(key_values) -> List[Dict]:
+    '''
+    ServiceComponentKeyValue list -> [{key: value}], as cliArgs and envVars in yaml
+    '''
+    return [{item.key: item.value} for item in key_values]
+
+
+def _interfaces(interfaces) -> Dict:
+    return {
+        name: {
+            'create': {
+                'implementation': interface.create.implementation,
+                'inputs': {
+                    'cliArgs': _key_values(interface.create.inputs.cliArgs),
+                    'envVars': _key_values(interface.create.inputs.envVars)
+                }
+            }
+        }
+        for name, interface in interfaces.items()
+    }
+
+
+def _artifacts(artifacts) -> Dict:
+    tosca_artifacts = {}
+    for name, artifact in artifacts.items():
+        tosca_artifact = {
+            'file': artifact.file,
+            'type': artifact.type,
+            'repository': artifact.repository,
+            'isPrivate': artifact.isPrivate
+        }
+        for field in ('username', 'password'):
+            if artifact.HasField(field):
+                tosca_artifact[field] = getattr(artifact, field)
+        tosca_artifacts[name] = tosca_artifact
+    return tosca_artifacts
+
+
+def tosca_protobuf_to_dict(body: bytes) -> Dict:
+    '''
+    Decode serialized Tosca message.
+    Raises google.protobuf.message.DecodeError
+    '''
+    tosca = tosca_pb2.Tosca.FromString(body)
+    return {
+        'tosca_definitions_version': tosca.tosca_definitions_version,
+        'description': tosca.description,
+        'serviceOverlay': tosca.serviceOverlay,
+        'node_templates': {
+            name: {
+                'type': node.type,
+                'requirements': _requirements(node.requirements),
+                'artifacts': _artifacts(node.artifacts),
+                'interfaces': _interfaces(node.interfaces),
+                'isJob': node.isJob
+            }
+            for name, node in tosca.node_templates.items()
+        }
+    }
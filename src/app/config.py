@@ -2,6 +2,8 @@
     Docstring
 '''
 import os
+import socket
+import tempfile
 
 # Set DEV to False when building production container images
 DEV = False
@@ -25,6 +27,100 @@ else:
 
 TOKEN_URL = f"{K8S_SHIM_URL}:{K8S_SHIM_PORT}/token"
 
+# M2M token cache (k8s shim tokens)
+# TOKEN_REFRESH_MARGIN: seconds before JWT expiry the token is refreshed in the background
+# TOKEN_DEFAULT_TTL: seconds a token is cached when its expiry can not be read
+# TOKEN_FETCH_TIMEOUT: seconds a caller waits for an in-flight token fetch
+TOKEN_REFRESH_MARGIN = float(os.environ.get('TOKEN_REFRESH_MARGIN', '60'))
+TOKEN_DEFAULT_TTL = float(os.environ.get('TOKEN_DEFAULT_TTL', '300'))
+TOKEN_FETCH_TIMEOUT = float(os.environ.get('TOKEN_FETCH_TIMEOUT', '5'))
+
+# Keep-alive HTTP connection pool shared by all CBClient instances
+# CB_POOL_CONNECTIONS: number of per-host pools kept (one per Orion-LD host:port)
+# CB_POOL_MAXSIZE: max keep-alive connections kept per host
+# CB_POOL_BLOCK: when true, wait for a free connection instead of opening extra ones
+CB_POOL_CONNECTIONS = int(os.environ.get('CB_POOL_CONNECTIONS', '4'))
+CB_POOL_MAXSIZE = int(os.environ.get('CB_POOL_MAXSIZE', '20'))
+CB_POOL_BLOCK = os.environ.get('CB_POOL_BLOCK', 'false').lower() == 'true'
+
+# Max entities per NGSI-LD /entityOperations request, bigger batches are chunked
+CB_BATCH_SIZE = int(os.environ.get('CB_BATCH_SIZE', '100'))
+# CB call resilience
+# CB_RETRY_ATTEMPTS: attempts of idempotent CB calls (GET, PATCH, DELETE, batch update/upsert/delete)
+# CB_RETRY_BACKOFF_BASE, CB_RETRY_BACKOFF_MAX: jittered exponential backoff bounds in seconds
+# CB_BREAKER_ERROR_RATE: CB error rate over CB_BREAKER_WINDOW seconds that opens the circuit,
+#   once at least CB_BREAKER_MIN_REQUESTS calls were made
+# CB_BREAKER_OPEN_SECONDS: seconds CB calls fail fast before a probe call is let through
+CB_RETRY_ATTEMPTS = int(os.environ.get('CB_RETRY_ATTEMPTS', '3'))
+CB_RETRY_BACKOFF_BASE = float(os.environ.get('CB_RETRY_BACKOFF_BASE', '0.2'))
+CB_RETRY_BACKOFF_MAX = float(os.environ.get('CB_RETRY_BACKOFF_MAX', '2'))
+CB_BREAKER_ERROR_RATE = float(os.environ.get('CB_BREAKER_ERROR_RATE', '0.5'))
+CB_BREAKER_MIN_REQUESTS = int(os.environ.get('CB_BREAKER_MIN_REQUESTS', '10'))
+CB_BREAKER_WINDOW = float(os.environ.get('CB_BREAKER_WINDOW', '30'))
+CB_BREAKER_OPEN_SECONDS = float(os.environ.get('CB_BREAKER_OPEN_SECONDS', '15'))
+
+# Validated TOSCA documents kept by content hash, 0 disables the cache
+TOSCA_CACHE_SIZE = int(os.environ.get('TOSCA_CACHE_SIZE', '128'))
+
+# Adaptive CB timeouts, tracked per operation (query, patch, create, delete, batch)
+# timeout = EWMA latency + CB_TIMEOUT_DEVIATIONS * EWMA latency deviation
+# CB_TIMEOUT_INITIAL: seconds used until CB_TIMEOUT_MIN_SAMPLES latencies were observed
+# CB_TIMEOUT_FLOOR, CB_TIMEOUT_CEILING: timeout bounds in seconds
+# CB_TIMEOUT_ALPHA: EWMA weight of the newest latency
+CB_TIMEOUT_INITIAL = float(os.environ.get('CB_TIMEOUT_INITIAL', '5'))
+CB_TIMEOUT_FLOOR = float(os.environ.get('CB_TIMEOUT_FLOOR', '1'))
+CB_TIMEOUT_CEILING = float(os.environ.get('CB_TIMEOUT_CEILING', '15'))
+CB_TIMEOUT_ALPHA = float(os.environ.get('CB_TIMEOUT_ALPHA', '0.125'))
+CB_TIMEOUT_DEVIATIONS = float(os.environ.get('CB_TIMEOUT_DEVIATIONS', '4'))
+CB_TIMEOUT_MIN_SAMPLES = int(os.environ.get('CB_TIMEOUT_MIN_SAMPLES', '5'))
+
+# Entities per page when iterating over query results (Orion-LD caps limit at 1000)
+CB_PAGE_SIZE = int(os.environ.get('CB_PAGE_SIZE', '100'))
+
+# Read-through cache of CB query results, shared by CBClient and AsyncCBClient
+# CB_CACHE_ENABLED: cache query_entity / query_entities results
+# CB_CACHE_MAX_ENTRIES: cached query results, least recently used ones are evicted
+# CB_CACHE_DEFAULT_TTL: seconds a result is cached when its entity type has no TTL
+# CB_CACHE_TTLS: per entity type TTLs in seconds, e.g. "Domain=60,Service=5", 0 disables caching
+CB_CACHE_ENABLED = os.environ.get('CB_CACHE_ENABLED', 'false').lower() == 'true'
+CB_CACHE_MAX_ENTRIES = int(os.environ.get('CB_CACHE_MAX_ENTRIES', '1000'))
+CB_CACHE_DEFAULT_TTL = float(os.environ.get('CB_CACHE_DEFAULT_TTL', '2'))
+CB_CACHE_TTLS = {
+    entity_type.strip(): float(ttl)
+    for entity_type, ttl in (
+        item.split('=', 1) for item in os.environ.get(
+            'CB_CACHE_TTLS', 'Domain=60,Service=5,ServiceComponent=2').split(',')
+        if '=' in item)
+}
+
+# Seconds between background refreshes of the memoized host domain id, 0 disables them
+HOST_DOMAIN_REFRESH_INTERVAL = float(
+    os.environ.get('HOST_DOMAIN_REFRESH_INTERVAL', '600'))
+
+# Service component status index fed by NGSI-LD notifications
+# STATUS_NOTIFICATION_URL: URL CB notifies, e.g. http://hlo-fe:8000/hlo_fe/notifications,
+#   the index is disabled and status is read from CB when not set
+# STATUS_SUBSCRIPTION_ID: id of the subscription, one per replica
+# STATUS_INDEX_MAX_AGE: seconds after which an indexed service is reloaded from CB
+# STATUS_NOTIFICATION_TOKEN: shared secret CB sends in a header with every notification,
+#   notifications without it are rejected (a random one is generated when not set)
+STATUS_NOTIFICATION_URL = os.environ.get('STATUS_NOTIFICATION_URL')
+STATUS_SUBSCRIPTION_ID = os.environ.get(
+    'STATUS_SUBSCRIPTION_ID',
+    f'urn:ngsi-ld:Subscription:hlo-fe-status:{socket.gethostname()}')
+STATUS_INDEX_MAX_AGE = float(os.environ.get('STATUS_INDEX_MAX_AGE', '30'))
+STATUS_NOTIFICATION_TOKEN = os.environ.get('STATUS_NOTIFICATION_TOKEN')
+
+# Service status event streams
+# STATUS_STREAM_INTERVAL: seconds between status reads of a watched service
+# STATUS_STREAM_KEEPALIVE: seconds of silence before a keepalive comment is sent
+# STATUS_STREAM_TIMEOUT: max seconds a stream stays open
+STATUS_STREAM_INTERVAL = float(os.environ.get('STATUS_STREAM_INTERVAL', '2'))
+STATUS_STREAM_KEEPALIVE = float(os.environ.get('STATUS_STREAM_KEEPALIVE', '15'))
+STATUS_STREAM_TIMEOUT = float(os.environ.get('STATUS_STREAM_TIMEOUT', '900'))
+# Max seconds a status long-poll (wait parameter) holds the request
+STATUS_LONG_POLL_MAX = float(os.environ.get('STATUS_LONG_POLL_MAX', '60'))
+
 PARENT_PATH = os.path.dirname(__file__)
 LOG_PATH = PARENT_PATH + '/log/fe.log'
 
@@ -47,4 +143,36 @@ producer_config = {
     # os.environ.get('AUTO_OFFSET_RESET', 'earliest')
 }
 
+# Long lived fe2data producer
+# PRODUCER_POLL_INTERVAL: seconds each background poll waits for delivery reports
+# PRODUCER_FLUSH_TIMEOUT: seconds to wait for in-flight messages on shutdown
+PRODUCER_POLL_INTERVAL = float(os.environ.get('PRODUCER_POLL_INTERVAL', '0.1'))
+PRODUCER_FLUSH_TIMEOUT = float(os.environ.get('PRODUCER_FLUSH_TIMEOUT', '10'))
+
+# Durable fe2data outbox, notifications survive broker outages and restarts
+# OUTBOX_PATH: sqlite file, defaults under the temp directory for local runs,
+#   deployments set it on a persistent volume (helm chart outbox.path)
+# OUTBOX_BATCH_SIZE: max notifications sent per drain round
+# OUTBOX_POLL_INTERVAL: seconds the drainer sleeps when nothing is due
+# OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX: exponential retry backoff bounds in seconds
+OUTBOX_PATH = os.environ.get(
+    'OUTBOX_PATH', os.path.join(tempfile.gettempdir(), 'hlo-fe', 'fe2data.db'))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '1'))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '1'))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '60'))
+
+# Max services of one bulk allocation request
+BULK_MAX_SERVICES = int(os.environ.get('BULK_MAX_SERVICES', '100'))
+
+# Allocation job queue
+# JOB_WORKERS: allocation jobs run concurrently
+# JOB_QUEUE_SIZE: queued jobs before new requests are rejected with 429
+# JOB_RETENTION: finished jobs kept for GET /hlo_fe/jobs/{job_id}
+# JOB_RETRY_AFTER: Retry-After seconds sent with 429
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', '100'))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', '1000'))
+JOB_RETRY_AFTER = int(os.environ.get('JOB_RETRY_AFTER', '5'))
+
 existing_services = {}
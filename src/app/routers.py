@@ -3,25 +3,73 @@
   aeriOS REST API for aeriOS Service LCM
   OpenAPI: https://aeriOS-public.pages.aeriOS-project.eu/openapis/#/hlo_fe
 '''
+import asyncio
 from asyncio import to_thread
-from fastapi import HTTPException, APIRouter, Body, BackgroundTasks
-from fastapi.responses import JSONResponse
-from starlette.status import HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR
-from confluent_kafka import KafkaException
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, APIRouter, Body, Header, Query, Request,\
+    Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.status import HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR,\
+    HTTP_204_NO_CONTENT, HTTP_207_MULTI_STATUS, HTTP_304_NOT_MODIFIED,\
+    HTTP_429_TOO_MANY_REQUESTS
 from app.app_models.tosca_models import ServiceNotFound, validate_tosca,\
-    TOSCA_YAML_EXAMPLE, TOSCA_EXAMPLE
-from app.utils import kafka_client
-from app.fe_engine import FeEngine
+    tosca_media_type, TOSCA_YAML_EXAMPLE, TOSCA_EXAMPLE, tosca_cache, TOSCA,\
+    TOSCA_JSON, TOSCA_YAML, BulkAllocationRequest
+from app.utils import outbox
 from app.utils.log import get_app_logger
 from app.utils import continuum_utils
+from app.utils import async_continuum_utils
 from app.app_models.aeriOS_continuum import ServiceComponentStatusEnum, ServiceStatusResponse
+from app.app_models.job_models import JobStatusResponse, JobNotFound
+from app.utils import job_queue
+from app.utils.single_flight import lifecycle_guard
+from app.utils import service_diff
+from app.utils import host_domain
+from app.utils.status_index import status_index, notification_authorized
+from app.utils.status_stream import status_hub, stream_service_events,\
+    status_etag, etag_matches, wait_for_status_change
+from app import config
 import app.utils.aeriOS_contrinuum_generator as aeriOS_json_generator
 import app.utils.aeriOS_ngsild as aeriOS_ngsild
+from app.api_clients import cb_client
+from app.api_clients import entity_cache
+from app.api_clients.adaptive_timeout import get_cb_timeouts_stats
 
 logger = get_app_logger()
 
 router = APIRouter()
 
+# TOSCA request body, content negotiated by read_tosca
+TOSCA_REQUEST_BODY = {
+    "content": {
+        "application/x-yaml": {
+            "example": TOSCA_YAML_EXAMPLE
+        },
+        "application/json": {
+            "example": TOSCA_EXAMPLE
+        },
+        "application/x-protobuf": {
+            "schema": {
+                "type": "string",
+                "format": "binary",
+                "description": "Tosca message of app_models/schemas/tosca.proto"
+            }
+        }
+    },
+    "required": True,
+}
+
+
+async def read_tosca(request: Request):
+    '''
+    Validated TOSCA object of the request body, decoded according to its Content-Type
+    (json and protobuf skip yaml parsing), None when invalid
+    '''
+    body = await request.body()
+    return validate_tosca(tosca_yaml=body,
+                          media_type=tosca_media_type(
+                              request.headers.get('content-type')))
+
 
 @router.get("/hlo_fe/services/{service_id}",
             response_model=list[ServiceStatusResponse],
@@ -34,14 +82,85 @@ router = APIRouter()
                     "description": "Bad Request"
                 }
             })
-async def get_service_status(service_id):
+async def get_service_status(service_id: str,
+                             response: Response,
+                             wait: float = Query(
+                                 0,
+                                 ge=0,
+                                 description="Long-poll: seconds to hold the request "
+                                 "until status no longer matches If-None-Match"),
+                             if_none_match: Optional[str] = Header(None)):
     '''
     Get service status.
-    Response: List of service components status
+    Response: List of service components status, with an ETag over the statuses.
+    A request with a matching If-None-Match gets 304,
+    with wait it is held until status changes or wait seconds passed
+    (not when every component is in a terminal state, its status is final).
     '''
-    if not continuum_utils.check_service_exists(service_id=service_id):
+    components = await async_continuum_utils.get_indexed_service_status(
+        service_id=service_id)
+    if components is None:
         raise HTTPException(status_code=404, detail="Service not found")
-    return continuum_utils.get_service_status(service_id=service_id)
+    etag = status_etag(components)
+    if wait > 0 and etag_matches(if_none_match, etag):
+        components = await wait_for_status_change(
+            service_id, components, min(wait, config.STATUS_LONG_POLL_MAX))
+        etag = status_etag(components)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=HTTP_304_NOT_MODIFIED,
+                        headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return components
+
+
+@router.post("/hlo_fe/notifications", status_code=HTTP_204_NO_CONTENT)
+async def receive_notification(notification: dict = Body(...),
+                               x_hlo_notification_token: Optional[str] = Header(
+                                   None),
+                               token: Optional[str] = Query(None)):
+    '''
+    NGSI-LD notification receiver, feeds the service component status index
+    Only notifications of the status subscription carrying its token
+    (X-HLO-Notification-Token header or token query parameter) are applied
+    '''
+    if not notification_authorized(notification, x_hlo_notification_token
+                                   or token):
+        raise HTTPException(status_code=403,
+                            detail="Unknown notification subscription")
+    service_ids = status_index.apply_notification(notification.get("data", []))
+    status_hub.wake(service_ids)
+
+
+@router.get("/hlo_fe/services/{service_id}/events",
+            response_class=StreamingResponse,
+            responses={
+                200: {
+                    "description": "Server-Sent Events of service component status changes",
+                    "content": {
+                        "text/event-stream": {}
+                    }
+                },
+                404: {
+                    "model": ServiceNotFound,
+                    "description": "Bad Request"
+                }
+            })
+async def stream_service_status(service_id: str):
+    '''
+    Stream service components status.
+    Each "status" event carries the list of changed service components status,
+    the first one all of them. An "end" event closes the stream
+    when all components are Running, Failed or Finished.
+    '''
+    if not await async_continuum_utils.check_service_exists(
+            service_id=service_id):
+        raise HTTPException(status_code=404, detail="Service not found")
+    return StreamingResponse(stream_service_events(service_id),
+                             media_type="text/event-stream",
+                             headers={
+                                 "Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"
+                             })
 
 
 @router.post(
@@ -62,29 +181,21 @@ async def get_service_status(service_id):
         },
         400: {
             "description": "Invalid Service Parameters"
-        }
-    },
-    openapi_extra={
-        "requestBody": {
-            "content": {
-                "application/x-yaml": {
-                    "example": TOSCA_YAML_EXAMPLE
-                }
-            },
-            "required": True,
         },
+        429: {
+            "description": "Allocation queue full, retry after Retry-After seconds"
+        }
     },
+    openapi_extra={"requestBody": TOSCA_REQUEST_BODY},
 )
-async def allocate_service(background_tasks: BackgroundTasks,
-                           service_id: str,
-                           tosca_yaml: str = Body(..., example=TOSCA_EXAMPLE)):
+async def allocate_service(service_id: str, request: Request):
     '''
     Allocate new service acrros domains
+    TOSCA body as yaml, json or protobuf, chosen by Content-Type
     :return: Response message and status code.
     '''
 
-    # logger.info('TOSCA file recieved: %s', tosca_yaml)
-    tosca_obj = validate_tosca(tosca_yaml=tosca_yaml)
+    tosca_obj = await read_tosca(request)
 
     # import json
     # logger.info('Translated tosca request: %s', json.dumps(json.loads(tosca_obj.json()), indent=4))
@@ -93,9 +204,17 @@ async def allocate_service(background_tasks: BackgroundTasks,
     if not tosca_obj:
         raise HTTPException(status_code=400,
                             detail="Invalid Service Parameters")
-    background_tasks.add_task(run_allocate_service,
-                              service_id=service_id,
-                              tosca_obj=tosca_obj)
+    try:
+        # Concurrent allocations of the same service are merged into one execution
+        job = job_queue.get_job_queue().submit("allocate",
+                                               lifecycle_guard.run,
+                                               service_id,
+                                               "allocate",
+                                               run_allocate_service,
+                                               service_id=service_id,
+                                               tosca_obj=tosca_obj)
+    except job_queue.JobQueueFull as ex:
+        return queue_full_response(ex)
 
     # Return a 202 Accepted response with a Location header
     response = JSONResponse(
@@ -105,13 +224,45 @@ async def allocate_service(background_tasks: BackgroundTasks,
             "status": "starting",
             "message":
             "Service allocation initiated. Check service components status at the URL provided.",
-            "url": f"/hlo_fe/services/{service_id}"
+            "url": f"/hlo_fe/services/{service_id}",
+            "jobId": job.id,
+            "jobUrl": f"/hlo_fe/jobs/{job.id}"
         })
     response.headers["Location"] = f"/hlo_fe/services/{service_id}"
 
     return response
 
 
+def queue_full_response(ex: job_queue.JobQueueFull) -> JSONResponse:
+    '''
+    429 response when the allocation job queue is full
+    '''
+    logger.error("Allocation rejected: %s", ex)
+    return JSONResponse(status_code=HTTP_429_TOO_MANY_REQUESTS,
+                        content={"detail": str(ex)},
+                        headers={"Retry-After": str(config.JOB_RETRY_AFTER)})
+
+
+def service_read_failed(service_id: str,
+                        error: cb_client.CBQueryError) -> dict:
+    '''
+    Outcome of an operation that could not read the service from CB,
+    nothing is written on a partial view
+    '''
+    logger.error("Service %s not read: %s", service_id, error)
+    return {
+        "serviceId": service_id,
+        "status": "failed to read service",
+        "errors": [{
+            "entityId": service_id,
+            "error": {
+                "title": "service could not be read",
+                "detail": str(error)
+            }
+        }]
+    }
+
+
 def run_allocate_service(service_id: str, tosca_obj):
     '''
     Run the allocation
@@ -119,22 +270,18 @@ def run_allocate_service(service_id: str, tosca_obj):
     @tosca_obj: TOSCA modeled service
     '''
     # If service exists and service components in RUNNING or STARTING status, STOP here
-    if continuum_utils.check_service_exists(service_id=service_id):
-        for scomponent_id in continuum_utils.get_service_components_list(
-                service_id):
-            if continuum_utils.get_service_component_status(
-                    service_component_id=scomponent_id) in [
-                        ServiceComponentStatusEnum.RUNNING,
-                        ServiceComponentStatusEnum.STARTING
-                    ]:
-                logger.info(
-                    "Service Component %s: Already started or starting",
-                    scomponent_id)
-                return
-                # return {
-                #     "status":
-                #     f"service component {scomponent_id} already Started or Running Returning "
-                # }
+    try:
+        snapshot = continuum_utils.get_service_snapshot(service_id=service_id)
+    except cb_client.CBQueryError as e:
+        return service_read_failed(service_id, e)
+    if snapshot:
+        for scomponent in snapshot.components_in([
+                ServiceComponentStatusEnum.RUNNING,
+                ServiceComponentStatusEnum.STARTING
+        ]):
+            logger.info("Service Component %s: Already started or starting",
+                        scomponent.id)
+            return {"serviceId": service_id, "status": "already started or starting"}
 
     # ... else proceed with entities create and continuum upadte and ....
     aeriOS = aeriOS_json_generator.aeriOSContinuumEnitiesGenerator(
@@ -158,22 +305,209 @@ def run_allocate_service(service_id: str, tosca_obj):
         created_all_entities = None
 
     if created_all_entities:
+        # Recorded in the durable outbox, delivered to redpanda in the background
+        outbox.publish_fe2data(service_id=service_id)
+        return {"serviceId": service_id, "status": "service allocation initiated"}
+    # raise HTTPException(
+    #     status_code=409,
+    #     detail="Failed to create all aeriOS entities for service allocation"
+    # )
+    logger.error("Failed to create all aeriOS entities for service allocation")
+    return {
+        "serviceId": service_id,
+        "status": "failed to create all aeriOS entities for service allocation"
+    }
+
+
+@router.post(
+    "/hlo_fe/services",
+    responses={
+        202: {
+            "description": "Bulk service allocation initiated",
+            "headers": {
+                "Location": {
+                    "description": "The URL to retrieve the allocation job",
+                    "schema": {
+                        "type": "string",
+                        "format": "uri"
+                    }
+                }
+            },
+        },
+        400: {
+            "description": "Invalid bulk request"
+        },
+        429: {
+            "description": "Allocation queue full, retry after Retry-After seconds"
+        }
+    },
+)
+async def allocate_services(bulk: BulkAllocationRequest):
+    '''
+    Allocate many services with one request
+    TOSCA documents are validated in parallel, entities of all services are created
+    with batch operations and one job reports the outcome of every service
+    '''
+    service_ids = [service.serviceId for service in bulk.services]
+    if not service_ids or len(service_ids) > config.BULK_MAX_SERVICES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Between 1 and {config.BULK_MAX_SERVICES} services expected")
+    if len(set(service_ids)) != len(service_ids):
+        raise HTTPException(status_code=400,
+                            detail="Duplicate service ids")
+
+    tosca_objs = await asyncio.gather(*(to_thread(
+        validate_tosca,
+        tosca_yaml=service.tosca,
+        media_type=bulk_tosca_media_type(service.tosca))
+                                        for service in bulk.services))
+    services = list(zip(service_ids, tosca_objs))
+    try:
+        job = job_queue.get_job_queue().submit("allocate_bulk",
+                                               run_allocate_services,
+                                               services=services)
+    except job_queue.JobQueueFull as ex:
+        return queue_full_response(ex)
+
+    response = JSONResponse(
+        status_code=202,
+        content={
+            "jobId": job.id,
+            "jobUrl": f"/hlo_fe/jobs/{job.id}",
+            "message":
+            "Bulk service allocation initiated. Check per service outcome at the job URL.",
+            "services": [{
+                "serviceId": service_id,
+                "status": "starting" if tosca_obj else "invalid",
+                "url": f"/hlo_fe/services/{service_id}"
+            } for service_id, tosca_obj in services]
+        })
+    response.headers["Location"] = f"/hlo_fe/jobs/{job.id}"
+    return response
+
+
+def bulk_tosca_media_type(tosca) -> str:
+    '''
+    json for json text, so it skips yaml parsing, yaml otherwise
+    '''
+    if isinstance(tosca, str) and tosca.lstrip().startswith('{'):
+        return TOSCA_JSON
+    return TOSCA_YAML
+
+
+def run_allocate_services(services: List[Tuple[str, Optional[TOSCA]]]) -> dict:
+    '''
+    Run a bulk allocation
+    Every service is guarded like a single allocation (same operation and payload),
+    so a concurrent allocation of one of them is joined or serialized, never interleaved
+    @services: (service id, TOSCA modeled service or None when invalid) pairs
+    '''
+    outcomes = {
+        service_id: "invalid service parameters"
+        for service_id, _ in services
+    }
+    results = lifecycle_guard.run_many(
+        "allocate", allocate_services_batch, {
+            service_id: {
+                "service_id": service_id,
+                "tosca_obj": tosca_obj
+            }
+            for service_id, tosca_obj in services if tosca_obj
+        })
+    for service_id, result in results.items():
+        outcomes[service_id] = result["status"] if result else (
+            "failed to create all aeriOS entities for service allocation")
+    return {
+        "services": [{
+            "serviceId": service_id,
+            "status": status
+        } for service_id, status in outcomes.items()]
+    }
+
+
+def allocate_services_batch(calls: Dict[str, dict]) -> Dict[str, dict]:
+    '''
+    Allocate services, run under the lifecycle guard of every one of them
+    New services are created with one batch create (Services) and one batch upsert
+    (their components, requirements and ports) and notified with one outbox batch,
+    services that already exist go through the single service allocation (restart) flow
+    @calls: service id -> run_allocate_service kwargs
+    :return service id -> outcome, as returned by run_allocate_service
+    '''
+    outcomes = {}
+    existing = continuum_utils.get_existing_services(list(calls))
+    service_entities = []
+    entities = []
+    entity_service = {}
+    created = []
+    for service_id, kwargs in calls.items():
+        if service_id in existing:
+            outcomes[service_id] = run_allocate_service(**kwargs)
+            continue
         try:
-            # pass
-            kafka_client.produce_message(service_id=service_id)
-        except KafkaException as ex:
-            # raise HTTPException(
-            #     status_code=500,
-            #     detail=f"Redpanda failure,HLO pipeline broken: {ex}") from ex
-            logger.error("Redpanda failure,HLO pipeline broken: %s", ex)
-        # return {"status": "service allocation initiated"}
-    else:
-        # raise HTTPException(
-        #     status_code=409,
-        #     detail="Failed to create all aeriOS entities for service allocation"
-        # )
-        logger.error(
-            "Failed to create all aeriOS entities for service allocation")
+            json_entities = aeriOS_json_generator.aeriOSContinuumEnitiesGenerator(
+                service_id=service_id, tosca_obj=kwargs["tosca_obj"]).run()
+        except Exception:  # pylint: disable=broad-except
+            # One service must not fail the whole bulk
+            logger.exception("Entity generation failed for service %s",
+                             service_id)
+            json_entities = None
+        if not json_entities:
+            logger.error("Failed to create aeriOS entities for service %s",
+                         service_id)
+            outcomes[service_id] = {
+                "serviceId": service_id,
+                "status":
+                "failed to create all aeriOS entities for service allocation"
+            }
+            continue
+        for entity in aeriOS_ngsild.aeriOSNgsild(
+                json_entities).get_ngsild_entities():
+            if entity["type"] == "Service":
+                service_entities.append(entity)
+            else:
+                entities.append(entity)
+            entity_service[entity["id"]] = service_id
+        created.append(service_id)
+
+    # Services are created, so a service allocated meanwhile is not overwritten,
+    # their entities have deterministic ids and are upserted over any leftovers
+    cb = cb_client.CBClient()
+    failed = set()
+    if service_entities:
+        result = cb.batch_create(service_entities)
+        for error in result["errors"]:
+            logger.error("Failed to Create entity with id: %s, error: %s",
+                         error.get("entityId"), error.get("error"))
+            failed.add(entity_service.get(error.get("entityId")))
+    entities = [
+        entity for entity in entities
+        if entity_service[entity["id"]] not in failed
+    ]
+    if entities:
+        result = cb.batch_upsert(entities)
+        for error in result["errors"]:
+            logger.error("Failed to Create entity with id: %s, error: %s",
+                         error.get("entityId"), error.get("error"))
+            failed.add(entity_service.get(error.get("entityId")))
+    for service_id in [
+            service_id for service_id in created if service_id in failed
+    ]:
+        created.remove(service_id)
+        outcomes[service_id] = {
+            "serviceId": service_id,
+            "status":
+            "failed to create all aeriOS entities for service allocation"
+        }
+
+    outbox.publish_fe2data_many(created)
+    for service_id in created:
+        outcomes[service_id] = {
+            "serviceId": service_id,
+            "status": "service allocation initiated"
+        }
+    return outcomes
 
 
 @router.put("/hlo_fe/services/{service_id}",
@@ -184,19 +518,32 @@ def run_allocate_service(service_id: str, tosca_obj):
                 404: {
                     "model": ServiceNotFound,
                     "description": "Bad Request"
+                },
+                429: {
+                    "description":
+                    "Allocation queue full, retry after Retry-After seconds"
                 }
             })
-async def re_allocate(background_tasks: BackgroundTasks, service_id: str):
+async def re_allocate(service_id: str):
     '''
     Re-allocate service
     @service_id: the id of the service to re-allocate
     '''
     # If service does not exist, return 404
-    if not continuum_utils.check_service_exists(service_id=service_id):
+    if not await async_continuum_utils.check_service_exists(
+            service_id=service_id):
         logger.error("Service %s not found", service_id)
         raise HTTPException(status_code=404, detail="Service not found")
 
-    background_tasks.add_task(run_re_allocate_service, service_id=service_id)
+    try:
+        job = job_queue.get_job_queue().submit("re-allocate",
+                                               lifecycle_guard.run,
+                                               service_id,
+                                               "re-allocate",
+                                               run_re_allocate_service,
+                                               service_id=service_id)
+    except job_queue.JobQueueFull as ex:
+        return queue_full_response(ex)
 
     # Return a 202 Accepted response with a Location header
     response = JSONResponse(
@@ -206,7 +553,9 @@ async def re_allocate(background_tasks: BackgroundTasks, service_id: str):
             "status": "starting",
             "message":
             "Service Re-allocation initiated. Check service components status at the URL provided.",
-            "url": f"/hlo_fe/services/{service_id}"
+            "url": f"/hlo_fe/services/{service_id}",
+            "jobId": job.id,
+            "jobUrl": f"/hlo_fe/jobs/{job.id}"
         })
     response.headers["Location"] = f"/hlo_fe/services/{service_id}"
 
@@ -219,26 +568,30 @@ def run_re_allocate_service(service_id: str):
     @service_id: the id of the service to re-allocate
     '''
     # If service exists and service components in RUNNING or STARTING status, STOP here
-    if continuum_utils.check_service_exists(service_id=service_id):
-        for scomponent_id in continuum_utils.get_service_components_list(
-                service_id):
-            if continuum_utils.get_service_component_status(
-                    service_component_id=scomponent_id) in [
-                        ServiceComponentStatusEnum.RUNNING,
-                        ServiceComponentStatusEnum.STARTING
-                    ]:
-                logger.info(
-                    "Service Component %s: Already started or starting",
-                    scomponent_id)
-                return
+    try:
+        snapshot = continuum_utils.get_service_snapshot(service_id=service_id)
+    except cb_client.CBQueryError as e:
+        return service_read_failed(service_id, e)
+    if snapshot:
+        for scomponent in snapshot.components_in([
+                ServiceComponentStatusEnum.RUNNING,
+                ServiceComponentStatusEnum.STARTING
+        ]):
+            logger.info("Service Component %s: Already started or starting",
+                        scomponent.id)
+            return {"serviceId": service_id, "status": "already started or starting"}
         # If no service component in RUNNING or STARTING status,
         # reset all service components status to STARTING and service status to DEPLOYING
-        continuum_utils.reset_service_component_starting(entity_id=service_id)
-        continuum_utils.reset_service_deploying(entity_id=service_id)
-    try:
-        kafka_client.produce_message(service_id=service_id)
-    except KafkaException as ex:
-        logger.error("Redpanda failure,HLO pipeline broken: %s", ex)
+        result = continuum_utils.restart_service(entity_id=service_id,
+                                                 snapshot=snapshot)
+        if result["errors"]:
+            return {
+                "serviceId": service_id,
+                "status": "failed to restart service",
+                "errors": result["errors"]
+            }
+    outbox.publish_fe2data(service_id=service_id)
+    return {"serviceId": service_id, "status": "service re-allocation initiated"}
 
 
 @router.patch(
@@ -255,67 +608,101 @@ def run_re_allocate_service(service_id: str):
             "description": "Bad Request"
         }
     },
-    openapi_extra={
-        "requestBody": {
-            "content": {
-                "application/x-yaml": {
-                    "example": TOSCA_YAML_EXAMPLE
-                }
-            },
-            "required": True,
-        },
-    },
+    openapi_extra={"requestBody": TOSCA_REQUEST_BODY},
 )
 async def change_service_allocation_paramters(service_id: str,
-                                              tosca_yaml: str = Body(
-                                                  ...,
-                                                  example=TOSCA_YAML_EXAMPLE)):
+                                              request: Request):
     '''
     Update service allocation parameters
+    TOSCA body as yaml, json or protobuf, chosen by Content-Type
     '''
-    # logger.info('TOSCA file recieved: %s', tosca_yaml)
-    tosca_obj = validate_tosca(tosca_yaml=tosca_yaml)
+    tosca_obj = await read_tosca(request)
     # logger.info('Translated tosca request: %s', tosca_obj)
 
     if not tosca_obj:
         raise HTTPException(status_code=400,
                             detail="Invalid Service Parameters")
-    if not continuum_utils.check_service_exists(service_id=service_id):
+    if not await async_continuum_utils.check_service_exists(
+            service_id=service_id):
         raise HTTPException(status_code=404, detail="Service not found")
 
-    client = FeEngine()
-    tocsa_jsonld = client.tosca2jsonld(service_id=service_id,
-                                       tosca_dict=tosca_obj)
-    logger.info("SERVICE RECEIVED FROM TOSCA ")
-    logger.info("SERVICE PYDANTIC FROM TOSCA CREATED ")
-    logger.info(
-        "PLEASE CREATE NGSI-LD entities FROM PYDANTIC AND UPDATE ALL RELATED ENTITIES TO ORION-CB"
-    )
-    logger.info("PUSHING SERVICE ID RECEIVED ")
-    client.allocate_service(service_id=service_id, tosca_jsonld=tocsa_jsonld)
-
-    ## FIXME: Map TOSCA to NGSI-LD
-    ## FIXME: create service component IDs based on service ID
-    ##         and update their status
-    for scomponent_id in [
-            "urn:ngsi-ld:Service:05:Component:01",
-            "urn:ngsi-ld:Service:05:Component:02"
-    ]:
-        continuum_utils.set_service_component_status(
-            service_id=service_id,
-            scomponent_id=
-            scomponent_id,  # FIXME: create actual scomponent and ids
-            scomponent_status=ServiceComponentStatusEnum.LOCATING
-        )  # FIXME: is correct?
+    # Serialized with the other lifecycle operations on the service,
+    # every update diffs against the writes of the previous one, so none is merged
+    result = await to_thread(lifecycle_guard.run,
+                             service_id,
+                             "update",
+                             run_update_service,
+                             service_id=service_id,
+                             tosca_obj=tosca_obj,
+                             coalesce=False)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Service not found")
+    if result.get("errors"):
+        return JSONResponse(status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                            content=result)
+    return result
 
-    try:
-        kafka_client.produce_message(service_id=service_id)
-    except KafkaException as ex:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Redpanda failure,HLO pipeline broken: {ex}") from ex
 
-    return {"status": "service allocation parameters change initiated"}
+def run_update_service(service_id: str, tosca_obj) -> Optional[dict]:
+    '''
+    Update the service to a new TOSCA, writing only what changed
+    @service_id: the id of the updated service
+    @tosca_obj: TOSCA modeled service
+    :return outcome, None if the service does not exist
+    '''
+    json_entities = aeriOS_json_generator.aeriOSContinuumEnitiesGenerator(
+        service_id=service_id, tosca_obj=tosca_obj).run()
+    if not json_entities:
+        logger.error("Failed to create aeriOS entities for service %s update",
+                     service_id)
+        return {
+            "serviceId": service_id,
+            "status": "failed to create all aeriOS entities for service update",
+            "errors": [{
+                "entityId": service_id,
+                "error": {
+                    "title": "aeriOS entities generation failed"
+                }
+            }]
+        }
+    try:
+        current = service_diff.get_service_entities(service_id)
+    except cb_client.CBQueryError as e:
+        # A partial view would recreate the entities it misses, nothing is written
+        logger.error("Stored entities of service %s not read: %s", service_id,
+                     e)
+        return {
+            "serviceId": service_id,
+            "status": "failed to read stored service entities",
+            "errors": [{
+                "entityId": service_id,
+                "error": {
+                    "title": "stored service entities could not be read"
+                }
+            }]
+        }
+    if current is None:
+        return None
+    diff = service_diff.diff_service(
+        service_id,
+        aeriOS_ngsild.aeriOSNgsild(json_entities).get_ngsild_entities(),
+        current)
+    if diff.is_empty():
+        return {"serviceId": service_id, "status": "no changes"}
+    result = service_diff.apply_service_diff(diff)
+    if result["errors"]:
+        return {
+            "serviceId": service_id,
+            "status": "failed to update service entities",
+            "errors": result["errors"],
+            **diff.summary()
+        }
+    outbox.publish_fe2data(service_id=service_id)
+    return {
+        "serviceId": service_id,
+        "status": "service allocation parameters change initiated",
+        **diff.summary()
+    }
 
 
 @router.delete("/hlo_fe/services/{service_id}",
@@ -334,26 +721,47 @@ async def deallocate_service(service_id: str):
     '''
     logger.info('Service id: %s', service_id)
 
-    if not continuum_utils.check_service_exists(service_id=service_id):
+    # Concurrent deallocations of the same service are merged into one execution
+    result = await to_thread(lifecycle_guard.run, service_id, "deallocate",
+                             run_deallocate_service, service_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Service not found")
+    if result.get("errors"):
+        return JSONResponse(status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                            content=result)
+    return result
 
-    # Update service components status to Stopping and service action type to destroying
-    success: bool = True
-    success &= continuum_utils.set_service_components_removing(
-        entity_id=service_id)
-    try:
-        if success:
-            kafka_client.produce_message(service_id=service_id)
-            continuum_utils.set_service_destroying(entity_id=service_id)
-            message = "service deallocation initiated"
-        else:
-            message = "Can not deallocate when service component(s) not in Running or Failed state"
-    except KafkaException as ex:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Redpanda failure,HLO pipeline broken: {ex}") from ex
 
-    return {"status": message}
+def run_deallocate_service(service_id: str) -> Optional[dict]:
+    '''
+    Run the service deallocation
+    The snapshot is read under the lifecycle guard, so it reflects the completed
+      effects of any other operation on the service
+    @service_id: the id of the service to deallocate
+    :return outcome, None when service does not exist
+    '''
+    try:
+        snapshot = continuum_utils.get_service_snapshot(service_id=service_id)
+    except cb_client.CBQueryError as e:
+        return service_read_failed(service_id, e)
+    if not snapshot:
+        return None
+    # Update service components status to Removing and service action type to destroying
+    stoppable, result = continuum_utils.stop_service(entity_id=service_id,
+                                                     snapshot=snapshot)
+    if result["errors"]:
+        # Deployment engines are not notified of a half written stop
+        return {
+            "status": "failed to update service status",
+            "errors": result["errors"]
+        }
+    if stoppable:
+        outbox.publish_fe2data(service_id=service_id)
+        return {"status": "service deallocation initiated"}
+    return {
+        "status":
+        "Can not deallocate when service component(s) not in Running or Failed state"
+    }
 
 
 @router.delete("/hlo_fe/services/{service_id}/purge",
@@ -362,28 +770,180 @@ async def purge_service(service_id: str):
     """
     Asynchronously purge a service and its components from the Continuum.
     """
-    if not continuum_utils.check_service_exists(service_id=service_id):
-        raise HTTPException(status_code=404, detail="Service not found")
-    if not continuum_utils.check_service_can_be_purged(service_id=service_id):
-        raise HTTPException(
-            status_code=400,
-            detail="Service cannot be purged. Ensure it has beed stopped."
-        )
-    
     try:
 
-        # Call the sync purge function in a thread-safe way
-        await to_thread(continuum_utils.delete_from_continuum_service_by_id,
-                        service_id)
-        return JSONResponse(
-            status_code=HTTP_200_OK,
-            content={"message": f"Service '{service_id}' has been purged successfully."}
-        )
+        # Call the sync purge function in a thread-safe way,
+        # concurrent purges of the same service are merged into one execution
+        summary = await to_thread(lifecycle_guard.run, service_id, "purge",
+                                  run_purge_service, service_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to purge service {service_id}: {str(e)}"
         ) from e
+    status_index.forget(service_id)
+    if summary["failed"]:
+        return JSONResponse(
+            status_code=HTTP_207_MULTI_STATUS,
+            content={"message": f"Service '{service_id}' has been partially purged.",
+                     **summary}
+        )
+    return JSONResponse(
+        status_code=HTTP_200_OK,
+        content={"message": f"Service '{service_id}' has been purged successfully.",
+                 **summary}
+    )
+
+
+def run_purge_service(service_id: str) -> dict:
+    '''
+    Check and purge a service under the lifecycle guard,
+      so it can not be restarted between the check and the deletes
+    @service_id: the id of the service to purge
+    :return purge summary, raises HTTPException 404 or 400
+    '''
+    snapshot = continuum_utils.get_service_snapshot(service_id=service_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Service not found")
+    if not continuum_utils.check_service_can_be_purged(service_id=service_id,
+                                                       snapshot=snapshot):
+        raise HTTPException(
+            status_code=400,
+            detail="Service cannot be purged. Ensure it has beed stopped."
+        )
+    return continuum_utils.delete_from_continuum_service_by_id(
+        service_id, snapshot)
+
+
+@router.get("/hlo_fe/jobs/{job_id}",
+            response_model=JobStatusResponse,
+            responses={
+                200: {
+                    "description": "Success"
+                },
+                404: {
+                    "model": JobNotFound,
+                    "description": "Bad Request"
+                }
+            })
+async def get_job_status(job_id: str):
+    '''
+    Get allocation job status
+    '''
+    job = job_queue.get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_response()
+
+
+@router.get("/hlo_fe/admin/jobs", status_code=HTTP_200_OK)
+async def get_job_queue_stats():
+    '''
+    Report allocation job queue depth and worker usage
+    '''
+    return job_queue.get_job_queue().stats()
+
+
+@router.get("/hlo_fe/admin/lifecycle", status_code=HTTP_200_OK)
+async def get_lifecycle_stats():
+    '''
+    Report executed and coalesced service lifecycle operations
+    '''
+    return lifecycle_guard.stats()
+
+
+@router.get("/hlo_fe/admin/cb/cache", status_code=HTTP_200_OK)
+async def get_cb_cache_stats():
+    '''
+    Report CB entity cache hits, misses and size
+    '''
+    return entity_cache.get_entity_cache_stats()
+
+
+@router.delete("/hlo_fe/admin/cb/cache", status_code=HTTP_200_OK)
+async def clear_cb_cache():
+    '''
+    Drop all cached CB query results
+    '''
+    cache = entity_cache.get_entity_cache()
+    if cache is not None:
+        cache.clear()
+    return entity_cache.get_entity_cache_stats()
+
+
+@router.get("/hlo_fe/admin/host_domain", status_code=HTTP_200_OK)
+async def get_host_domain_stats():
+    '''
+    Report the memoized host domain id
+    '''
+    return host_domain.host_domain_cache.stats()
+
+
+@router.post("/hlo_fe/admin/host_domain/refresh", status_code=HTTP_200_OK)
+async def refresh_host_domain():
+    '''
+    Resolve the host domain id from CB again
+    '''
+    await to_thread(host_domain.host_domain_cache.refresh)
+    return host_domain.host_domain_cache.stats()
+
+
+@router.get("/hlo_fe/admin/status_index", status_code=HTTP_200_OK)
+async def get_status_index_stats():
+    '''
+    Report service component status index size and hits
+    '''
+    return status_index.stats()
+
+
+@router.get("/hlo_fe/admin/status_stream", status_code=HTTP_200_OK)
+async def get_status_stream_stats():
+    '''
+    Report watched services and connected watchers
+    '''
+    return status_hub.stats()
+
+
+@router.get("/hlo_fe/admin/cb/breaker", status_code=HTTP_200_OK)
+async def get_cb_breaker_state():
+    '''
+    Report CB circuit breaker state and error rate
+    '''
+    return cb_client.cb_breaker.stats()
+
+
+@router.get("/hlo_fe/admin/cb/timeouts", status_code=HTTP_200_OK)
+async def get_cb_timeouts():
+    '''
+    Report adaptive CB timeouts and latency estimates per operation
+    '''
+    return get_cb_timeouts_stats()
+
+
+@router.get("/hlo_fe/admin/tosca_cache", status_code=HTTP_200_OK)
+async def get_tosca_cache():
+    '''
+    Report validated TOSCA cache size and hit ratio
+    '''
+    return tosca_cache.stats()
+
+
+@router.get("/hlo_fe/admin/cb/pool", status_code=HTTP_200_OK)
+async def get_cb_pool_stats():
+    '''
+    Report CB keep-alive connection pool usage
+    '''
+    return cb_client.get_cb_pool_stats()
+
+
+@router.get("/hlo_fe/admin/outbox", status_code=HTTP_200_OK)
+async def get_outbox_stats():
+    '''
+    Report fe2data notifications waiting in the outbox
+    '''
+    return outbox.get_outbox().stats()
 
 
 # @router.get(
@@ -1,9 +1,9 @@
 """
     Class that transforms TOSCA to aeriOS JSON entities.
 """
+import hashlib
 import re
-import uuid
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Set, Tuple, Optional
 from app.app_models import tosca_models
 import app.app_models.aeriOS_continuum as aeriOS_c
 import app.utils.continuum_utils as c_utils
@@ -20,6 +20,20 @@ def extract_number(text):
     return None
 
 
+def network_port_id(scomponent_id: str, port_name: str, attempt: int = 0) -> str:
+    """
+        Deterministic NetworkPort id, the same service component port gets the same id
+        on every allocation, so its entity is upserted instead of piling up.
+        scomponent_id already carries the service id and the component name,
+        attempt > 0 derives another id on collision.
+    """
+    key = f"{scomponent_id}|{port_name}"
+    if attempt:
+        key += f"|{attempt}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return f"urn:ngsi-ld:NetworkPort:{digest}"
+
+
 class aeriOSContinuumEnitiesGenerator:
     """
         Class genrates aeriOS NGSILD entities from TOSCA
@@ -33,6 +47,7 @@ class aeriOSContinuumEnitiesGenerator:
         self.tosca_obj = tosca_obj
         self.host_domain = c_utils.get_host_domain()
         self.expose_ports = False
+        self.port_ids: Set[str] = set()
 
     def get_scomponent_env_vars(self, env_vars: List) -> List[Dict]:
         '''
@@ -92,8 +107,22 @@ class aeriOSContinuumEnitiesGenerator:
 
         return "", None, None, None
 
+    def get_port_id(self, scomponent_id: str, port_name: str) -> str:
+        """
+            Id of a service component port, unique among the ports of the service
+            (a port name repeated in several network requirements gets the next attempt)
+        """
+        attempt = 0
+        port_id = network_port_id(scomponent_id, port_name)
+        while port_id in self.port_ids:
+            attempt += 1
+            port_id = network_port_id(scomponent_id, port_name, attempt)
+        self.port_ids.add(port_id)
+        return port_id
+
     def get_network_requrierements(
-            self, requirements: List[tosca_models.NetworkRequirement]) -> List:
+            self, requirements: List[tosca_models.NetworkRequirement],
+            scomponent_id) -> List:
         """
             Get service component network requirements
         """
@@ -108,9 +137,8 @@ class aeriOSContinuumEnitiesGenerator:
                     self.expose_ports = value
                 elif cap_key == "ports":
                     exposed_port = value  # just for clarity
-                    for _, port_properties in exposed_port.items():
-                        uid = uuid.uuid4().hex[:8]
-                        port_id = f"urn:ngsi-ld:NetworkPort:{uid}"
+                    for port_name, port_properties in exposed_port.items():
+                        port_id = self.get_port_id(scomponent_id, port_name)
                         port_type = "NetworkPort"
                         port_number = port_properties.properties.source
                         # FIXME aeriOS continuum has it as string, tosca sends list[str].
@@ -216,7 +244,7 @@ class aeriOSContinuumEnitiesGenerator:
             req_net_key, req_value = network_requirement
             if req_value:
                 network_ports_ids = self.get_network_requrierements(
-                    requirements=req_value)
+                    requirements=req_value, scomponent_id=scomponent_id)
             elif network_ports_ids is None:
                 network_ports_ids = []
 
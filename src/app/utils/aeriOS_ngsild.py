@@ -1,7 +1,7 @@
 """"
     Module for conformance with NGSI-LD data model and API
 """
-from typing import List, Dict
+from typing import List, Dict, Optional
 import app.app_models.aeriOS_continuum as aeriOS_c
 from app.api_clients.cb_client import CBClient
 from app.utils.log import get_app_logger
@@ -18,12 +18,17 @@ class aeriOSNgsild:
         self.logger = get_app_logger()
         self.cb_client = CBClient()
         self.success = True
+        self.failed_entities: List[Dict] = []
         self.aeriOS_json = aeriOS_json
 
     def run(self):
         """
             Class executor
+            Service is created alone, as a 409 on it drives the restart flow,
+            all other entities have deterministic ids and are upserted with batch entity operations,
+            so entities left over by an earlier allocation are replaced, not duplicated
         """
+        entities = []
         for item in self.aeriOS_json:
             if isinstance(item, aeriOS_c.Service):
                 r = self.create_service_entity(item)
@@ -32,22 +37,90 @@ class aeriOSNgsild:
                 # So we restart it, which means:
                 #  a) set service components to Starting state and b) service action type to Seploying
                 if r == 409:
-                    continuum_utils.reset_service_component_starting(
-                        entity_id=item.id)
-                    continuum_utils.reset_service_deploying(entity_id=item.id)
-                    return True
-            if isinstance(item, aeriOS_c.ServiceComponent):
-                self.create_service_component_entity(item)
-            if isinstance(item, aeriOS_c.InfrastructureElementRequirements):
-                self.create_ie_requirements_entity(item)
-            if isinstance(item, aeriOS_c.NetworkPort):
-                self.create_network_port_entity(item)
+                    result = continuum_utils.restart_service(entity_id=item.id)
+                    if result is None:
+                        self.logger.error('Service %s to restart not found',
+                                          item.id)
+                        self.success = False
+                    else:
+                        self.failed_entities.extend(result['errors'])
+                        self.success &= not result['errors']
+                    return self.success
+                continue
+            entity = self.get_ngsild_entity(item)
+            if entity is not None:
+                entities.append(entity)
+        self.upsert_entities(entities)
         return self.success
 
+    def get_ngsild_entities(self) -> List[Dict]:
+        """
+            NGSI-LD entities of all aeriOS items, Service included, without creating them
+        """
+        entities = []
+        for item in self.aeriOS_json:
+            entity = self.get_ngsild_entity(item)
+            if entity is not None:
+                entities.append(entity)
+        return entities
+
+    def get_ngsild_entity(self, item) -> Optional[Dict]:
+        """
+            NGSI-LD entity of one aeriOS item
+        """
+        if isinstance(item, aeriOS_c.Service):
+            return self.get_service_entity(item)
+        if isinstance(item, aeriOS_c.ServiceComponent):
+            return self.get_service_component_entity(item)
+        if isinstance(item, aeriOS_c.InfrastructureElementRequirements):
+            return self.get_ie_requirements_entity(item)
+        if isinstance(item, aeriOS_c.NetworkPort):
+            return self.get_network_port_entity(item)
+        return None
+
+    def upsert_entities(self, entities: List[Dict]):
+        """
+            Create or replace NGSI-LD entities in as few batch requests as possible
+            Per entity failures of the batch response are logged and kept in failed_entities
+        """
+        if not entities:
+            return
+        result = self.cb_client.batch_upsert(entities)
+        for entity_id in result['success']:
+            self.logger.info('Created entity with id: %s', entity_id)
+        for error in result['errors']:
+            self.logger.error('Failed to Create entity with id: %s, error: %s',
+                              error.get('entityId'), error.get('error'))
+        self.failed_entities.extend(result['errors'])
+        self.success &= not result['errors']
+
     def create_service_entity(self, item: aeriOS_c.Service):
         """
             Create Service NGSI-LD entity
         """
+        json_ld_service = self.get_service_entity(item)
+        succeeded = False
+        r = self.cb_client.create_entity(create_object=json_ld_service)
+        if r == 201:
+            succeeded = True
+            self.logger.info('Created entity with id: %s, entity: %s:',
+                             item.id, json_ld_service)
+        elif r == 409:
+            #FIXME: Service exists check status of service components and decide what to do
+            # For now just STOP process
+            self.logger.info('Service Entity with id: %s, exists. Entity: %s:',
+                             item.id, json_ld_service)
+            return 409
+        else:
+            self.logger.error(
+                'Failed to Create entity with id: %s, entity: %s:', item.id,
+                json_ld_service)
+        self.success &= succeeded
+
+    def get_service_entity(self, item: aeriOS_c.Service) -> Dict:
+        """
+            Service NGSI-LD entity
+        """
         json_ld_service = {
             "id": item.id,
             "type": "Service",
@@ -72,27 +145,12 @@ class aeriOSNgsild:
                 "value": item.hasOverlay
             }
         }
-        succeeded = False
-        r = self.cb_client.create_entity(create_object=json_ld_service)
-        if r == 201:
-            succeeded = True
-            self.logger.info('Created entity with id: %s, entity: %s:',
-                             item.id, json_ld_service)
-        elif r == 409:
-            #FIXME: Service exists check status of service components and decide what to do
-            # For now just STOP process
-            self.logger.info('Service Entity with id: %s, exists. Entity: %s:',
-                             item.id, json_ld_service)
-            return 409
-        else:
-            self.logger.error(
-                'Failed to Create entity with id: %s, entity: %s:', item.id,
-                json_ld_service)
-        self.success &= succeeded
+        return json_ld_service
 
-    def create_service_component_entity(self, item: aeriOS_c.ServiceComponent):
+    def get_service_component_entity(self,
+                                     item: aeriOS_c.ServiceComponent) -> Dict:
         """
-            Create Service Component NGSI-LD entity
+            Service Component NGSI-LD entity
         """
         json_ld_service_component = {
             "id": f"{item.id}",
@@ -112,25 +170,12 @@ class aeriOSNgsild:
             **({"repoPassword": {"type": "Property", "value": item.repoPassword}} if item.repoPassword else {}),
             # **({"sla": {"type": "Property", "value": item.sla}} if item.sla and item.sla != "urn:ngsi-ld:null" else {}),
         }
+        return json_ld_service_component
 
-        # print(json_ld_service_component)
-        succeeded = False
-        r = self.cb_client.create_entity(
-            create_object=json_ld_service_component)
-        if r == 201:
-            succeeded = True
-            self.logger.info('Created entity with id: %s, entity: %s:',
-                             item.id, json_ld_service_component)
-        else:
-            self.logger.error(
-                'Failed to Create entity with id: %s, entity: %s:', item.id,
-                json_ld_service_component)
-        self.success &= succeeded
-
-    def create_ie_requirements_entity(
-            self, item: aeriOS_c.InfrastructureElementRequirements):
+    def get_ie_requirements_entity(
+            self, item: aeriOS_c.InfrastructureElementRequirements) -> Dict:
         """
-            Create Service IE Requirments NGSI-LD entity
+            Service IE Requirments NGSI-LD entity
         """
         json_ld_ie_requirments = {
             "id": item.id,
@@ -144,22 +189,11 @@ class aeriOSNgsild:
             **({"greenEnergyRatio": {"type": "Property", "value": item.greenEnergyRatio}} if item.greenEnergyRatio is not None else {}),
             **({'domainId': {"type": "Relationship", "object": item.domainId}} if item.domainId and item.domainId != "urn:ngsi-ld:null" else {})
         }
+        return json_ld_ie_requirments
 
-        # print(json_ld_ie_requirments)
-        succeeded = False
-        r = self.cb_client.create_entity(create_object=json_ld_ie_requirments)
-        if r == 201:
-            succeeded = True
-            self.logger.info('Created entity with id: %s, entity: %s:',
-                             item.id, json_ld_ie_requirments)
-        else:
-            self.logger.info('Failed to Creat entity with id: %s, entity: %s:',
-                             item.id, json_ld_ie_requirments)
-        self.success &= succeeded
-
-    def create_network_port_entity(self, item: aeriOS_c.NetworkPort):
+    def get_network_port_entity(self, item: aeriOS_c.NetworkPort) -> Dict:
         """
-            Create Service Nertwork Port NGSI-LD entity
+            Service Nertwork Port NGSI-LD entity
         """
         json_ld_network_port = {
             "id": item.id,
@@ -173,13 +207,4 @@ class aeriOSNgsild:
                 "value": item.portProtocol
             }
         }
-        succeeded = False
-        r = self.cb_client.create_entity(create_object=json_ld_network_port)
-        if r == 201:
-            succeeded = True
-            self.logger.info('Created entity with id: %s, entity: %s:',
-                             item.id, json_ld_network_port)
-        else:
-            self.logger.info('Created entity with id: %s, entity: %s:',
-                             item.id, json_ld_network_port)
-        self.success &= succeeded
+        return json_ld_network_port
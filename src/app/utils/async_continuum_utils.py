@@ -0,0 +1,59 @@
+'''
+ Async counterparts of continuum_utils read helpers,
+ awaited by the FastAPI endpoints so CB I/O does not block the event loop
+'''
+from typing import Optional
+from app.api_clients.async_cb_client import AsyncCBClient
+from app.api_clients.ngsild_query import NgsiLdQuery
+from app.utils.continuum_utils import service_components_query
+from app.utils.status_index import status_index
+
+
+async def check_service_exists(service_id: str) -> bool:
+    '''
+    Check if service  exists
+    Not projected: CB answers 404 for an entity without any of the projected attributes
+    :param  service_id: id of the service of which part is service component
+    :return True or False
+    '''
+    cb_client = AsyncCBClient()
+    jsonld_params = NgsiLdQuery()
+    service_json = await cb_client.query_entity(entity_id=service_id,
+                                                ngsild_params=jsonld_params)
+    if service_json is not None and service_json.get('type') is not None:
+        return True
+    return False
+
+
+async def get_service_status(service_id: str):
+    """
+    Return a list of all components of a service with status
+    :param service_id: id of service
+    :return list of json objects
+    """
+    cb_client = AsyncCBClient()
+    service_components_status_list = [
+        scomponent async for scomponent in cb_client.iter_entities(
+            service_components_query(service_id, ['serviceComponentStatus']))
+    ]
+    return service_components_status_list
+
+
+async def get_indexed_service_status(service_id: str) -> Optional[list]:
+    """
+    Return a list of all components of a service with status,
+    from the status index when it holds the service
+    :param service_id: id of service
+    :return list of json objects or None if service does not exist
+    """
+    if status_index.enabled:
+        components = status_index.get(service_id)
+        if components is not None:
+            return components
+    started_at = status_index.load_started()
+    if not await check_service_exists(service_id=service_id):
+        return None
+    components = await get_service_status(service_id=service_id)
+    if status_index.enabled and components is not None:
+        status_index.load(service_id, components, started_at)
+    return components
@@ -1,21 +1,35 @@
 '''
  Docstring
 '''
-from typing import List, Dict
-from app.api_clients.cb_client import CBClient
+from typing import List, Optional, Set, Tuple
+from app import config
+from app.api_clients.cb_client import CBClient, CBQueryError
+from app.api_clients.ngsild_query import NgsiLdQuery
 import app.app_models.aeriOS_continuum as aeriOS_C
 from app.app_models.aeriOS_continuum import ServiceComponentStatusEnum as status
 from app.app_models.aeriOS_continuum import ServiceActionTypeEnum
+from app.utils import host_domain
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+# Attributes read by ServiceSnapshot
+SERVICE_SNAPSHOT_ATTRS = ['actionType', 'domainHandler']
+COMPONENT_SNAPSHOT_ATTRS = [
+    'serviceComponentStatus', 'infrastructureElementRequirements',
+    'networkPorts'
+]
 
 
 def check_service_exists(service_id: str) -> bool:
     '''
     Check if service  exists
+    Not projected: CB answers 404 for an entity without any of the projected attributes
     :param  service_id: id of the service of which part is service component
     :return True or False
     '''
     cb_client = CBClient()
-    jsonld_params = 'format=simplified'
+    jsonld_params = NgsiLdQuery()
     service_json = cb_client.query_entity(entity_id=service_id,
                                           ngsild_params=jsonld_params)
     if service_json is not None and service_json.get('type') is not None:
@@ -23,6 +37,73 @@ def check_service_exists(service_id: str) -> bool:
     return False
 
 
+def get_existing_services(service_ids: List[str]) -> Set[str]:
+    '''
+    Which of the services exist, with one query per page of ids
+    instead of one query per service
+    :param  service_ids: ids of the services
+    :return ids of the existing services
+    '''
+    cb_client = CBClient()
+    existing = set()
+    page_size = config.CB_PAGE_SIZE
+    for start in range(0, len(service_ids), page_size):
+        ids = service_ids[start:start + page_size]
+        existing.update(
+            service.get('id') for service in cb_client.iter_entities(
+                NgsiLdQuery(entity_type='Service', ids=ids)))
+    return existing
+
+
+def service_components_query(service_id: str,
+                             attrs: List[str]) -> NgsiLdQuery:
+    '''
+    Query of the Service Components of a service, projected on attrs
+    '''
+    return NgsiLdQuery(entity_type='ServiceComponent',
+                       attrs=attrs).where('service', service_id)
+
+
+def get_service_snapshot(service_id: str) -> Optional[aeriOS_C.ServiceSnapshot]:
+    '''
+    Get the Service and the status of all its Service Components
+    with one query for the service and one for its components
+    :param  service_id: id of the service
+    :return ServiceSnapshot or None if service does not exist
+    Raises CBQueryError when the components can not be read,
+      a service is never seen as one without components
+    '''
+    cb_client = CBClient()
+    service_json = cb_client.query_entity(
+        entity_id=service_id,
+        ngsild_params=NgsiLdQuery(attrs=SERVICE_SNAPSHOT_ATTRS))
+    if service_json is None or service_json.get('type') is None:
+        return None
+    service_components_json = list(
+        cb_client.iter_entities(
+            service_components_query(service_id, COMPONENT_SNAPSHOT_ATTRS)))
+    return build_service_snapshot(service_json, service_components_json)
+
+
+def build_service_snapshot(service_json: dict,
+                           service_components_json: List[dict]
+                           ) -> aeriOS_C.ServiceSnapshot:
+    '''
+    Build ServiceSnapshot from simplified NGSI-LD service and service components
+    '''
+    if service_components_json is None:
+        raise CBQueryError(
+            f"Service components of {service_json.get('id')} were not read")
+    return aeriOS_C.ServiceSnapshot(
+        id=service_json.get('id'),
+        actionType=service_json.get('actionType'),
+        domainHandler=service_json.get('domainHandler'),
+        components=[
+            aeriOS_C.ServiceComponentSnapshot(**scomponent)
+            for scomponent in service_components_json
+        ])
+
+
 def get_service_status(service_id: str):
     """
     Return a list of all components of a service with status
@@ -35,9 +116,9 @@ def get_service_status(service_id: str):
     }]
     """
     cb_client = CBClient()
-    service_components_status_list = cb_client.query_entities(
-        f'type=ServiceComponent&attrs=serviceComponentStatus&q=service=="{service_id}"&format=simplified'
-    )
+    service_components_status_list = list(
+        cb_client.iter_entities(
+            service_components_query(service_id, ['serviceComponentStatus'])))
     return service_components_status_list
 
 
@@ -50,7 +131,8 @@ def check_service_component_exists(service_id: str,
     :return True or False
     '''
     cb_client = CBClient()
-    jsonld_params = f'format=simplified&q=service=="{service_id}"'
+    jsonld_params = NgsiLdQuery(attrs=['serviceComponentStatus']).where(
+        'service', service_id)
     scomponent_json = cb_client.query_entity(entity_id=service_component_id,
                                              ngsild_params=jsonld_params)
     if scomponent_json is not None and scomponent_json.get(
@@ -60,21 +142,6 @@ def check_service_component_exists(service_id: str,
     return False
 
 
-def set_service_component_status(service_id, scomponent_id,
-                                 scomponent_status: str):
-    """
-        Set the status for a service component in CB
-    """
-    cb_client = CBClient()
-    data = {
-        "serviceComponentStatus": {
-            "type": "Relationship",
-            "object": scomponent_status
-        }
-    }
-    cb_client.patch_entity(entity_id=scomponent_id, upd_object=data)
-
-
 def set_service_component_status_attr(service_id, scomponent_id,
                                       scomponent_status: str):
     """
@@ -124,227 +191,231 @@ def set_service_component_ie_attr(service_id, scomponent_id,
                                 upd_object=data)
 
 
-def get_service_component_status(service_component_id: str,
-                                 service_id: str = ""):
-    '''
-    Check if service component exists
-    :param  service_id: id of the service of which part is service component
-    :param  service_component_id: id of the service component id
-    :return ServiceComponentStatusEnum
-    '''
-    # FIXME: it is dangerous
-    # In fact , we do not need it. It gets paranoid, servicecomponentId already contains service id and a uuid
-    # if not service_id:
-    #     # based on the naming convention: [urn:ngsi-ld]:[Service:05]:[Component:02]
-    #     # Being paranoid? We could do without it also...
-    #     scomponent_id = service_component_id
-    #     parts = scomponent_id.split(':')
-    #     service_id = ':'.join(parts[:4])
-    cb_client = CBClient()
-    jsonld_params = 'format=simplified'
-    scomponent_json = cb_client.query_entity(entity_id=service_component_id,
-                                             ngsild_params=jsonld_params)
-    if scomponent_json is not None and scomponent_json.get(
-            'serviceComponentStatus') is not None:
-        return scomponent_json.get('serviceComponentStatus')
-    return None
-
-
-def get_service_components_list(entity_id: str) -> List[str]:
+def component_status_fragment(scomponent_id: str,
+                              scomponent_status: str) -> dict:
     """
-        Get a list with all ids of service components of a service
+        Batch update fragment setting the status of a service component
     """
-    cb_client = CBClient()
-    scomponents_id_list = []
-    service_components_list_json = cb_client.query_entities(
-        f'format=simplified&type=ServiceComponent&q=service=="{entity_id}"')
-    for scomponent in service_components_list_json:
-        scomponents_id_list.append(scomponent.get('id'))
-    return scomponents_id_list
+    return {
+        "id": scomponent_id,
+        "type": "ServiceComponent",
+        "serviceComponentStatus": {
+            "type": "Relationship",
+            "object": scomponent_status
+        }
+    }
 
 
-def reset_service_component_starting(
-        entity_id) -> List[aeriOS_C.ServiceComponent]:
+def service_action_fragment(service_id: str, action_type: str,
+                            domain_handler: str = None) -> dict:
     """
-    Get service components from CB
+        Batch update fragment setting the action type (and domain handler) of a service
     """
-    cb_client = CBClient()
-
-    service_components_list_json = cb_client.query_entities(
-        f'format=simplified&type=ServiceComponent&q=service=="{entity_id}"')
-    service_components_py = [
-        aeriOS_C.ServiceComponent(**item)
-        for item in service_components_list_json
-    ]
-    for scomponent in service_components_py:
-        if scomponent.serviceComponentStatus in [
-                status.FAILED, status.FINISHED
-        ]:
-            set_service_component_status(service_id="",
-                                         scomponent_id=scomponent.id,
-                                         scomponent_status=status.STARTING)
+    fragment = {
+        "id": service_id,
+        "type": "Service",
+        "actionType": {
+            "type": "Property",
+            "value": action_type
+        }
+    }
+    if domain_handler:
+        fragment["domainHandler"] = {
+            "type": "Relationship",
+            "object": domain_handler
+        }
+    return fragment
 
 
-def set_service_components_removing(
-        entity_id) -> List[aeriOS_C.ServiceComponent]:
+def write_status_batch(fragments: List[dict]) -> dict:
     """
-    Get service components from CB
+    Send status changes of a service and its components as one batch update
+    :return per entity success and errors of the batch
     """
-    cb_client = CBClient()
-
-    service_components_list_json = cb_client.query_entities(
-        f'format=simplified&type=ServiceComponent&q=service=="{entity_id}"')
-    service_components_py = [
-        aeriOS_C.ServiceComponent(**item)
-        for item in service_components_list_json
-    ]
-    for scomponent in service_components_py:
-        in_state_running: bool = True
-        if scomponent.serviceComponentStatus in [
-                status.RUNNING, status.FAILED
-        ]:
-            set_service_component_status(service_id="",
-                                         scomponent_id=scomponent.id,
-                                         scomponent_status=status.REMOVING)
-        else:
-            in_state_running = False
-    return in_state_running
+    if not fragments:
+        return {"success": [], "errors": []}
+    result = CBClient().batch_update(fragments)
+    for error in result["errors"]:
+        logger.error("Status update of %s failed: %s", error.get("entityId"),
+                     error.get("error"))
+    return result
 
 
-def get_host_domain():
+def restart_service(
+        entity_id,
+        snapshot: Optional[aeriOS_C.ServiceSnapshot] = None) -> Optional[dict]:
     """
-    Get local domain id
-    local=true in ngsi-ld returns domain tha is localy registred in Orion-ld,
-    The only locally registered domain is ...local domain
-    Returns:
-      id of host domain
+    Restart a stopped service in one batch:
+    Failed or Finished service components to Starting,
+    service action type to Deploying on the host domain
+    :param entity_id: id of the service
+    :param snapshot: already fetched service snapshot, fetched if not given
+    :return result of the batch, None when the service does not exist
     """
-    cb_client = CBClient()
-    jsonld_params = 'type=Domain&format=simplified&local=true&attrs=publicUrl'
-    domain_json = cb_client.query_entities(ngsild_params=jsonld_params)
-    # We are confident about [0] because each domain has just one domain registered locally
-    if domain_json:
-        return domain_json[0].get("id")
-    else:
+    if snapshot is None:
+        snapshot = get_service_snapshot(entity_id)
+    if snapshot is None:
         return None
+    fragments = [
+        component_status_fragment(scomponent.id, status.STARTING) for scomponent
+        in snapshot.components_in([status.FAILED, status.FINISHED])
+    ]
+    fragments.append(
+        service_action_fragment(entity_id, ServiceActionTypeEnum.DEPLOYING,
+                                get_host_domain()))
+    return write_status_batch(fragments)
 
 
-def set_service_destroying(entity_id):
+def stop_service(
+        entity_id,
+        snapshot: Optional[aeriOS_C.ServiceSnapshot] = None
+) -> Tuple[bool, dict]:
     """
-    Set the action type destroying for service  in CB
-    Used when delete API endpoint for service called
-    Reset to None in Deployment Engine when delete request is handled.
+    Stop a service in one batch:
+    Running or Failed service components to Removing,
+    service action type to Destroying when all components could be stopped
+    :param entity_id: id of the service
+    :param snapshot: already fetched service snapshot, fetched if not given
+    :return whether all service components were Running or Failed, result of the batch
     """
-    cb_client = CBClient()
-    data = {
-        "actionType": {
-            "type": "Property",
-            "value": ServiceActionTypeEnum.DESTROYING
-        }
-    }
-    cb_client.patch_entity(entity_id=entity_id, upd_object=data)
+    if snapshot is None:
+        snapshot = get_service_snapshot(entity_id)
+    if snapshot is None:
+        return False, {"success": [], "errors": []}
+    removable = snapshot.components_in([status.RUNNING, status.FAILED])
+    fragments = [
+        component_status_fragment(scomponent.id, status.REMOVING)
+        for scomponent in removable
+    ]
+    stoppable = len(removable) == len(snapshot.components)
+    if stoppable:
+        fragments.append(
+            service_action_fragment(entity_id,
+                                    ServiceActionTypeEnum.DESTROYING))
+    return stoppable, write_status_batch(fragments)
 
 
-def reset_service_deploying(entity_id):
+def get_host_domain():
     """
-    Set the action type deploying for service  in CB
-    Used when delete API endpoint for start service 
-      called for a service that is already in CB but in a stopped (finished) state
-    Reset to None in Deployment Engine when delete request is handled.
+    Get local domain id
+    Resolved once from CB and kept in memory, see app.utils.host_domain
+    Returns:
+      id of host domain
     """
-    cb_client = CBClient()
-    data = {
-        "actionType": {
-            "type": "Property",
-            "value": ServiceActionTypeEnum.DEPLOYING
-        },
-        "domainHandler": {
-            "type": "Relationship",
-            "object": get_host_domain()
-        }
-    }
-    cb_client.patch_entity(entity_id=entity_id, upd_object=data)
+    return host_domain.get_host_domain()
 
 
-def check_service_can_be_purged(service_id: str) -> bool:
+def check_service_can_be_purged(
+        service_id: str,
+        snapshot: Optional[aeriOS_C.ServiceSnapshot] = None) -> bool:
     """
     Check if a service can be purged (deleted) from the system.
     A service can be purged if it is in a 'FINISHED' state and has no components.
     :param service_id: ID of the service to check
+    :param snapshot: already fetched service snapshot, fetched if not given
     :return: True if the service can be purged, False otherwise
     """
-    cb_client = CBClient()
-
-    query_str = "format=simplified&attrs=actionType"
-    # Get the status of the service
-    service_status = cb_client.query_entity(entity_id=service_id,
-                                            ngsild_params=query_str)
-    if service_status.get('actionType') in [ServiceActionTypeEnum.FINISHED, ServiceActionTypeEnum.HANDLED, ServiceActionTypeEnum.DESTROYING]:
+    if snapshot is None:
+        snapshot = get_service_snapshot(service_id)
+    if snapshot is None:
+        return False
+    if snapshot.actionType in [ServiceActionTypeEnum.FINISHED, ServiceActionTypeEnum.HANDLED, ServiceActionTypeEnum.DESTROYING]:
         return True
     return False
 
 
-def get_service_components_for_delete(entity_id: str) -> Dict[str, List[str]]:
+def _is_not_found(error: dict) -> bool:
     '''
-    Get all service components, network ports and infrastructure element requirements
-    for a given service entity.
-    :param entity_id: ID of the service entity
-    :return: Dictionary with lists of IDs for service components, network ports, and infrastructure element requirements
+    Batch delete error meaning the entity is already gone
     '''
-    cb_client = CBClient()
-
-    # Initialize result structure
-    result = {
-        "serviceComponentsIds": [],
-        "networkPortsList": [],
-        "InfrastructureElementRequirementsList": []
-    }
-
-    # Query all ServiceComponent entities for this service
-    service_components_list_json = cb_client.query_entities(
-        f'format=simplified&type=ServiceComponent&q=service=="{entity_id}"')
+    error = error or {}
+    return error.get('status') == 404 or str(
+        error.get('type', '')).endswith('ResourceNotFound')
 
-    # Iterate and collect IDs
-    for scomponent in service_components_list_json:
-        sc_id = scomponent.get("id")
-        if sc_id:
-            result["serviceComponentsIds"].append(sc_id)
 
-        # Collect infrastructureElementRequirements (if present)
-        ie_req = scomponent.get("infrastructureElementRequirements")
-        if ie_req:
-            result["InfrastructureElementRequirementsList"].append(ie_req)
-
-        # Collect networkPorts (if present)
-        network_ports = scomponent.get("networkPorts", [])
-        if isinstance(network_ports, list):
-            result["networkPortsList"].extend(network_ports)
-
-    return result
+def _delete_tier(cb_client: CBClient, entity_ids: List[str],
+                 summary: dict) -> set:
+    '''
+    Batch delete one tier of entities and record per entity results in summary
+    :return ids that were deleted or already gone
+    '''
+    if not entity_ids:
+        return set()
+    result = cb_client.batch_delete(entity_ids)
+    deleted = set(result['success'])
+    for error in result['errors']:
+        if _is_not_found(error.get('error')):
+            deleted.add(error.get('entityId'))
+        else:
+            summary['failed'].append(error)
+    summary['deleted'].extend(
+        entity_id for entity_id in entity_ids if entity_id in deleted)
+    return deleted
 
 
-def delete_from_continuum_service_by_id(service_id):
+def delete_from_continuum_service_by_id(
+        service_id, snapshot: Optional[aeriOS_C.ServiceSnapshot] = None) -> dict:
     """
     Purge service and all its components from continuum
+    Entities are deleted with batch requests, leaf entities first:
+    NetworkPorts and InfrastructureElementRequirements, then ServiceComponents, then the Service.
+    An entity is kept when one of the entities it references could not be deleted,
+    so a later purge can still find them.
+    The Service is only deleted once the snapshot components were read
+    and a new query finds no ServiceComponent left.
     :param service_id: id of the service to delete
-    :return: None
+    :param snapshot: already fetched service snapshot, fetched if not given
+    :return: {"deleted": [ids], "failed": [{"entityId": .., "error": {..}}], "kept": [ids]}
     """
     cb_client = CBClient()
+    summary = {'deleted': [], 'failed': [], 'kept': []}
+
+    if snapshot is None:
+        snapshot = get_service_snapshot(service_id)
+    if snapshot is None:
+        return summary
+
+    # NetworkPorts and InfrastructureElementRequirements reference nothing
+    leaf_ids = []
+    for scomponent in snapshot.components:
+        leaf_ids.extend(scomponent.networkPorts)
+        if scomponent.infrastructureElementRequirements:
+            leaf_ids.append(scomponent.infrastructureElementRequirements)
+    deleted = _delete_tier(cb_client, leaf_ids, summary)
+
+    # ServiceComponents whose leaf entities are all gone
+    component_ids = []
+    for scomponent in snapshot.components:
+        leafs = list(scomponent.networkPorts)
+        if scomponent.infrastructureElementRequirements:
+            leafs.append(scomponent.infrastructureElementRequirements)
+        if all(leaf in deleted for leaf in leafs):
+            component_ids.append(scomponent.id)
+        else:
+            summary['kept'].append(scomponent.id)
+    deleted |= _delete_tier(cb_client, component_ids, summary)
+
+    # The Service, when all its ServiceComponents are gone
+    # and CB confirms none is left (e.g. created after the snapshot)
+    if all(scomponent.id in deleted for scomponent in snapshot.components) \
+            and not _components_left(cb_client, service_id):
+        _delete_tier(cb_client, [service_id], summary)
+    else:
+        summary['kept'].append(service_id)
 
-    # Get all related IDs
-    summary = get_service_components_for_delete(service_id)
-
-    # Delete the main service entity
-    cb_client.delete_entity(entity_id=service_id)
-
-    # Delete all NetworkPort entities
-    for port_id in summary.get("networkPortsList", []):
-        cb_client.delete_entity(entity_id=port_id)
+    return summary
 
-    # Delete all InfrastructureElementRequirements entities
-    for ie_req_id in summary.get("InfrastructureElementRequirementsList", []):
-        cb_client.delete_entity(entity_id=ie_req_id)
 
-    # Delete all ServiceComponent entities
-    for component_id in summary.get("serviceComponentsIds", []):
-        cb_client.delete_entity(entity_id=component_id)
+def _components_left(cb_client: CBClient, service_id: str) -> bool:
+    '''
+    Whether ServiceComponents of a service are still in CB,
+    a failed query counts as components left
+    '''
+    try:
+        return any(
+            True for _ in cb_client.iter_entities(
+                service_components_query(service_id, ['service'])))
+    except CBQueryError as e:
+        logger.error('Service %s kept, its components could not be read: %s',
+                     service_id, e)
+        return True
@@ -1,29 +1,307 @@
 '''
 Docstring
 '''
-from requests.exceptions import RequestException, HTTPError, Timeout
+import asyncio
+import functools
+import json
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple
+import httpx
+from requests.exceptions import RequestException, HTTPError, Timeout,\
+    InvalidJSONError
+from requests.exceptions import ConnectionError as RequestsConnectionError
 from app.utils.log import get_app_logger
 
-def catch_requests_exceptions(func):
+
+class RetryPolicy:
+    '''
+        Retries of an idempotent call on transient failures
+        (connection errors, timeouts and retry_statuses),
+        with jittered exponential backoff between attempts
+    '''
+
+    def __init__(self,
+                 attempts: int,
+                 backoff_base: float,
+                 backoff_max: float,
+                 retry_statuses: Tuple[int, ...] = (502, 503, 504)):
+        self.attempts = max(attempts, 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = retry_statuses
+
+    def backoff(self, attempt: int) -> float:
+        '''
+            Seconds to wait after failed attempt (0 based), full jitter
+        '''
+        return random.uniform(
+            0, min(self.backoff_base * 2**attempt, self.backoff_max))
+
+
+class CircuitBreaker:
+    '''
+        Fails calls fast once the error rate of a dependency crosses error_rate
+        over the last window seconds (at least min_requests calls).
+        After open_seconds one probe call is let through (half open),
+        its outcome closes or re-opens the circuit.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, error_rate: float, min_requests: int,
+                 window: float, open_seconds: float):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._rejected = 0
+        self._trips = 0
+
+    def allow(self) -> bool:
+        '''
+            Whether a call may go out now
+        '''
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and \
+                    time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record(self, success: bool):
+        '''
+            Record outcome of a call that was allowed
+        '''
+        logger = get_app_logger()
+        now = time.monotonic()
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+                if success:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info('Circuit %s closed', self.name)
+                else:
+                    self._trip(now)
+                return
+            self._outcomes.append((now, success))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            if self._state == self.CLOSED and len(
+                    self._outcomes) >= self.min_requests:
+                failures = sum(1 for _, ok in self._outcomes if not ok)
+                if failures / len(self._outcomes) >= self.error_rate:
+                    self._trip(now)
+
+    def release(self):
+        '''
+            Forget a call that was allowed but ended without a CB outcome
+            (cancelled, or an error that is not a CB failure),
+            a half open circuit lets the next call probe instead
+        '''
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+
+    def _trip(self, now: float):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._trips += 1
+        get_app_logger().error('Circuit %s open for %ss', self.name,
+                               self.open_seconds)
+
+    def stats(self) -> dict:
+        '''
+            Breaker state and error rate over the window
+        '''
+        with self._lock:
+            now = time.monotonic()
+            outcomes = [ok for at, ok in self._outcomes if now - at <= self.window]
+            failures = sum(1 for ok in outcomes if not ok)
+            return {
+                'name': self.name,
+                'state': self._state,
+                'requests': len(outcomes),
+                'failures': failures,
+                'errorRate': failures / len(outcomes) if outcomes else 0,
+                'threshold': self.error_rate,
+                'openSeconds': self.open_seconds,
+                'openForSeconds': max(
+                    self.open_seconds - (now - self._opened_at), 0)
+                if self._state == self.OPEN else 0,
+                'rejected': self._rejected,
+                'trips': self._trips
+            }
+
+
+def _requests_failure(e: Exception) -> Tuple[bool, Optional[int]]:
+    '''
+        (dependency failure, http status) for a requests exception,
+        status is None for connection errors and timeouts
+    '''
+    if isinstance(e, HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status >= 500, status
+    return True, None
+
+
+def catch_requests_exceptions(func=None,
+                              *,
+                              retry: Optional[RetryPolicy] = None,
+                              breaker: Optional[CircuitBreaker] = None):
     '''
-        Docstring
+        Log requests errors and return None instead of raising
+        Optionally retry transient failures with retry policy (idempotent calls only)
+        and fail fast while breaker is open.
+        Usable as @catch_requests_exceptions or @catch_requests_exceptions(retry=.., breaker=..)
     '''
+    if func is None:
+        return functools.partial(catch_requests_exceptions,
+                                 retry=retry,
+                                 breaker=breaker)
     logger = get_app_logger()
+    attempts = retry.attempts if retry else 1
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        try:
-            result = func(*args, **kwargs)
-            return result
-        except HTTPError as e:
-            logger.info("4xx or 5xx: %s \n",  {e})
-            return None  # raise our custom exception or log, etc.
-        except ConnectionError as e:
-            logger.info("Raised for connection-related issues (e.g., DNS resolution failure, network issues): %s \n",  {e})
-            return None  # raise our custom exception or log, etc.
-        except Timeout as e:
-            logger.info("Timeout occured: %s \n",  {e})
-            return None  # raise our custom exception or log, etc.
-        except RequestException as e:
-            logger.info("Request failed: %s \n",  {e})
-            return None  # raise our custom exception or log, etc.
+        for attempt in range(attempts):
+            if breaker is not None and not breaker.allow():
+                logger.info("Circuit %s open, %s not called \n", breaker.name,
+                            func.__name__)
+                return None
+            try:
+                result = func(*args, **kwargs)
+                if breaker is not None:
+                    breaker.record(True)
+                return result
+            except InvalidJSONError as e:
+                # CB answered, with a body that is not json: neither a CB failure nor retried
+                if breaker is not None:
+                    breaker.record(True)
+                logger.info("Invalid json from %s: %s \n", func.__name__, e)
+                return None
+            except RequestException as e:
+                failure, status = _requests_failure(e)
+                if breaker is not None:
+                    breaker.record(not failure)
+                if retry is None or attempt + 1 >= attempts or (
+                        status is not None
+                        and status not in retry.retry_statuses):
+                    _log_requests_exception(logger, e)
+                    return None
+                logger.info("%s failed (%s), retry %s/%s \n", func.__name__,
+                            e, attempt + 1, attempts - 1)
+                time.sleep(retry.backoff(attempt))
+            except BaseException:
+                # Not a CB outcome (caller error, cancelled, interrupted),
+                # a half open probe is released without closing or re-opening the circuit
+                if breaker is not None:
+                    breaker.release()
+                raise
+        return None
 
     return wrapper
+
+
+def _log_requests_exception(logger, e: RequestException):
+    if isinstance(e, HTTPError):
+        logger.info("4xx or 5xx: %s \n",  {e})
+    elif isinstance(e, RequestsConnectionError):
+        logger.info("Raised for connection-related issues (e.g., DNS resolution failure, network issues): %s \n",  {e})
+    elif isinstance(e, Timeout):
+        logger.info("Timeout occured: %s \n",  {e})
+    else:
+        logger.info("Request failed: %s \n",  {e})
+
+
+def _httpx_failure(e: Exception) -> Tuple[bool, Optional[int]]:
+    '''
+        (dependency failure, http status) for an httpx exception,
+        status is None for connection errors and timeouts
+    '''
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        return status >= 500, status
+    return True, None
+
+
+def catch_httpx_exceptions(func=None,
+                           *,
+                           retry: Optional[RetryPolicy] = None,
+                           breaker: Optional[CircuitBreaker] = None):
+    '''
+        Async counterpart of catch_requests_exceptions for httpx coroutines
+    '''
+    if func is None:
+        return functools.partial(catch_httpx_exceptions,
+                                 retry=retry,
+                                 breaker=breaker)
+    logger = get_app_logger()
+    attempts = retry.attempts if retry else 1
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            if breaker is not None and not breaker.allow():
+                logger.info("Circuit %s open, %s not called \n", breaker.name,
+                            func.__name__)
+                return None
+            try:
+                result = await func(*args, **kwargs)
+                if breaker is not None:
+                    breaker.record(True)
+                return result
+            except (httpx.DecodingError, json.JSONDecodeError) as e:
+                # CB answered, with a body that can not be decoded: neither a CB failure nor retried
+                if breaker is not None:
+                    breaker.record(True)
+                logger.info("Invalid body from %s: %s \n", func.__name__, e)
+                return None
+            except httpx.HTTPError as e:
+                failure, status = _httpx_failure(e)
+                if breaker is not None:
+                    breaker.record(not failure)
+                if retry is None or attempt + 1 >= attempts or (
+                        status is not None
+                        and status not in retry.retry_statuses):
+                    _log_httpx_exception(logger, e)
+                    return None
+                logger.info("%s failed (%s), retry %s/%s \n", func.__name__,
+                            e, attempt + 1, attempts - 1)
+                await asyncio.sleep(retry.backoff(attempt))
+            except BaseException:
+                # Not a CB outcome (caller error, cancelled, interrupted),
+                # a half open probe is released without closing or re-opening the circuit
+                if breaker is not None:
+                    breaker.release()
+                raise
+        return None
+
+    return wrapper
+
+
+def _log_httpx_exception(logger, e: httpx.HTTPError):
+    if isinstance(e, httpx.HTTPStatusError):
+        logger.info("4xx or 5xx: %s \n",  {e})
+    elif isinstance(e, httpx.TimeoutException):
+        logger.info("Timeout occured: %s \n",  {e})
+    elif isinstance(e, httpx.NetworkError):
+        logger.info("Raised for connection-related issues (e.g., DNS resolution failure, network issues): %s \n",  {e})
+    else:
+        logger.info("Request failed: %s \n",  {e})
@@ -0,0 +1,146 @@
+'''
+    Host domain id resolved once and kept for the process lifetime
+    The local domain practically never changes, it is refreshed by a background timer
+    or on demand through the admin API instead of being queried on every allocation
+'''
+import threading
+import time
+from typing import Optional
+from app.api_clients.cb_client import CBClient
+from app.api_clients.ngsild_query import NgsiLdQuery
+from app.config import HOST_DOMAIN_REFRESH_INTERVAL
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+
+def resolve_host_domain() -> Optional[str]:
+    """
+    Query CB for the local domain id
+    local=true in ngsi-ld returns domain tha is localy registred in Orion-ld,
+    The only locally registered domain is ...local domain
+    Returns:
+      id of host domain
+    """
+    cb_client = CBClient()
+    jsonld_params = NgsiLdQuery(entity_type='Domain',
+                                attrs=['publicUrl'],
+                                local=True)
+    domain_json = cb_client.query_entities(ngsild_params=jsonld_params)
+    # We are confident about [0] because each domain has just one domain registered locally
+    if domain_json:
+        return domain_json[0].get("id")
+    return None
+
+
+class HostDomainCache:
+    '''
+    Memoized host domain id
+    A failed resolution keeps the previous value, callers resolve again only when none is known
+    '''
+
+    def __init__(self, interval: float = HOST_DOMAIN_REFRESH_INTERVAL):
+        self.interval = interval
+        self._domain: Optional[str] = None
+        self._resolved_at = 0.0
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._running = False
+
+    def get(self) -> Optional[str]:
+        '''
+        Cached host domain id, resolved on first use
+        '''
+        domain = self._domain
+        if domain is not None:
+            return domain
+        return self.refresh()
+
+    def set(self, domain: Optional[str]):
+        '''
+        Store a resolved host domain id
+        '''
+        if domain:
+            self._domain = domain
+            self._resolved_at = time.time()
+
+    def refresh(self) -> Optional[str]:
+        '''
+        Resolve host domain from CB now
+        '''
+        with self._lock:
+            try:
+                domain = resolve_host_domain()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Could not resolve host domain: %s", e)
+                domain = None
+            if domain:
+                if domain != self._domain:
+                    logger.info("Host domain resolved: %s", domain)
+                self.set(domain)
+            else:
+                logger.error("Could not resolve host domain, keeping %s",
+                             self._domain)
+            return self._domain
+
+    def start(self):
+        '''
+        Resolve host domain and keep refreshing it in the background
+        '''
+        self._running = True
+        self.refresh()
+        self._schedule()
+
+    def stop(self):
+        '''
+        Stop background refresh
+        '''
+        self._running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def stats(self) -> dict:
+        '''
+        Cached host domain and its age
+        '''
+        return {
+            'hostDomain': self._domain,
+            'ageSeconds': time.time() - self._resolved_at if self._resolved_at else None,
+            'refreshInterval': self.interval
+        }
+
+    def _tick(self):
+        self.refresh()
+        self._schedule()
+
+    def _schedule(self):
+        if not self._running or self.interval <= 0:
+            return
+        self._timer = threading.Timer(self.interval, self._tick)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+host_domain_cache = HostDomainCache()
+
+
+def get_host_domain() -> Optional[str]:
+    '''
+    Host domain id, from memory
+    '''
+    return host_domain_cache.get()
+
+
+def start_host_domain_refresh():
+    '''
+    Resolve host domain at application startup and refresh it periodically
+    '''
+    host_domain_cache.start()
+
+
+def stop_host_domain_refresh():
+    '''
+    Stop periodic host domain refresh at application shutdown
+    '''
+    host_domain_cache.stop()
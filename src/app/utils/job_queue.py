@@ -0,0 +1,222 @@
+'''
+    In-process allocation job queue
+    A fixed pool of worker threads runs allocation jobs from a bounded queue,
+    so a deployment burst is rejected with 429 instead of starving the status endpoints
+'''
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from app.app_models.job_models import JobStatusEnum, JobStatusResponse
+from app.config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RETENTION
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+# Seconds an idle worker waits for a job before checking the stop flag
+STOP_POLL_INTERVAL = 0.5
+
+
+class JobQueueFull(Exception):
+    '''
+    Raised when the job queue is at its bound
+    '''
+
+
+class Job:
+    '''
+    Allocation job and its outcome
+    '''
+
+    def __init__(self, name: str, fn: Callable, args: tuple, kwargs: dict,
+                 service_id: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.service_id = service_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = JobStatusEnum.QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+
+    def to_response(self) -> JobStatusResponse:
+        '''
+        Job as REST response model
+        '''
+        return JobStatusResponse(jobId=self.id,
+                                 name=self.name,
+                                 serviceId=self.service_id,
+                                 status=self.status,
+                                 createdAt=self.created_at,
+                                 startedAt=self.started_at,
+                                 finishedAt=self.finished_at,
+                                 result=self.result,
+                                 error=self.error)
+
+
+class JobQueue:
+    '''
+    Bounded queue served by a fixed number of worker threads
+    '''
+
+    def __init__(self,
+                 workers: int = JOB_WORKERS,
+                 max_size: int = JOB_QUEUE_SIZE,
+                 retention: int = JOB_RETENTION):
+        self.workers = workers
+        self.retention = retention
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._running = 0
+        self._rejected = 0
+
+    def start(self):
+        '''
+        Start worker threads
+        '''
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name=f'allocation-worker-{i}',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        '''
+        Let workers finish queued jobs and stop them
+        Never blocks on a full queue: sentinels only wake idle workers up,
+        busy ones see the stop flag once the queue is drained
+        '''
+        self._stopping.set()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> Job:
+        '''
+        Queue fn(*args, **kwargs) to run on a worker
+        service_id keyword argument, if any, is also kept as job metadata
+        :raise JobQueueFull when the queue is at its bound
+        '''
+        job = Job(name, fn, args, kwargs, kwargs.get('service_id'))
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full as e:
+            with self._jobs_lock:
+                self._rejected += 1
+            raise JobQueueFull(
+                f'{self._queue.maxsize} allocation jobs already queued') from e
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        '''
+        Get queued, running or recently finished job
+        '''
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        '''
+        Queue depth and worker usage
+        '''
+        with self._jobs_lock:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': self._queue.qsize(),
+                'queueSize': self._queue.maxsize,
+                'rejected': self._rejected
+            }
+
+    def _evict_finished(self):
+        # Keep at most retention jobs, oldest finished ones go first
+        excess = len(self._jobs) - self.retention
+        if excess <= 0:
+            return
+        for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None
+        ][:excess]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=STOP_POLL_INTERVAL)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            if job is None:
+                return
+            with self._jobs_lock:
+                self._running += 1
+            job.status = JobStatusEnum.RUNNING
+            job.started_at = time.time()
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                job.status = JobStatusEnum.SUCCEEDED
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception('Job %s (%s) failed', job.id, job.name)
+                job.error = str(e)
+                job.status = JobStatusEnum.FAILED
+            finally:
+                job.finished_at = time.time()
+                with self._jobs_lock:
+                    self._running -= 1
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    '''
+    Process wide allocation job queue, started on first use
+    '''
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                job_queue = JobQueue()
+                job_queue.start()
+                _job_queue = job_queue
+    return _job_queue
+
+
+def start_job_queue():
+    '''
+    Start allocation workers at application startup
+    '''
+    get_job_queue()
+
+
+def stop_job_queue(timeout: Optional[float] = None):
+    '''
+    Stop allocation workers at application shutdown
+    '''
+    global _job_queue
+    with _job_queue_lock:
+        job_queue, _job_queue = _job_queue, None
+    if job_queue is not None:
+        job_queue.stop(timeout)
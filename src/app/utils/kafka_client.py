@@ -1,8 +1,16 @@
 '''
     Protobuf and kafka related functions
+    One long lived producer is shared by the whole process,
+    delivery reports are served by a background poll loop and surface as futures,
+    awaitable ones when produced from the event loop
 '''
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Optional, Union
 from confluent_kafka import Producer, KafkaException
-from app.config import PRODUCER_TOPIC, producer_config
+from app.config import PRODUCER_TOPIC, producer_config, PRODUCER_POLL_INTERVAL,\
+    PRODUCER_FLUSH_TIMEOUT
 from app.utils.log import get_app_logger
 from app.app_models.py_files import front_end_pb2
 
@@ -41,33 +49,142 @@ def on_delivery(err, msg):
         logger.info('Message delivered to %s [%s]', msg.topic(), msg.partition())
 
 
-def produce_message(service_id):
+class Fe2DataProducer:
+    '''
+    Long lived kafka producer.
+    Created once, a background thread polls for delivery reports
+    and resolves the future returned for each produced message
+    '''
+
+    def __init__(self, config: dict, topic: str):
+        self.topic = topic
+        self._producer = Producer(config)
+        self._running = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        '''
+        Start background poll loop
+        '''
+        if self._running.is_set():
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._poll_loop,
+                                        name='fe2data-producer-poll',
+                                        daemon=True)
+        self._thread.start()
+
+    def _poll_loop(self):
+        while self._running.is_set():
+            self._producer.poll(PRODUCER_POLL_INTERVAL)
+
+    def produce(self,
+                value: bytes,
+                key: Optional[str] = None) -> Union[Future, asyncio.Future]:
+        '''
+        Queue message for delivery, does not wait for the broker
+        :return Future resolved with the delivered message or failed with KafkaException,
+          an asyncio future to await when called from a running event loop
+        '''
+        future = Future()
+
+        def _on_delivery(err, msg):
+            on_delivery(err, msg)
+            if err is not None:
+                future.set_exception(KafkaException(err))
+            else:
+                future.set_result(msg)
+
+        try:
+            self._producer.produce(topic=self.topic,
+                                   value=value,
+                                   key=key,
+                                   on_delivery=_on_delivery)
+        except BufferError:
+            # Local queue full, give the poll loop a moment to drain it and retry once
+            self._producer.poll(PRODUCER_POLL_INTERVAL)
+            self._producer.produce(topic=self.topic,
+                                   value=value,
+                                   key=key,
+                                   on_delivery=_on_delivery)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return future
+        return asyncio.wrap_future(future, loop=loop)
+
+    def flush(self, timeout: float = PRODUCER_FLUSH_TIMEOUT) -> int:
+        '''
+        Wait for in-flight messages
+        :return number of messages still in queue
+        '''
+        return self._producer.flush(timeout)
+
+    def close(self, timeout: float = PRODUCER_FLUSH_TIMEOUT):
+        '''
+        Stop poll loop and flush in-flight messages
+        '''
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        remaining = self.flush(timeout)
+        if remaining:
+            logger.error('%s fe2data messages not delivered on shutdown',
+                         remaining)
+
+
+_fe2data_producer: Optional[Fe2DataProducer] = None
+_fe2data_producer_lock = threading.Lock()
+
+
+def get_producer() -> Fe2DataProducer:
+    '''
+    Process wide producer, created and started on first use
+    '''
+    global _fe2data_producer
+    if _fe2data_producer is None:
+        with _fe2data_producer_lock:
+            if _fe2data_producer is None:
+                producer = Fe2DataProducer(producer_config, PRODUCER_TOPIC)
+                producer.start()
+                _fe2data_producer = producer
+    return _fe2data_producer
+
+
+def start_producer():
+    '''
+    Create the producer at application startup
+    '''
+    get_producer()
+
+
+def stop_producer(timeout: float = PRODUCER_FLUSH_TIMEOUT):
+    '''
+    Flush and close the producer at application shutdown
+    '''
+    global _fe2data_producer
+    with _fe2data_producer_lock:
+        producer, _fe2data_producer = _fe2data_producer, None
+    if producer is not None:
+        producer.close(timeout)
+
+
+def produce_message(service_id) -> Union[Future, asyncio.Future]:
     '''
     Deliver message to redpanda
+    :return Future resolved on delivery report, awaitable from the event loop
     '''
-    producer = Producer(producer_config)
     # Create protobuf message for redpanda
     # According to protobuf service data model
     # And (binary) serialize it
     protobuf_msg = serialize_to_bytes(
         create_fe2data_output(service_id=service_id))
     logger.info('Protobuf message: %s', protobuf_msg)
+    return get_producer().produce(value=protobuf_msg)
 
-    try:
-        # Sending a message to the topic
-        producer.produce(topic=PRODUCER_TOPIC,
-                         value=protobuf_msg,
-                         callback=on_delivery)
-
-        # Wait for delivery confirmation
-        producer.poll(5)
-
-    except KafkaException as e:
-        logger.error('Kafka Error: %s', e)
-
-    finally:
-        # Close the producer
-        producer.flush()
 
 if __name__ == "__main__":
-    produce_message('urn:ngsi-ld:service:fake')
+    start_producer()
+    produce_message('urn:ngsi-ld:service:fake').result(PRODUCER_FLUSH_TIMEOUT)
+    stop_producer()
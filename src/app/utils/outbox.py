@@ -0,0 +1,232 @@
+'''
+    Durable local outbox for fe2data notifications
+    Every HLODataAggregatorOutput is recorded in sqlite before it is sent,
+    a background drainer sends pending ones in batches with backoff
+    and removes them when the broker confirms delivery.
+    Broker latency is decoupled from API latency and no notification is lost across restarts.
+'''
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import partial
+from typing import List, Optional
+from app.config import OUTBOX_PATH, OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL,\
+    OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX, PRODUCER_FLUSH_TIMEOUT
+from app.utils import kafka_client
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+
+class Fe2DataOutbox:
+    '''
+    sqlite backed outbox of fe2data protobuf messages
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS fe2data_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                service_id TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                in_flight INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )''')
+        # Messages in flight when the process stopped are sent again
+        self._conn.execute('UPDATE fe2data_outbox SET in_flight = 0')
+        self._conn.commit()
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._running = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, service_id: str) -> int:
+        '''
+        Record fe2data notification for service, to be sent by the drainer
+        :return outbox id
+        '''
+        return self.enqueue_many([service_id])[0]
+
+    def enqueue_many(self, service_ids: List[str]) -> List[int]:
+        '''
+        Record fe2data notifications for services in one transaction,
+        the drainer hands them to the producer in one batch
+        :return outbox ids
+        '''
+        rows = [(service_id,
+                 kafka_client.serialize_to_bytes(
+                     kafka_client.create_fe2data_output(service_id=service_id)))
+                for service_id in service_ids]
+        now = time.time()
+        outbox_ids = []
+        with self._lock:
+            for service_id, payload in rows:
+                cursor = self._conn.execute(
+                    'INSERT INTO fe2data_outbox '
+                    '(service_id, payload, next_attempt_at, created_at) '
+                    'VALUES (?, ?, ?, ?)', (service_id, payload, now, now))
+                outbox_ids.append(cursor.lastrowid)
+            self._conn.commit()
+        if outbox_ids:
+            self._wakeup.set()
+        logger.info('fe2data notifications for %s queued in outbox',
+                    ', '.join(service_ids))
+        return outbox_ids
+
+    def start(self):
+        '''
+        Start background drainer
+        '''
+        if self._running.is_set():
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._drain_loop,
+                                        name='fe2data-outbox-drainer',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = PRODUCER_FLUSH_TIMEOUT):
+        '''
+        Stop drainer, wait for in-flight deliveries and close the db
+        '''
+        self._running.clear()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        kafka_client.get_producer().flush(timeout)
+        with self._lock:
+            self._closed = True
+            self._conn.close()
+
+    def stats(self) -> dict:
+        '''
+        Pending and in-flight notifications
+        '''
+        with self._lock:
+            pending, in_flight, oldest = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(in_flight), 0), MIN(created_at) '
+                'FROM fe2data_outbox').fetchone()
+        return {
+            'pending': pending,
+            'inFlight': in_flight,
+            'oldestAgeSeconds': time.time() - oldest if oldest else 0
+        }
+
+    def _drain_loop(self):
+        while self._running.is_set():
+            sent = self.drain_once()
+            if sent < OUTBOX_BATCH_SIZE:
+                self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def drain_once(self) -> int:
+        '''
+        Send one batch of due notifications
+        :return number of notifications handed to the producer
+        '''
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, payload, attempts FROM fe2data_outbox '
+                'WHERE in_flight = 0 AND next_attempt_at <= ? '
+                'ORDER BY id LIMIT ?',
+                (time.time(), OUTBOX_BATCH_SIZE)).fetchall()
+            self._conn.executemany(
+                'UPDATE fe2data_outbox SET in_flight = 1 WHERE id = ?',
+                [(row[0], ) for row in rows])
+            self._conn.commit()
+        for outbox_id, payload, attempts in rows:
+            try:
+                future = kafka_client.get_producer().produce(value=payload)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error('Redpanda failure, fe2data %s kept in outbox: %s',
+                             outbox_id, e)
+                self._retry_later(outbox_id, attempts)
+                continue
+            future.add_done_callback(
+                partial(self._on_delivery, outbox_id, attempts))
+        return len(rows)
+
+    def _on_delivery(self, outbox_id: int, attempts: int, future):
+        if future.exception() is not None:
+            self._retry_later(outbox_id, attempts)
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute('DELETE FROM fe2data_outbox WHERE id = ?',
+                               (outbox_id, ))
+            self._conn.commit()
+
+    def _retry_later(self, outbox_id: int, attempts: int):
+        backoff = min(OUTBOX_BACKOFF_BASE * 2**attempts, OUTBOX_BACKOFF_MAX)
+        backoff *= random.uniform(0.5, 1.0)
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute(
+                'UPDATE fe2data_outbox SET in_flight = 0, attempts = ?, '
+                'next_attempt_at = ? WHERE id = ?',
+                (attempts + 1, time.time() + backoff, outbox_id))
+            self._conn.commit()
+
+
+_fe2data_outbox: Optional[Fe2DataOutbox] = None
+_fe2data_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Fe2DataOutbox:
+    '''
+    Process wide outbox, created and started on first use
+    '''
+    global _fe2data_outbox
+    if _fe2data_outbox is None:
+        with _fe2data_outbox_lock:
+            if _fe2data_outbox is None:
+                outbox = Fe2DataOutbox(OUTBOX_PATH)
+                outbox.start()
+                _fe2data_outbox = outbox
+    return _fe2data_outbox
+
+
+def start_outbox():
+    '''
+    Open the outbox and start draining what is left from previous runs
+    '''
+    get_outbox()
+
+
+def stop_outbox():
+    '''
+    Stop the drainer at application shutdown
+    '''
+    global _fe2data_outbox
+    with _fe2data_outbox_lock:
+        outbox, _fe2data_outbox = _fe2data_outbox, None
+    if outbox is not None:
+        outbox.stop()
+
+
+def publish_fe2data(service_id: str) -> int:
+    '''
+    Notify HLO data aggregator about service, through the outbox
+    '''
+    return get_outbox().enqueue(service_id)
+
+
+def publish_fe2data_many(service_ids: List[str]) -> List[int]:
+    '''
+    Notify HLO data aggregator about many services, through the outbox in one batch
+    '''
+    if not service_ids:
+        return []
+    return get_outbox().enqueue_many(service_ids)
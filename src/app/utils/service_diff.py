@@ -0,0 +1,293 @@
+'''
+    Attribute level diff between the NGSI-LD entities stored for a service
+    and the entities generated from a new TOSCA.
+    Only changed attributes are written: one upsert (options=update) carries new entities
+    and changed attribute fragments, attributes no longer generated are deleted one by one,
+    one delete removes components and ports gone from the TOSCA.
+'''
+from typing import Dict, List, Optional, Set
+from app import config
+from app.api_clients.cb_client import CBClient
+from app.api_clients.ngsild_query import NgsiLdQuery
+from app.app_models.aeriOS_continuum import ServiceComponentStatusEnum
+from app.utils.continuum_utils import service_components_query
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+# Attributes owned by the lifecycle (allocation, status updates), never diffed
+LIFECYCLE_ATTRIBUTES = {
+    'Service': {'actionType', 'domainHandler'},
+    'ServiceComponent': {'serviceComponentStatus', 'infrastructureElement'}
+}
+
+# Attributes aeriOS_ngsild writes, only when the TOSCA sets them (credentials, constraints, ..)
+# A stored one the new TOSCA no longer sets is deleted, attributes written by others are kept
+GENERATED_ATTRIBUTES = {
+    'Service': {'name', 'description', 'hasOverlay'},
+    'ServiceComponent': {
+        'service', 'containerImage', 'infrastructureElementRequirements',
+        'networkPorts', 'cliArgs', 'envVars', 'exposePorts', 'isJob',
+        'isPrivate', 'repoUsername', 'repoPassword'
+    },
+    'InfrastructureElementRequirements': {
+        'infrastructureElement', 'requiredCpuUsage', 'requiredRam',
+        'cpuArchitecture', 'realTimeCapable', 'energyEfficiencyRatio',
+        'greenEnergyRatio', 'domainId'
+    },
+    'NetworkPort': {'portNumber', 'portProtocol'}
+}
+
+IE_REQUIREMENTS_SUFFIX = ':InfrastructureElementRequirements'
+
+
+def _simplified(attribute):
+    '''
+    keyValues form of a normalized NGSI-LD attribute,
+    single instance lists compare equal to their instance
+    '''
+    if isinstance(attribute, dict) and attribute.get('type') in (
+            'Property', 'Relationship', 'GeoProperty'):
+        attribute = attribute.get('object', attribute.get('value'))
+    elif isinstance(attribute, list):
+        attribute = [_simplified(instance) for instance in attribute]
+    if isinstance(attribute, list) and len(attribute) == 1:
+        return attribute[0]
+    return attribute
+
+
+def _as_list(value) -> List:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _port_key(port: dict):
+    return (_simplified(port.get('portNumber')),
+            _simplified(port.get('portProtocol')))
+
+
+class ServiceDiff:
+    '''
+    Writes turning the stored service into the new one
+    '''
+
+    def __init__(self, service_id: str):
+        self.service_id = service_id
+        # entity id -> full entity (created) or changed attribute fragment
+        self.upserts: Dict[str, dict] = {}
+        self.created: Set[str] = set()
+        self.deletes: List[str] = []
+        # entity id -> names of stored attributes to delete
+        self.removed_attributes: Dict[str, List[str]] = {}
+        self.changed_components: Set[str] = set()
+
+    def is_empty(self) -> bool:
+        '''
+        Stored service already matches the new TOSCA
+        '''
+        return not self.upserts and not self.deletes \
+            and not self.removed_attributes
+
+    def summary(self) -> dict:
+        '''
+        Counts of the writes
+        '''
+        return {
+            'created': len(self.created),
+            'updated': len(self.upserts) - len(self.created),
+            'deleted': len(self.deletes),
+            'removedAttributes': sum(
+                len(names) for names in self.removed_attributes.values()),
+            'changedComponents': sorted(self.changed_components)
+        }
+
+
+def _query_by_ids(cb_client: CBClient, entity_type: str,
+                  ids: List[str]) -> List[dict]:
+    entities = []
+    for start in range(0, len(ids), config.CB_PAGE_SIZE):
+        entities.extend(
+            cb_client.iter_entities(
+                NgsiLdQuery(entity_type=entity_type,
+                            ids=ids[start:start + config.CB_PAGE_SIZE])))
+    return entities
+
+
+def get_service_entities(service_id: str) -> Optional[Dict[str, dict]]:
+    '''
+    Stored entities of a service (Service, ServiceComponents,
+    their InfrastructureElementRequirements and NetworkPorts), simplified, by id
+    :return None if service does not exist
+    Raises CBQueryError when any of them can not be read, a partial view is never returned
+    '''
+    cb_client = CBClient()
+    service = cb_client.query_entity(entity_id=service_id,
+                                     ngsild_params=NgsiLdQuery())
+    if service is None or service.get('type') is None:
+        return None
+    entities = {service_id: service}
+    components = list(
+        cb_client.iter_entities(service_components_query(service_id, [])))
+    port_ids = []
+    for component in components:
+        entities[component['id']] = component
+        port_ids.extend(_as_list(component.get('networkPorts')))
+    for entity in _query_by_ids(
+            cb_client, 'InfrastructureElementRequirements',
+        [component['id'] + IE_REQUIREMENTS_SUFFIX
+         for component in components]) + _query_by_ids(
+             cb_client, 'NetworkPort', port_ids):
+        entities[entity['id']] = entity
+    return entities
+
+
+def _reuse_port_ids(new_entities: Dict[str, dict], current: Dict[str, dict]):
+    '''
+    Ports have deterministic ids, so a stored port with the same id is the same port.
+    Other new ports get the id of a remaining stored port with the same number
+    and protocol on the same component (ports stored with random ids by older
+    allocations), so unchanged ports are neither deleted nor created
+    '''
+    for component in [
+            entity for entity in list(new_entities.values())
+            if entity.get('type') == 'ServiceComponent'
+    ]:
+        stored = current.get(component['id'])
+        if stored is None or 'networkPorts' not in component:
+            continue
+        stored_ports = {
+            _port_key(current[port_id]): port_id
+            for port_id in _as_list(stored.get('networkPorts'))
+            if port_id in current and port_id not in new_entities
+        }
+        port_ids = []
+        for port_id in _as_list(_simplified(component['networkPorts'])):
+            port = new_entities.get(port_id)
+            stored_id = stored_ports.pop(_port_key(port), None) \
+                if port is not None and port_id not in current else None
+            if stored_id is not None and stored_id != port_id:
+                new_entities[stored_id] = {**new_entities.pop(port_id), 'id': stored_id}
+                port_id = stored_id
+            port_ids.append(port_id)
+        component['networkPorts'] = {'type': 'Relationship', 'object': port_ids}
+
+
+def _owner(entity: dict, port_owners: Dict[str, str]) -> Optional[str]:
+    '''
+    Service component an entity belongs to
+    '''
+    if entity.get('type') == 'ServiceComponent':
+        return entity['id']
+    if entity.get('type') == 'InfrastructureElementRequirements':
+        return entity['id'].removesuffix(IE_REQUIREMENTS_SUFFIX)
+    return port_owners.get(entity['id'])
+
+
+def diff_service(service_id: str, new_entities: List[dict],
+                 current: Dict[str, dict]) -> ServiceDiff:
+    '''
+    Compare generated (normalized) entities with stored (simplified) ones
+    Components that are new or changed, or whose requirements or ports changed,
+    go back to LOCATING
+    '''
+    diff = ServiceDiff(service_id)
+    new_by_id = {entity['id']: dict(entity) for entity in new_entities}
+    _reuse_port_ids(new_by_id, current)
+
+    port_owners = {}
+    for entity_by_id in (current, new_by_id):
+        for entity in entity_by_id.values():
+            if entity.get('type') == 'ServiceComponent':
+                for port_id in _as_list(_simplified(entity.get('networkPorts'))):
+                    port_owners[port_id] = entity['id']
+
+    for entity_id, entity in new_by_id.items():
+        stored = current.get(entity_id)
+        if stored is None:
+            diff.upserts[entity_id] = entity
+            diff.created.add(entity_id)
+        else:
+            ignored = LIFECYCLE_ATTRIBUTES.get(entity.get('type'), set())
+            changed = {
+                name: attribute
+                for name, attribute in entity.items()
+                if name not in ('id', 'type') and name not in ignored
+                and _simplified(attribute) != _simplified(stored.get(name))
+            }
+            removed = sorted(
+                name for name in GENERATED_ATTRIBUTES.get(entity.get('type'), ())
+                if name not in entity and name not in ignored
+                and stored.get(name) is not None)
+            if not changed and not removed:
+                continue
+            if changed:
+                diff.upserts[entity_id] = {
+                    'id': entity_id,
+                    'type': entity['type'],
+                    **changed
+                }
+            if removed:
+                diff.removed_attributes[entity_id] = removed
+        owner = _owner(entity, port_owners)
+        if owner is not None:
+            diff.changed_components.add(owner)
+
+    for entity_id, stored in current.items():
+        if entity_id in new_by_id:
+            continue
+        diff.deletes.append(entity_id)
+        owner = _owner(stored, port_owners)
+        if owner is not None and owner in new_by_id:
+            diff.changed_components.add(owner)
+
+    for component_id in diff.changed_components:
+        if component_id not in new_by_id:
+            continue
+        fragment = diff.upserts.setdefault(component_id, {
+            'id': component_id,
+            'type': 'ServiceComponent'
+        })
+        fragment['serviceComponentStatus'] = {
+            'type': 'Relationship',
+            'object': ServiceComponentStatusEnum.LOCATING
+        }
+    return diff
+
+
+def apply_service_diff(diff: ServiceDiff) -> dict:
+    '''
+    Write the diff with one upsert and one delete batch (each chunked by CB_BATCH_SIZE),
+    removed attributes in between, one request each
+    :return merged per entity success and errors
+    '''
+    cb_client = CBClient()
+    result = {'success': [], 'errors': []}
+    if diff.upserts:
+        upsert = cb_client.batch_upsert(list(diff.upserts.values()),
+                                        options='update')
+        result['success'].extend(upsert['success'])
+        result['errors'].extend(upsert['errors'])
+    for entity_id, names in diff.removed_attributes.items():
+        failed = [
+            name for name in names
+            if cb_client.delete_entity_attr(entity_id, name) not in (204, 404)
+        ]
+        if failed:
+            result['errors'].append({
+                'entityId': entity_id,
+                'error': {
+                    'title': 'attributes not deleted',
+                    'detail': ', '.join(failed)
+                }
+            })
+        else:
+            result['success'].append(entity_id)
+    if diff.deletes:
+        deleted = cb_client.batch_delete(diff.deletes)
+        result['success'].extend(deleted['success'])
+        result['errors'].extend(deleted['errors'])
+    for error in result['errors']:
+        logger.error('Failed to update entity %s of service %s: %s',
+                     error.get('entityId'), diff.service_id, error.get('error'))
+    return result
@@ -0,0 +1,165 @@
+'''
+    Keyed single-flight for service lifecycle operations
+    Concurrent identical operations (same operation and arguments) on one service id
+    are merged into one execution, all other operations on one service id are serialized
+'''
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+
+
+def _jsonable(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    return repr(value)
+
+
+def payload_digest(args: tuple, kwargs: dict) -> str:
+    '''
+    Hash of the arguments of an operation, calls are merged only when it matches
+    '''
+    payload = json.dumps([args, kwargs], sort_keys=True, default=_jsonable)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ServiceLifecycleGuard:
+    '''
+    Per service id lock plus in-flight registry of (service id, operation, payload digest).
+    A caller arriving while the same operation with the same arguments on the same service
+    is queued or running does not execute it again, it waits for and gets the shared result.
+    A caller with other arguments (e.g. another TOSCA) waits for the service lock
+    and runs its own operation afterwards.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, str, str], Future] = {}
+        # service id -> [lock, number of executions holding or waiting for it]
+        self._service_locks: Dict[str, List] = {}
+        self._executions: Dict[str, int] = defaultdict(int)
+        self._coalesced: Dict[str, int] = defaultdict(int)
+
+    def run(self,
+            key: str,
+            operation: str,
+            fn: Callable,
+            *args,
+            coalesce: bool = True,
+            **kwargs):
+        '''
+        Run fn(*args, **kwargs) as operation on service key,
+        or join the identical operation already in flight
+        @coalesce: False to never merge, the call is only serialized
+        :return fn result, shared by all merged callers
+        '''
+        flight = (key, operation, payload_digest(args, kwargs)) \
+            if coalesce else None
+        with self._lock:
+            future = self._inflight.get(flight) if flight else None
+            leader = future is None
+            if leader:
+                future = Future()
+                if flight:
+                    self._inflight[flight] = future
+                entry = self._service_locks.setdefault(
+                    key, [threading.Lock(), 0])
+                entry[1] += 1
+                self._executions[operation] += 1
+            else:
+                self._coalesced[operation] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            with entry[0]:
+                result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, flight, entry)
+            future.set_exception(e)
+            raise
+        self._finish(key, flight, entry)
+        future.set_result(result)
+        return result
+
+    def run_many(self, operation: str, fn: Callable,
+                 calls: Dict[str, dict]) -> Dict[str, object]:
+        '''
+        Run operation on many services with one fn(calls) execution,
+        calls maps service key -> kwargs of its operation, fn returns key -> result.
+        Each service is guarded as by run(key, operation, **kwargs): an identical operation
+        in flight is joined instead of run, other services have their lock held
+        (taken in key order) for the whole execution
+        :return key -> result, None for a joined operation that failed
+        '''
+        joined: Dict[str, Future] = {}
+        led: Dict[str, Tuple[Tuple[str, str, str], List, Future]] = {}
+        with self._lock:
+            for key, kwargs in calls.items():
+                flight = (key, operation, payload_digest((), kwargs))
+                future = self._inflight.get(flight)
+                if future is not None:
+                    joined[key] = future
+                    self._coalesced[operation] += 1
+                    continue
+                future = self._inflight[flight] = Future()
+                entry = self._service_locks.setdefault(
+                    key, [threading.Lock(), 0])
+                entry[1] += 1
+                self._executions[operation] += 1
+                led[key] = (flight, entry, future)
+
+        held = []
+        try:
+            for key in sorted(led):
+                led[key][1][0].acquire()
+                held.append(key)
+            results = fn({key: calls[key] for key in led}) if led else {}
+        except BaseException as e:
+            self._finish_many(led, held)
+            for _, _, future in led.values():
+                future.set_exception(e)
+            raise
+        self._finish_many(led, held)
+        for key, (_, _, future) in led.items():
+            future.set_result(results.get(key))
+        # Joined only once the locks are released, so two bulks never wait on each other
+        for key, future in joined.items():
+            try:
+                results[key] = future.result()
+            except Exception:  # pylint: disable=broad-except
+                results[key] = None
+        return results
+
+    def _finish_many(self, led: Dict[str, tuple], held: List[str]):
+        for key in held:
+            led[key][1][0].release()
+        for key, (flight, entry, _) in led.items():
+            self._finish(key, flight, entry)
+
+    def _finish(self, key: str, flight: Optional[Tuple[str, str, str]],
+                entry: List):
+        with self._lock:
+            # Later callers start a new execution, they see the effects of this one
+            if flight:
+                self._inflight.pop(flight, None)
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._service_locks.pop(key, None)
+
+    def stats(self) -> dict:
+        '''
+        Executions and merged (coalesced) requests per operation
+        '''
+        with self._lock:
+            return {
+                'executions': dict(self._executions),
+                'coalesced': dict(self._coalesced),
+                'inFlight': len(self._inflight)
+            }
+
+
+lifecycle_guard = ServiceLifecycleGuard()
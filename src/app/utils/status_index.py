@@ -0,0 +1,246 @@
+'''
+    In-memory index of service component status
+    Kept up to date by NGSI-LD notifications of a subscription on ServiceComponent changes,
+    so status reads are a dictionary lookup instead of a CB round trip.
+    A service is loaded with one query the first time it is read (cold index)
+    and reloaded when its view is older than STATUS_INDEX_MAX_AGE, which bounds staleness
+    when notifications are lost.
+'''
+import hmac
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Set
+from app.api_clients.cb_client import CBClient
+from app.config import STATUS_NOTIFICATION_URL, STATUS_SUBSCRIPTION_ID,\
+    STATUS_INDEX_MAX_AGE, STATUS_NOTIFICATION_TOKEN
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+WATCHED_ATTRIBUTES = ['serviceComponentStatus', 'service']
+
+# Header carrying the notification token, set by CB from the subscription receiverInfo
+NOTIFICATION_TOKEN_HEADER = 'X-HLO-Notification-Token'
+
+# Token notifications must carry, set when the status subscription is registered:
+# STATUS_NOTIFICATION_TOKEN or a random one, no notification is accepted before
+_notification_token: Optional[str] = None
+
+
+def _value(attribute):
+    '''
+    Attribute value of a keyValues or normalized notification entity
+    '''
+    if isinstance(attribute, dict):
+        if 'object' in attribute:
+            return attribute['object']
+        return attribute.get('value')
+    return attribute
+
+
+class _ServiceView:
+    '''
+    Status of the components of one service
+    '''
+    __slots__ = ('components', 'updated_at', 'loaded_at')
+
+    def __init__(self):
+        # component id -> (status, monotonic time of the change)
+        self.components: Dict[str, tuple] = {}
+        self.updated_at = 0.0
+        self.loaded_at = 0.0
+
+
+class ServiceStatusIndex:
+    '''
+    service id -> component id -> serviceComponentStatus
+    '''
+
+    def __init__(self, max_age: float = STATUS_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._services: Dict[str, _ServiceView] = {}
+        self._component_service: Dict[str, str] = {}
+        self._hits = 0
+        self._misses = 0
+        self._notifications = 0
+        # Index is only trusted once CB notifies this process about changes
+        self.enabled = False
+
+    def get(self, service_id: str) -> Optional[List[dict]]:
+        '''
+        Component status list of service, as returned by get_service_status,
+        or None when the service is not indexed or its view is too old
+        '''
+        now = time.monotonic()
+        with self._lock:
+            view = self._services.get(service_id)
+            if view is None or now - view.loaded_at > self.max_age:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return [{
+                'id': component_id,
+                'type': 'ServiceComponent',
+                'serviceComponentStatus': component_status
+            } for component_id, (component_status,
+                                 _) in view.components.items()]
+
+    def load_started(self) -> float:
+        '''
+        Taken before the fallback query and handed to load
+        '''
+        return time.monotonic()
+
+    def load(self, service_id: str, components: List[dict],
+             started_at: float):
+        '''
+        Index service from a fresh component status query,
+        changes notified while the query was running are kept
+        A service whose components were not read is never indexed
+        '''
+        if components is None:
+            return
+        with self._lock:
+            view = self._services.get(service_id) or _ServiceView()
+            fresh = {}
+            for component in components:
+                component_id = component.get('id')
+                previous = view.components.get(component_id)
+                if previous is not None and previous[1] > started_at:
+                    fresh[component_id] = previous
+                else:
+                    fresh[component_id] = (component.get(
+                        'serviceComponentStatus'), started_at)
+                self._component_service[component_id] = service_id
+            for component_id, previous in view.components.items():
+                if component_id not in fresh and previous[1] > started_at:
+                    fresh[component_id] = previous
+            view.components = fresh
+            view.loaded_at = view.updated_at = time.monotonic()
+            self._services[service_id] = view
+
+    def apply_notification(self, entities: List[dict]) -> Set[str]:
+        '''
+        Update indexed services from NGSI-LD notification data
+        Components of services not indexed yet are ignored, they are loaded on first read
+        :return ids of the notified services
+        '''
+        now = time.monotonic()
+        notified = set()
+        with self._lock:
+            self._notifications += 1
+            for entity in entities or []:
+                component_id = entity.get('id')
+                service_id = _value(entity.get(
+                    'service')) or self._component_service.get(component_id)
+                if service_id:
+                    notified.add(service_id)
+                component_status = _value(entity.get('serviceComponentStatus'))
+                view = self._services.get(service_id)
+                if view is None or component_status is None:
+                    continue
+                view.components[component_id] = (component_status, now)
+                view.updated_at = now
+                self._component_service[component_id] = service_id
+        return notified
+
+    def forget(self, service_id: str):
+        '''
+        Drop service from the index, e.g. after it was purged
+        '''
+        with self._lock:
+            view = self._services.pop(service_id, None)
+            if view is not None:
+                for component_id in view.components:
+                    self._component_service.pop(component_id, None)
+
+    def stats(self) -> dict:
+        '''
+        Index size and hit/miss counters
+        '''
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'services': len(self._services),
+                'components': len(self._component_service),
+                'hits': self._hits,
+                'misses': self._misses,
+                'notifications': self._notifications,
+                'maxAge': self.max_age
+            }
+
+
+status_index = ServiceStatusIndex()
+
+
+def get_status_subscription(token: str) -> dict:
+    '''
+    NGSI-LD subscription on ServiceComponent status changes
+    @token: notification token CB sends in the NOTIFICATION_TOKEN_HEADER header
+    '''
+    endpoint = {
+        'uri': STATUS_NOTIFICATION_URL,
+        'accept': 'application/json',
+        'receiverInfo': [{
+            'key': NOTIFICATION_TOKEN_HEADER,
+            'value': token
+        }]
+    }
+    return {
+        'id': STATUS_SUBSCRIPTION_ID,
+        'type': 'Subscription',
+        'description': 'HLO FE service component status index',
+        'entities': [{
+            'type': 'ServiceComponent'
+        }],
+        'watchedAttributes': WATCHED_ATTRIBUTES,
+        'notification': {
+            'attributes': WATCHED_ATTRIBUTES,
+            'format': 'keyValues',
+            'endpoint': endpoint
+        }
+    }
+
+
+def notification_authorized(notification: dict, token: Optional[str]) -> bool:
+    '''
+    Whether a notification comes from the status subscription of this process:
+    its subscriptionId must match and the token (header or query) must be
+    the one the subscription was registered with
+    '''
+    if notification.get('subscriptionId') != STATUS_SUBSCRIPTION_ID:
+        return False
+    if _notification_token is None or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), _notification_token.encode())
+
+
+def start_status_subscription():
+    '''
+    Register the status subscription at application startup,
+    when STATUS_NOTIFICATION_URL tells CB where this process is reachable
+    '''
+    if not STATUS_NOTIFICATION_URL:
+        logger.info('STATUS_NOTIFICATION_URL not set, status read from CB')
+        return
+    global _notification_token
+    token = STATUS_NOTIFICATION_TOKEN or secrets.token_urlsafe(32)
+    if CBClient().create_subscription(get_status_subscription(token)) is None:
+        logger.error('Could not register status subscription %s',
+                     STATUS_SUBSCRIPTION_ID)
+        return
+    _notification_token = token
+    status_index.enabled = True
+    logger.info('Status subscription %s notifies %s', STATUS_SUBSCRIPTION_ID,
+                STATUS_NOTIFICATION_URL)
+
+
+def stop_status_subscription():
+    '''
+    Remove the status subscription at application shutdown
+    '''
+    if status_index.enabled:
+        status_index.enabled = False
+        CBClient().delete_subscription(STATUS_SUBSCRIPTION_ID)
@@ -0,0 +1,258 @@
+'''
+    Push service component status changes to watchers
+    One upstream watch per service is shared by all its watchers,
+    it reads status (from the status index when enabled) and broadcasts deltas.
+    Watches stop when the last watcher leaves or every component reached a terminal state.
+'''
+import asyncio
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional, Set
+from app.app_models.aeriOS_continuum import ServiceComponentStatusEnum
+from app.config import STATUS_STREAM_INTERVAL, STATUS_STREAM_KEEPALIVE,\
+    STATUS_STREAM_TIMEOUT
+from app.utils import async_continuum_utils
+from app.utils.log import get_app_logger
+
+logger = get_app_logger()
+
+TERMINAL_STATUSES = {
+    ServiceComponentStatusEnum.RUNNING, ServiceComponentStatusEnum.FAILED,
+    ServiceComponentStatusEnum.FINISHED
+}
+
+# Queue items closing a stream: watch over (terminal status or service deleted), watch failed
+_END = None
+_ERROR = object()
+
+
+def is_terminal(components: List[dict]) -> bool:
+    '''
+    All components of the service reached a terminal state
+    '''
+    return bool(components) and all(
+        component.get('serviceComponentStatus') in TERMINAL_STATUSES
+        for component in components)
+
+
+def status_etag(components: List[dict]) -> str:
+    '''
+    ETag over the (id, status) pairs of the service components, order independent
+    '''
+    pairs = sorted((component.get('id') or '',
+                    component.get('serviceComponentStatus') or '')
+                   for component in components)
+    digest = hashlib.sha1(json.dumps(pairs).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    '''
+    If-None-Match header holds etag (weak comparison) or *
+    '''
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+class _ServiceWatch:
+    '''
+    Upstream watch of one service and the queues of its watchers
+    '''
+
+    def __init__(self):
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.last: Dict[str, dict] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class ServiceStatusHub:
+    '''
+    service id -> shared watch, used from the application event loop only
+    '''
+
+    def __init__(self, interval: float = STATUS_STREAM_INTERVAL):
+        self.interval = interval
+        self._watches: Dict[str, _ServiceWatch] = {}
+
+    def subscribe(self, service_id: str) -> asyncio.Queue:
+        '''
+        Start watching service, the queue gets lists of changed components
+        and _END (_ERROR when status could not be read) when the stream is over
+        '''
+        queue: asyncio.Queue = asyncio.Queue()
+        watch = self._watches.get(service_id)
+        if watch is None:
+            watch = self._watches[service_id] = _ServiceWatch()
+            watch.task = asyncio.create_task(self._watch(service_id, watch))
+        elif watch.last:
+            # Late watchers start from the current state
+            queue.put_nowait(list(watch.last.values()))
+        watch.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, service_id: str, queue: asyncio.Queue):
+        '''
+        Stop watching service, the upstream watch stops with its last watcher
+        '''
+        watch = self._watches.get(service_id)
+        if watch is None:
+            return
+        watch.subscribers.discard(queue)
+        if not watch.subscribers:
+            self._watches.pop(service_id, None)
+            if watch.task is not None:
+                watch.task.cancel()
+
+    def current(self, service_id: str) -> Optional[List[dict]]:
+        '''
+        Last read status of a watched service
+        '''
+        watch = self._watches.get(service_id)
+        if watch is None or not watch.last:
+            return None
+        return list(watch.last.values())
+
+    def wake(self, service_ids: Iterable[str]):
+        '''
+        Read status now instead of at the next interval, e.g. after a notification
+        '''
+        for service_id in service_ids:
+            watch = self._watches.get(service_id)
+            if watch is not None:
+                watch.wakeup.set()
+
+    def stats(self) -> dict:
+        '''
+        Watched services and watchers
+        '''
+        return {
+            'services': len(self._watches),
+            'watchers': sum(
+                len(watch.subscribers) for watch in self._watches.values())
+        }
+
+    async def _watch(self, service_id: str, watch: _ServiceWatch):
+        try:
+            while True:
+                components = await async_continuum_utils.get_indexed_service_status(
+                    service_id=service_id)
+                if components is None:
+                    # Service deleted
+                    break
+                delta = [
+                    component for component in components
+                    if watch.last.get(component.get('id')) != component
+                ]
+                watch.last = {
+                    component.get('id'): component
+                    for component in components
+                }
+                if delta:
+                    self._broadcast(watch, delta)
+                if is_terminal(components):
+                    break
+                watch.wakeup.clear()
+                try:
+                    await asyncio.wait_for(watch.wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            end = _END
+        except asyncio.CancelledError:
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error('Status watch of %s failed: %s', service_id, e)
+            end = _ERROR
+        self._broadcast(watch, end)
+        if self._watches.get(service_id) is watch:
+            self._watches.pop(service_id, None)
+
+    @staticmethod
+    def _broadcast(watch: _ServiceWatch, item):
+        for queue in list(watch.subscribers):
+            queue.put_nowait(item)
+
+
+status_hub = ServiceStatusHub()
+
+
+def _sse(event: str, data) -> str:
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def stream_service_events(service_id: str):
+    '''
+    Server-Sent Events of service component status changes
+      event: status  data: list of changed ServiceStatusResponse
+      event: end     data: {} once all components are in a terminal state
+      event: error   data: {"detail": ..} when status could not be read, clients reconnect
+    '''
+    queue = status_hub.subscribe(service_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STATUS_STREAM_TIMEOUT
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                yield _sse('timeout', {})
+                return
+            try:
+                item = await asyncio.wait_for(
+                    queue.get(), min(STATUS_STREAM_KEEPALIVE, remaining))
+            except asyncio.TimeoutError:
+                # Comment line, keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+                continue
+            if item is _END:
+                yield _sse('end', {})
+                return
+            if item is _ERROR:
+                yield _sse('error', {'detail': 'Service status could not be read'})
+                return
+            yield _sse('status', item)
+    finally:
+        status_hub.unsubscribe(service_id, queue)
+
+
+async def wait_for_status_change(service_id: str, components: List[dict],
+                                 timeout: float) -> List[dict]:
+    '''
+    Long-poll: wait until the status of the service no longer matches components,
+    the status the client already holds (read from the status index or CB by the caller)
+    Never reads CB itself, changes come from the upstream watch the service shares
+    with the event streams; a terminal service is not watched, its status is final
+    :return current components status, components when unchanged at timeout
+    '''
+    if is_terminal(components):
+        return components
+    etag = status_etag(components)
+    latest = {component.get('id'): component for component in components}
+    queue = status_hub.subscribe(service_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _END or item is _ERROR:
+                # Watch over: terminal (its last delta is already merged),
+                # deleted or failed, the client reads again
+                break
+            latest.update(
+                (component.get('id'), component) for component in item)
+            current = status_hub.current(service_id) or list(latest.values())
+            if status_etag(current) != etag:
+                return current
+    finally:
+        status_hub.unsubscribe(service_id, queue)
+    return status_hub.current(service_id) or list(latest.values())
@@ -0,0 +1,13 @@
+'''
+    Tests import the app package from src, CB and shim point to an unreachable
+    local port, tests replace the HTTP sessions they need
+'''
+import os
+import sys
+
+os.environ.setdefault('CB_URL', 'http://127.0.0.1')
+os.environ.setdefault('CB_PORT', '9')
+os.environ.setdefault('K8S_SHIM_URL', 'http://127.0.0.1')
+os.environ.setdefault('K8S_SHIM_PORT', '9')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src'))
@@ -0,0 +1,156 @@
+'''
+    In memory stand-in of CBClient, holds simplified entities
+'''
+import json
+from typing import Dict, Iterable, List, Optional, Set
+from app.api_clients.cb_client import CBQueryError
+from app.api_clients.ngsild_query import NgsiLdQuery
+
+
+def _value(attribute):
+    if isinstance(attribute, dict) and attribute.get('type') in (
+            'Property', 'Relationship', 'GeoProperty'):
+        return attribute.get('object', attribute.get('value'))
+    return attribute
+
+
+class FakeCBClient:
+    '''
+        Entities by id, queried by type, id list and service== filters
+        Like Orion-LD, an entity with none of the projected attrs is not found
+        Queries of an entity type in failing_types fail like an unreachable CB,
+        batch updates and attribute deletes of entities in failing_ids fail
+    '''
+
+    def __init__(self, entities: Iterable[dict] = ()):
+        self.entities: Dict[str, dict] = {
+            entity['id']: dict(entity)
+            for entity in entities
+        }
+        self.failing_types: Set[str] = set()
+        self.failing_ids: Set[str] = set()
+        self.writes: List[tuple] = []
+
+    def __call__(self):
+        # Replaces the CBClient class, every instance shares the store
+        return self
+
+    def query_entity(self, entity_id, ngsild_params=None) -> Optional[dict]:
+        entity = self.entities.get(entity_id)
+        if entity is None or entity['type'] in self.failing_types:
+            return None
+        if isinstance(ngsild_params, NgsiLdQuery) and not self._projected(
+                entity, ngsild_params):
+            return None
+        return dict(entity)
+
+    @staticmethod
+    def _projected(entity: dict, query: NgsiLdQuery) -> bool:
+        return not query.attrs or any(attr in entity for attr in query.attrs)
+
+    def _matches(self, entity: dict, query: NgsiLdQuery) -> bool:
+        if query.entity_type and entity['type'] != query.entity_type:
+            return False
+        if query.ids and entity['id'] not in query.ids:
+            return False
+        for term in query.q_terms:
+            attr, value = term.split('==', 1)
+            if entity.get(attr) != json.loads(value):
+                return False
+        return self._projected(entity, query)
+
+    def iter_entities(self, query: NgsiLdQuery, page_size=None, prefetch=False):
+        if query.entity_type in self.failing_types:
+            raise CBQueryError(f'Query {query} failed at offset 0')
+        for entity in list(self.entities.values()):
+            if self._matches(entity, query):
+                yield dict(entity)
+
+    def _result(self, ids) -> dict:
+        return {'success': list(ids), 'errors': []}
+
+    def batch_create(self, entities: List[dict]) -> dict:
+        self.writes.append(('create', [entity['id'] for entity in entities]))
+        for entity in entities:
+            self.entities[entity['id']] = {
+                name: _value(attribute)
+                for name, attribute in entity.items()
+            }
+        return self._result(entity['id'] for entity in entities)
+
+    def batch_upsert(self, entities: List[dict], options: str = None) -> dict:
+        self.writes.append(('upsert', [entity['id'] for entity in entities]))
+        for entity in entities:
+            stored = self.entities.get(entity['id'], {}) \
+                if options == 'update' else {}
+            stored.update({
+                name: _value(attribute)
+                for name, attribute in entity.items()
+            })
+            self.entities[entity['id']] = stored
+        return self._result(entity['id'] for entity in entities)
+
+    def batch_update(self, entities: List[dict], options: str = None) -> dict:
+        self.writes.append(('update', [entity['id'] for entity in entities]))
+        result = {'success': [], 'errors': []}
+        for entity in entities:
+            if entity['id'] in self.failing_ids:
+                result['errors'].append({
+                    'entityId': entity['id'],
+                    'error': {
+                        'status': 500
+                    }
+                })
+                continue
+            self.entities.setdefault(entity['id'], {}).update({
+                name: _value(attribute)
+                for name, attribute in entity.items()
+            })
+            result['success'].append(entity['id'])
+        return result
+
+    def delete_entity_attr(self, entity_id, attr) -> int:
+        self.writes.append(('delete_attr', [f'{entity_id}/{attr}']))
+        if entity_id in self.failing_ids:
+            return None
+        entity = self.entities.get(entity_id)
+        if entity is None or attr not in entity:
+            return 404
+        del entity[attr]
+        return 204
+
+    def batch_delete(self, entity_ids: List[str]) -> dict:
+        self.writes.append(('delete', list(entity_ids)))
+        for entity_id in entity_ids:
+            self.entities.pop(entity_id, None)
+        return self._result(entity_ids)
+
+
+def service_entities(service_id: str = 'urn:ngsi-ld:Service:s1',
+                     component_status: str = 'urn:ngsi-ld:ServiceComponentStatus:Running',
+                     action_type: str = 'FINISHED') -> List[dict]:
+    '''
+        Simplified entities of a service with one component, its requirements and a port
+    '''
+    component_id = f'{service_id}:Component:c1'
+    return [{
+        'id': service_id,
+        'type': 'Service',
+        'actionType': action_type
+    }, {
+        'id': component_id,
+        'type': 'ServiceComponent',
+        'service': service_id,
+        'serviceComponentStatus': component_status,
+        'infrastructureElementRequirements':
+        f'{component_id}:InfrastructureElementRequirements',
+        'networkPorts': 'urn:ngsi-ld:NetworkPort:p1'
+    }, {
+        'id': f'{component_id}:InfrastructureElementRequirements',
+        'type': 'InfrastructureElementRequirements'
+    }, {
+        'id': 'urn:ngsi-ld:NetworkPort:p1',
+        'type': 'NetworkPort',
+        'portNumber': 80,
+        'portProtocol': 'TCP'
+    }]
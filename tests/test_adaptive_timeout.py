@@ -0,0 +1,72 @@
+'''
+    Adaptive CB timeouts: follow observed latency within bounds, back off on timeouts
+'''
+import pytest
+import requests
+from app.api_clients.adaptive_timeout import AdaptiveTimeout, OperationTimeouts
+
+
+def _timeout(**kwargs) -> AdaptiveTimeout:
+    settings = dict(initial=5, floor=1, ceiling=15, alpha=0.125, deviations=4,
+                    min_samples=3)
+    settings.update(kwargs)
+    return AdaptiveTimeout('query', **settings)
+
+
+def test_initial_timeout_until_enough_samples():
+    timeout = _timeout()
+    timeout.record(0.1)
+    timeout.record(0.1)
+    assert timeout.value() == 5
+    timeout.record(0.1)
+    assert timeout.value() < 5
+
+
+def test_timeout_follows_latency_within_bounds():
+    timeout = _timeout(floor=0.1)
+    for _ in range(50):
+        timeout.record(1.0)
+    # Steady latency, the deviation decays towards 0
+    assert 1.0 <= timeout.value() < 1.5
+    fast = _timeout()
+    for _ in range(5):
+        fast.record(0.01)
+    assert fast.value() == 1
+    slow = _timeout()
+    for _ in range(5):
+        slow.record(30)
+    assert slow.value() == 15
+
+
+def test_timeouts_double_until_next_answer():
+    timeout = _timeout(min_samples=1)
+    timeout.record(1.0)
+    # latency 1 + 4 * deviation 0.5
+    assert timeout.value() == 3
+    timeout.record_timeout()
+    assert timeout.value() == 6
+    timeout.record_timeout()
+    assert timeout.value() == 12
+    for _ in range(5):
+        timeout.record_timeout()
+    assert timeout.value() == 15
+    timeout.record(1.0)
+    # Backoff reset, the same latency narrows the deviation to 0.4375
+    assert timeout.value() == 2.75
+
+
+def test_measure_records_latency_and_timeouts():
+    timeouts = OperationTimeouts()
+    with timeouts.measure('query') as value:
+        assert value == timeouts.get('query').value()
+    assert timeouts.get('query').stats()['samples'] == 1
+    with pytest.raises(requests.exceptions.Timeout):
+        with timeouts.measure('query'):
+            raise requests.exceptions.Timeout()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with timeouts.measure('query'):
+            raise requests.exceptions.ConnectionError()
+    stats = timeouts.get('query').stats()
+    assert stats['samples'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['backoff'] == 2
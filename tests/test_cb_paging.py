@@ -0,0 +1,98 @@
+'''
+    Paged iteration over CB query results
+'''
+import asyncio
+import pytest
+from app.api_clients import async_cb_client, cb_client
+from app.api_clients.cb_client import CBQueryError
+from app.api_clients.ngsild_query import NgsiLdQuery
+
+QUERY = NgsiLdQuery(entity_type='ServiceComponent')
+
+
+def pages(total: int, fail_at: int = None):
+    '''
+        query_entities stand-in serving total entities, None at offset fail_at
+    '''
+    queries = []
+
+    def query_entities(query: NgsiLdQuery):
+        queries.append((query.limit, query.offset))
+        if query.offset == fail_at:
+            return None
+        return [{
+            'id': f'e{index}'
+        } for index in range(query.offset,
+                             min(query.offset + query.limit, total))]
+
+    return query_entities, queries
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(cb_client.k8s_shim_client, 'get_m2m_cb_token',
+                        lambda: 'token')
+    return cb_client.CBClient()
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_iterates_over_all_pages(client, prefetch):
+    client.query_entities, queries = pages(5)
+    entities = list(client.iter_entities(QUERY, page_size=2, prefetch=prefetch))
+    assert [entity['id'] for entity in entities] == [f'e{i}' for i in range(5)]
+    assert queries == [(2, 0), (2, 2), (2, 4)]
+
+
+def test_full_last_page_ends_on_empty_page(client):
+    client.query_entities, queries = pages(4)
+    assert len(list(client.iter_entities(QUERY, page_size=2))) == 4
+    assert queries == [(2, 0), (2, 2), (2, 4)]
+
+
+def test_no_results(client):
+    client.query_entities, _ = pages(0)
+    assert not list(client.iter_entities(QUERY, page_size=2))
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_failed_page_raises(client, prefetch):
+    client.query_entities, _ = pages(5, fail_at=2)
+    entities = client.iter_entities(QUERY, page_size=2, prefetch=prefetch)
+    assert [next(entities)['id'], next(entities)['id']] == ['e0', 'e1']
+    with pytest.raises(CBQueryError):
+        next(entities)
+
+
+def test_failed_first_page_raises(client):
+    client.query_entities, _ = pages(5, fail_at=0)
+    with pytest.raises(CBQueryError):
+        list(client.iter_entities(QUERY, page_size=2))
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_async_failed_page_raises(monkeypatch, prefetch):
+    monkeypatch.setattr(async_cb_client.k8s_shim_client.cb_token_cache,
+                        'peek', lambda: 'token')
+
+    async def run():
+        client = async_cb_client.AsyncCBClient()
+        query_entities, _ = pages(5, fail_at=2)
+
+        async def async_query_entities(query):
+            return query_entities(query)
+
+        client.query_entities = async_query_entities
+        seen = []
+        with pytest.raises(CBQueryError):
+            async for entity in client.iter_entities(QUERY,
+                                                     page_size=2,
+                                                     prefetch=prefetch):
+                seen.append(entity['id'])
+        assert seen == ['e0', 'e1']
+
+        query_entities, _ = pages(5)
+        assert len([
+            entity async for entity in client.iter_entities(QUERY, page_size=2)
+        ]) == 5
+
+    asyncio.run(run())
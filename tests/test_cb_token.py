@@ -0,0 +1,90 @@
+'''
+    m2m token cache invalidation and CB 401 handling
+'''
+import asyncio
+import threading
+from unittest import mock
+import pytest
+from app.api_clients import k8s_shim_client, cb_client, async_cb_client
+
+
+class Response:
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'id': 'urn:ngsi-ld:Service:s1'}
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    tokens = iter(['t1', 't2', 't3'])
+    cache = k8s_shim_client.M2MTokenCache('test', lambda: next(tokens))
+    monkeypatch.setattr(k8s_shim_client, 'cb_token_cache', cache)
+    yield cache
+    if cache._timer is not None:
+        cache._timer.cancel()
+
+
+def test_invalidate_drops_only_the_rejected_token(token_cache):
+    assert token_cache.get() == 't1'
+    token_cache.invalidate('t1')
+    assert token_cache.get() == 't2'
+    # A late 401 on t1 must not discard t2
+    token_cache.invalidate('t1')
+    assert token_cache.get() == 't2'
+    token_cache.invalidate()
+    assert token_cache.get() == 't3'
+
+
+def test_cb_client_retries_once_with_fresh_token_on_401(token_cache):
+    client = cb_client.CBClient()
+    sent = []
+
+    def request(method, url, headers, **kwargs):
+        sent.append(headers['Authorization'])
+        return Response(401 if headers['Authorization'] == 'Bearer t1' else 200)
+
+    client.session = mock.Mock(request=request)
+    assert client._request('get', 'http://cb/entities').status_code == 200
+    assert sent == ['Bearer t1', 'Bearer t2']
+    assert token_cache.get() == 't2'
+
+
+def test_cb_client_returns_second_401(token_cache):
+    client = cb_client.CBClient()
+    client.session = mock.Mock(
+        request=mock.Mock(return_value=Response(401)))
+    assert client._request('get', 'http://cb/entities').status_code == 401
+    assert client.session.request.call_count == 2
+
+
+def test_async_cb_client_fetches_missing_token_off_the_event_loop(token_cache):
+    async def run():
+        client = async_cb_client.AsyncCBClient()
+        assert client.m2m_cb_token is None
+        loop_thread = threading.get_ident()
+        fetch_threads = []
+        fetch = token_cache._fetch
+
+        def fetch_in_thread():
+            fetch_threads.append(threading.get_ident())
+            return fetch()
+
+        token_cache._fetch = fetch_in_thread
+        sent = []
+
+        async def request(method, url, headers, **kwargs):
+            sent.append(headers['Authorization'])
+            return Response(200)
+
+        client.session = mock.Mock(request=request)
+        await client._request('get', 'http://cb/entities')
+        assert sent == ['Bearer t1']
+        assert fetch_threads and loop_thread not in fetch_threads
+
+    asyncio.run(run())
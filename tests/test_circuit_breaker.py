@@ -0,0 +1,107 @@
+'''
+    Circuit breaker: a half open probe is released however the call ends,
+    only CB failures count against the circuit
+'''
+import asyncio
+import time
+import httpx
+import pytest
+import requests
+from app.utils.decorators import CircuitBreaker, RetryPolicy,\
+    catch_httpx_exceptions, catch_requests_exceptions
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker('test', error_rate=0.5, min_requests=1,
+                             window=30, open_seconds=0.01)
+    breaker.record(False)
+    assert breaker.stats()['state'] == CircuitBreaker.OPEN
+    time.sleep(0.02)
+    return breaker
+
+
+def test_cancelled_async_probe_is_released():
+    breaker = _half_open_breaker()
+    started = asyncio.Event()
+
+    @catch_httpx_exceptions(breaker=breaker)
+    async def probe():
+        started.set()
+        await asyncio.sleep(10)
+
+    async def cancel_probe():
+        task = asyncio.create_task(probe())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.stats()['state'] == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_interrupted_sync_probe_is_released():
+    breaker = _half_open_breaker()
+
+    @catch_requests_exceptions(breaker=breaker)
+    def probe():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        probe()
+    assert breaker.allow()
+
+
+def test_successful_probe_closes_circuit():
+    breaker = _half_open_breaker()
+
+    @catch_requests_exceptions(breaker=breaker)
+    def probe():
+        return 200
+
+    assert probe() == 200
+    assert breaker.stats()['state'] == CircuitBreaker.CLOSED
+
+
+def test_caller_error_releases_probe_without_closing_circuit():
+    breaker = _half_open_breaker()
+
+    @catch_requests_exceptions(breaker=breaker)
+    def probe():
+        raise ValueError('Entity ID must be provided for deletion.')
+
+    with pytest.raises(ValueError):
+        probe()
+    assert breaker.stats()['state'] == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_invalid_json_is_not_retried_nor_a_failure():
+    breaker = CircuitBreaker('test', error_rate=0.5, min_requests=1,
+                             window=30, open_seconds=10)
+    calls = []
+
+    @catch_requests_exceptions(retry=RetryPolicy(3, 0, 0), breaker=breaker)
+    def query():
+        calls.append(1)
+        raise requests.exceptions.JSONDecodeError('Expecting value', '<html>', 0)
+
+    assert query() is None
+    assert len(calls) == 1
+    assert breaker.stats()['failures'] == 0
+
+
+def test_undecodable_async_body_is_not_retried_nor_a_failure():
+    breaker = CircuitBreaker('test', error_rate=0.5, min_requests=1,
+                             window=30, open_seconds=10)
+    calls = []
+
+    @catch_httpx_exceptions(retry=RetryPolicy(3, 0, 0), breaker=breaker)
+    async def query():
+        calls.append(1)
+        return httpx.Response(200, content=b'<html>').json()
+
+    assert asyncio.run(query()) is None
+    assert len(calls) == 1
+    assert breaker.stats()['failures'] == 0
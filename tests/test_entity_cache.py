@@ -0,0 +1,62 @@
+'''
+    Entity cache: results read across a write are never stored, writes invalidate
+'''
+from app.api_clients.entity_cache import EntityCache
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:c1'
+COMPONENTS_PARAMS = 'type=ServiceComponent&format=simplified'
+
+
+def _cache() -> EntityCache:
+    return EntityCache(max_entries=10, default_ttl=60, ttls={})
+
+
+def test_result_read_before_a_write_is_not_stored():
+    cache = _cache()
+    generation = cache.generation()
+    # Written while the read was in flight
+    cache.invalidate([SERVICE_ID])
+    cache.put_entity(SERVICE_ID, 'format=simplified', {
+        'id': SERVICE_ID,
+        'type': 'Service'
+    }, generation)
+    assert cache.get_entity(SERVICE_ID, 'format=simplified') is None
+
+
+def test_result_read_without_writes_is_served():
+    cache = _cache()
+    service = {'id': SERVICE_ID, 'type': 'Service'}
+    cache.put_entity(SERVICE_ID, 'format=simplified', service,
+                     cache.generation())
+    cached = cache.get_entity(SERVICE_ID, 'format=simplified')
+    assert cached == service
+    cached['type'] = 'changed'
+    assert cache.get_entity(SERVICE_ID, 'format=simplified') == service
+
+
+def test_clear_drops_reads_in_flight():
+    cache = _cache()
+    generation = cache.generation()
+    cache.clear()
+    cache.put_entities(COMPONENTS_PARAMS, [{'id': COMPONENT_ID}], generation)
+    assert cache.get_entities(COMPONENTS_PARAMS) is None
+
+
+def test_write_invalidates_lists_of_its_type():
+    cache = _cache()
+    cache.put_entities(COMPONENTS_PARAMS, [{'id': COMPONENT_ID}],
+                       cache.generation())
+    cache.put_entities('type=Domain', [{'id': 'urn:ngsi-ld:Domain:d1'}],
+                       cache.generation())
+    cache.invalidate([f'{SERVICE_ID}:Component:c2'], 'ServiceComponent')
+    assert cache.get_entities(COMPONENTS_PARAMS) is None
+    assert cache.get_entities('type=Domain') is not None
+
+
+def test_zero_ttl_type_is_not_cached():
+    cache = EntityCache(max_entries=10, default_ttl=60,
+                        ttls={'ServiceComponent': 0})
+    cache.put_entities(COMPONENTS_PARAMS, [{'id': COMPONENT_ID}],
+                       cache.generation())
+    assert cache.get_entities(COMPONENTS_PARAMS) is None
@@ -0,0 +1,35 @@
+'''
+    Job queue: stopping never blocks on a full queue and still drains it
+'''
+import threading
+import time
+from app.utils.job_queue import JobQueue
+
+
+def test_stop_with_full_queue_drains_it_without_blocking():
+    job_queue = JobQueue(workers=1, max_size=2, retention=10)
+    release = threading.Event()
+    ran = []
+
+    def run(name):
+        release.wait(5)
+        ran.append(name)
+
+    job_queue.start()
+    first = job_queue.submit('job', run, 'a')
+    while job_queue.stats()['running'] != 1:
+        time.sleep(0.01)
+    job_queue.submit('job', run, 'b')
+    job_queue.submit('job', run, 'c')
+    assert job_queue.stats()['queued'] == 2
+
+    workers = list(job_queue._threads)  # pylint: disable=protected-access
+    started = time.monotonic()
+    job_queue.stop(0.1)
+    assert time.monotonic() - started < 1
+    release.set()
+    for worker in workers:
+        worker.join(5)
+        assert not worker.is_alive()
+    assert ran == ['a', 'b', 'c']
+    assert first.finished_at is not None
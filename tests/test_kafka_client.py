@@ -0,0 +1,74 @@
+'''
+    fe2data producer: delivery reports resolve futures, awaitable from the event loop
+'''
+import asyncio
+import threading
+from concurrent.futures import Future
+import pytest
+from confluent_kafka import KafkaException
+from app.utils import kafka_client
+
+
+class FakeProducer:
+    '''
+        Keeps the delivery callbacks, delivered by the test
+    '''
+
+    def __init__(self, config):
+        self.callbacks = []
+
+    def produce(self, topic, value, key=None, on_delivery=None):
+        self.callbacks.append(on_delivery)
+
+    def poll(self, timeout):
+        return 0
+
+    def flush(self, timeout):
+        return 0
+
+
+class FakeMessage:
+
+    def topic(self):
+        return 'fe2data'
+
+    def partition(self):
+        return 0
+
+
+@pytest.fixture
+def producer(monkeypatch):
+    monkeypatch.setattr(kafka_client, 'Producer', FakeProducer)
+    return kafka_client.Fe2DataProducer({}, 'fe2data')
+
+
+def test_produce_outside_event_loop_returns_future(producer):
+    future = producer.produce(b'message')
+    assert isinstance(future, Future)
+    message = FakeMessage()
+    producer._producer.callbacks[0](None, message)
+    assert future.result(0) is message
+
+
+def test_produce_from_event_loop_is_awaitable(producer):
+    message = FakeMessage()
+
+    async def produce():
+        delivery = producer.produce(b'message')
+        # Delivery reports come from the poll thread
+        threading.Thread(target=producer._producer.callbacks[0],
+                         args=(None, message)).start()
+        return await asyncio.wait_for(delivery, 1)
+
+    assert asyncio.run(produce()) is message
+
+
+def test_failed_delivery_raises_when_awaited(producer):
+
+    async def produce():
+        delivery = producer.produce(b'message')
+        producer._producer.callbacks[0]('broker down', None)
+        await delivery
+
+    with pytest.raises(KafkaException):
+        asyncio.run(produce())
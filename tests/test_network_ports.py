@@ -0,0 +1,167 @@
+'''
+    NetworkPort ids: deterministic, unique per service, stored ports reused by updates
+'''
+import pytest
+from app.app_models.tosca_models import parse_tosca
+from app.utils import aeriOS_contrinuum_generator as generator
+from app.utils import continuum_utils, service_diff
+from app.utils.aeriOS_contrinuum_generator import aeriOSContinuumEnitiesGenerator,\
+    network_port_id
+from tests.tosca_documents import tosca_document
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:web'
+IER_ID = f'{COMPONENT_ID}:InfrastructureElementRequirements'
+LOCATING = 'urn:ngsi-ld:ServiceComponentStatus:Locating'
+
+
+@pytest.fixture(autouse=True)
+def host_domain(monkeypatch):
+    monkeypatch.setattr(continuum_utils, 'get_host_domain',
+                        lambda: 'urn:ngsi-ld:Domain:D1')
+
+
+def _port_ids(tosca: dict) -> list:
+    entities = aeriOSContinuumEnitiesGenerator(SERVICE_ID,
+                                               parse_tosca(tosca)).run()
+    return [entity.id for entity in entities if entity.type == 'NetworkPort']
+
+
+def test_port_id_is_deterministic():
+    assert network_port_id(COMPONENT_ID, 'port1') == network_port_id(
+        COMPONENT_ID, 'port1')
+    assert len({
+        network_port_id(COMPONENT_ID, 'port1'),
+        network_port_id(COMPONENT_ID, 'port2'),
+        network_port_id(f'{SERVICE_ID}:Component:db', 'port1'),
+        network_port_id(COMPONENT_ID, 'port1', attempt=1)
+    }) == 4
+    assert _port_ids(tosca_document()) == _port_ids(tosca_document())
+
+
+def test_port_name_repeated_in_network_requirements():
+    tosca = tosca_document()
+    requirements = tosca['node_templates']['web']['requirements']
+    requirements.append(requirements[0])
+    port_ids = _port_ids(tosca)
+    assert port_ids == [
+        network_port_id(COMPONENT_ID, 'port1'),
+        network_port_id(COMPONENT_ID, 'port1', attempt=1)
+    ]
+
+
+def test_colliding_port_id_gets_next_attempt(monkeypatch):
+    tosca = tosca_document()
+    tosca['node_templates']['web']['requirements'][0]['network'][
+        'properties']['ports']['port2'] = {
+            'properties': {
+                'protocol': ['tcp'],
+                'source': 443
+            }
+        }
+
+    def colliding_port_id(scomponent_id, port_name, attempt=0):
+        # Every port name hashes to the same id on its first attempt
+        return f'urn:ngsi-ld:NetworkPort:{attempt}'
+
+    monkeypatch.setattr(generator, 'network_port_id', colliding_port_id)
+    assert _port_ids(tosca) == [
+        'urn:ngsi-ld:NetworkPort:0', 'urn:ngsi-ld:NetworkPort:1'
+    ]
+
+
+def _stored_service(port_id: str, port_number: int = 80) -> dict:
+    '''
+    Stored (simplified) service with one port
+    '''
+    return {
+        SERVICE_ID: {
+            'id': SERVICE_ID,
+            'type': 'Service'
+        },
+        COMPONENT_ID: {
+            'id': COMPONENT_ID,
+            'type': 'ServiceComponent',
+            'service': SERVICE_ID,
+            'networkPorts': port_id,
+            'infrastructureElementRequirements': IER_ID
+        },
+        IER_ID: {
+            'id': IER_ID,
+            'type': 'InfrastructureElementRequirements'
+        },
+        port_id: {
+            'id': port_id,
+            'type': 'NetworkPort',
+            'portNumber': port_number,
+            'portProtocol': 'tcp'
+        }
+    }
+
+
+def _new_service(port_number: int = 80) -> list:
+    '''
+    Generated (normalized) service with one port
+    '''
+    port_id = network_port_id(COMPONENT_ID, 'port1')
+    return [{
+        'id': SERVICE_ID,
+        'type': 'Service'
+    }, {
+        'id': COMPONENT_ID,
+        'type': 'ServiceComponent',
+        'service': {
+            'type': 'Relationship',
+            'object': SERVICE_ID
+        },
+        'networkPorts': {
+            'type': 'Relationship',
+            'object': [port_id]
+        },
+        'infrastructureElementRequirements': {
+            'type': 'Relationship',
+            'object': IER_ID
+        }
+    }, {
+        'id': IER_ID,
+        'type': 'InfrastructureElementRequirements'
+    }, {
+        'id': port_id,
+        'type': 'NetworkPort',
+        'portNumber': {
+            'type': 'Property',
+            'value': port_number
+        },
+        'portProtocol': {
+            'type': 'Property',
+            'value': 'tcp'
+        }
+    }]
+
+
+def test_unchanged_port_with_deterministic_id():
+    diff = service_diff.diff_service(
+        SERVICE_ID, _new_service(),
+        _stored_service(network_port_id(COMPONENT_ID, 'port1')))
+    assert diff.is_empty()
+
+
+def test_unchanged_port_with_random_id_is_reused():
+    # Stored by an allocation that generated random port ids
+    diff = service_diff.diff_service(
+        SERVICE_ID, _new_service(),
+        _stored_service('urn:ngsi-ld:NetworkPort:random'))
+    assert diff.is_empty()
+
+
+def test_changed_port_replaces_stored_one():
+    new_port_id = network_port_id(COMPONENT_ID, 'port1')
+    diff = service_diff.diff_service(
+        SERVICE_ID, _new_service(port_number=8080),
+        _stored_service('urn:ngsi-ld:NetworkPort:random'))
+    assert diff.created == {new_port_id}
+    assert diff.deletes == ['urn:ngsi-ld:NetworkPort:random']
+    assert diff.changed_components == {COMPONENT_ID}
+    component = diff.upserts[COMPONENT_ID]
+    assert component['networkPorts']['object'] == [new_port_id]
+    assert component['serviceComponentStatus']['object'] == LOCATING
@@ -0,0 +1,56 @@
+'''
+    NGSI-LD query params: q values are quoted, escaped and URL encoded
+'''
+from urllib.parse import parse_qs
+from app.api_clients.ngsild_query import NgsiLdQuery
+
+
+def _params(query: NgsiLdQuery) -> dict:
+    return {
+        name: values[0]
+        for name, values in parse_qs(query.to_params()).items()
+    }
+
+
+def test_string_values_are_quoted():
+    query = NgsiLdQuery(entity_type='ServiceComponent').where(
+        'service', 'urn:ngsi-ld:Service:s1')
+    assert query.to_params() == (
+        'type=ServiceComponent&q=service%3D%3D%22urn:ngsi-ld:Service:s1%22'
+        '&format=simplified')
+
+
+def test_reserved_characters_round_trip():
+    value = 'a b&c;d="e"/f?#%'
+    query = NgsiLdQuery().where('name', value)
+    encoded_q = query.to_params().split('&')[0]
+    for reserved in (' ', ';', '"', '?', '#'):
+        assert reserved not in encoded_q
+    assert _params(query)['q'] == 'name==' + '"a b&c;d=\\"e\\"/f?#%"'
+
+
+def test_numbers_and_booleans_are_not_quoted():
+    query = NgsiLdQuery().where('portNumber', 80).where('public', True,
+                                                         op='!=')
+    assert _params(query)['q'] == 'portNumber==80;public!=true'
+
+
+def test_ids_attrs_and_paging():
+    query = NgsiLdQuery(entity_type='NetworkPort',
+                        ids=['urn:ngsi-ld:NetworkPort:p1', 'urn:ngsi-ld:NetworkPort:p2'],
+                        attrs=['portNumber', 'portProtocol'],
+                        count=True,
+                        format=None,
+                        local=True).page(100, 200)
+    assert query.to_params() == (
+        'type=NetworkPort&id=urn:ngsi-ld:NetworkPort:p1,urn:ngsi-ld:NetworkPort:p2'
+        '&attrs=portNumber,portProtocol&limit=100&offset=200&count=true&local=true')
+
+
+def test_page_leaves_query_unchanged():
+    query = NgsiLdQuery(entity_type='ServiceComponent').where('service', 's1')
+    page = query.page(10, 20)
+    page.where('serviceComponentStatus', 'Running')
+    assert query.limit is None and query.offset is None
+    assert query.q_terms == ['service=="s1"']
+    assert str(query) == query.to_params()
@@ -0,0 +1,56 @@
+'''
+    Purge deletes the Service only once its components are known to be gone
+'''
+import pytest
+from app.api_clients.cb_client import CBQueryError
+from app.utils import continuum_utils
+from tests.fakes import FakeCBClient, service_entities
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:c1'
+
+
+@pytest.fixture
+def cb(monkeypatch):
+    fake = FakeCBClient(service_entities(SERVICE_ID))
+    monkeypatch.setattr(continuum_utils, 'CBClient', fake)
+    return fake
+
+
+def test_purge_deletes_leafs_components_then_service(cb):
+    summary = continuum_utils.delete_from_continuum_service_by_id(SERVICE_ID)
+    assert not cb.entities
+    assert summary['deleted'][-2:] == [COMPONENT_ID, SERVICE_ID]
+    assert summary['failed'] == summary['kept'] == []
+
+
+def test_purge_refuses_when_components_can_not_be_read(cb):
+    cb.failing_types.add('ServiceComponent')
+    with pytest.raises(CBQueryError):
+        continuum_utils.delete_from_continuum_service_by_id(SERVICE_ID)
+    assert SERVICE_ID in cb.entities
+    assert not cb.writes
+
+
+def test_purge_keeps_service_when_component_appeared(cb):
+    snapshot = continuum_utils.get_service_snapshot(SERVICE_ID)
+    # Created after the snapshot was read
+    cb.entities[f'{SERVICE_ID}:Component:late'] = {
+        'id': f'{SERVICE_ID}:Component:late',
+        'type': 'ServiceComponent',
+        'service': SERVICE_ID
+    }
+    summary = continuum_utils.delete_from_continuum_service_by_id(
+        SERVICE_ID, snapshot)
+    assert SERVICE_ID in cb.entities
+    assert summary['kept'] == [SERVICE_ID]
+
+
+def test_purge_keeps_service_when_confirmation_query_fails(cb):
+    snapshot = continuum_utils.get_service_snapshot(SERVICE_ID)
+    cb.failing_types.add('ServiceComponent')
+    summary = continuum_utils.delete_from_continuum_service_by_id(
+        SERVICE_ID, snapshot)
+    assert SERVICE_ID in cb.entities
+    assert COMPONENT_ID not in cb.entities
+    assert summary['kept'] == [SERVICE_ID]
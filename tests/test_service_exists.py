@@ -0,0 +1,16 @@
+'''
+    Service existence does not depend on optional Service attributes
+'''
+from app.utils import continuum_utils
+from tests.fakes import FakeCBClient
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+
+
+def test_service_without_action_type_exists(monkeypatch):
+    fake = FakeCBClient([{'id': SERVICE_ID, 'type': 'Service', 'name': 's1'}])
+    monkeypatch.setattr(continuum_utils, 'CBClient', fake)
+    assert continuum_utils.check_service_exists(SERVICE_ID)
+    assert not continuum_utils.check_service_exists('urn:ngsi-ld:Service:s2')
+    assert continuum_utils.get_existing_services(
+        [SERVICE_ID, 'urn:ngsi-ld:Service:s2']) == {SERVICE_ID}
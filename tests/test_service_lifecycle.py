@@ -0,0 +1,80 @@
+'''
+    Deallocation and re-allocation: deployment engines are only notified of written status
+'''
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app import routers
+from app.utils import continuum_utils
+from tests.fakes import FakeCBClient, service_entities
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:c1'
+RUNNING = 'urn:ngsi-ld:ServiceComponentStatus:Running'
+FINISHED = 'urn:ngsi-ld:ServiceComponentStatus:Finished'
+REMOVING = 'urn:ngsi-ld:ServiceComponentStatus:Removing'
+
+
+@pytest.fixture
+def published(monkeypatch):
+    service_ids = []
+    monkeypatch.setattr(routers.outbox, 'publish_fe2data',
+                        lambda service_id: service_ids.append(service_id))
+    monkeypatch.setattr(continuum_utils, 'get_host_domain',
+                        lambda: 'urn:ngsi-ld:Domain:D1')
+    return service_ids
+
+
+def _cb(monkeypatch, component_status: str) -> FakeCBClient:
+    fake = FakeCBClient(service_entities(SERVICE_ID, component_status))
+    monkeypatch.setattr(continuum_utils, 'CBClient', fake)
+    return fake
+
+
+def test_deallocation_publishes_written_stop(monkeypatch, published):
+    cb = _cb(monkeypatch, RUNNING)
+    result = routers.run_deallocate_service(SERVICE_ID)
+    assert result == {'status': 'service deallocation initiated'}
+    assert cb.entities[COMPONENT_ID]['serviceComponentStatus'] == REMOVING
+    assert published == [SERVICE_ID]
+
+
+def test_failed_stop_is_not_published(monkeypatch, published):
+    cb = _cb(monkeypatch, RUNNING)
+    cb.failing_ids.add(COMPONENT_ID)
+    app = FastAPI()
+    app.include_router(routers.router)
+    response = TestClient(app).delete(f'/hlo_fe/services/{SERVICE_ID}')
+    assert response.status_code == 500
+    assert response.json()['errors'][0]['entityId'] == COMPONENT_ID
+    assert not published
+
+
+def test_failed_restart_is_not_published(monkeypatch, published):
+    cb = _cb(monkeypatch, FINISHED)
+    cb.failing_ids.add(SERVICE_ID)
+    result = routers.run_re_allocate_service(SERVICE_ID)
+    assert result['errors'][0]['entityId'] == SERVICE_ID
+    assert not published
+
+
+def test_restart_is_published(monkeypatch, published):
+    _cb(monkeypatch, FINISHED)
+    result = routers.run_re_allocate_service(SERVICE_ID)
+    assert result['status'] == 'service re-allocation initiated'
+    assert published == [SERVICE_ID]
+
+
+def test_unreadable_service_is_not_deallocated(monkeypatch, published):
+    cb = _cb(monkeypatch, RUNNING)
+    cb.failing_types.add('ServiceComponent')
+    app = FastAPI()
+    app.include_router(routers.router)
+    response = TestClient(app).delete(f'/hlo_fe/services/{SERVICE_ID}')
+    assert response.status_code == 500
+    assert response.json()['status'] == 'failed to read service'
+    assert response.json()['errors'][0]['entityId'] == SERVICE_ID
+    assert cb.entities[COMPONENT_ID]['serviceComponentStatus'] == RUNNING
+    assert not published
+    assert routers.run_re_allocate_service(
+        SERVICE_ID)['status'] == 'failed to read service'
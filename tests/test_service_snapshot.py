@@ -0,0 +1,49 @@
+'''
+    Service snapshots never stand for a service whose components were not read
+'''
+import pytest
+from app.api_clients.cb_client import CBQueryError
+from app.utils import continuum_utils
+from tests.fakes import FakeCBClient, service_entities
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+
+
+@pytest.fixture
+def cb(monkeypatch):
+    fake = FakeCBClient(service_entities(SERVICE_ID))
+    monkeypatch.setattr(continuum_utils, 'CBClient', fake)
+    return fake
+
+
+def test_snapshot_reads_components(cb):
+    snapshot = continuum_utils.get_service_snapshot(SERVICE_ID)
+    assert snapshot.component_ids() == [f'{SERVICE_ID}:Component:c1']
+    assert snapshot.components[0].networkPorts == ['urn:ngsi-ld:NetworkPort:p1']
+
+
+def test_snapshot_of_missing_service_is_none(cb):
+    assert continuum_utils.get_service_snapshot('urn:ngsi-ld:Service:x') is None
+
+
+def test_snapshot_raises_when_components_query_fails(cb):
+    cb.failing_types.add('ServiceComponent')
+    with pytest.raises(CBQueryError):
+        continuum_utils.get_service_snapshot(SERVICE_ID)
+
+
+def test_snapshot_is_never_built_from_a_missing_list():
+    with pytest.raises(CBQueryError):
+        continuum_utils.build_service_snapshot({'id': SERVICE_ID}, None)
+
+
+def test_stop_service_does_not_destroy_unread_service(cb):
+    cb.failing_types.add('ServiceComponent')
+    with pytest.raises(CBQueryError):
+        continuum_utils.stop_service(SERVICE_ID)
+    assert not cb.writes
+
+
+def test_stop_service(cb):
+    assert continuum_utils.stop_service(SERVICE_ID)
+    assert cb.entities[SERVICE_ID]['actionType'] == 'DESTROYING'
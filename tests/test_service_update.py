@@ -0,0 +1,139 @@
+'''
+    Service update (PATCH): only diffs against a complete view of the stored service
+'''
+import pytest
+from app import routers
+from app.api_clients.cb_client import CBQueryError
+from app.utils import service_diff
+from tests.fakes import FakeCBClient, service_entities
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:c1'
+
+
+@pytest.fixture
+def cb(monkeypatch):
+    fake = FakeCBClient(service_entities(SERVICE_ID))
+    monkeypatch.setattr(service_diff, 'CBClient', fake)
+    return fake
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    '''
+    The TOSCA translation generates the stored service with a new port
+    '''
+    entities = [{
+        'id': SERVICE_ID,
+        'type': 'Service'
+    }, {
+        'id': COMPONENT_ID,
+        'type': 'ServiceComponent',
+        'service': {
+            'type': 'Relationship',
+            'object': SERVICE_ID
+        },
+        'infrastructureElementRequirements': {
+            'type': 'Relationship',
+            'object': f'{COMPONENT_ID}:InfrastructureElementRequirements'
+        },
+        'networkPorts': {
+            'type': 'Relationship',
+            'object': ['urn:ngsi-ld:NetworkPort:p1', 'urn:ngsi-ld:NetworkPort:p2']
+        }
+    }, {
+        'id': f'{COMPONENT_ID}:InfrastructureElementRequirements',
+        'type': 'InfrastructureElementRequirements'
+    }, {
+        'id': 'urn:ngsi-ld:NetworkPort:p1',
+        'type': 'NetworkPort',
+        'portNumber': {'type': 'Property', 'value': 80},
+        'portProtocol': {'type': 'Property', 'value': 'TCP'}
+    }, {
+        'id': 'urn:ngsi-ld:NetworkPort:p2',
+        'type': 'NetworkPort',
+        'portNumber': {'type': 'Property', 'value': 443},
+        'portProtocol': {'type': 'Property', 'value': 'TCP'}
+    }]
+
+    class Generator:
+
+        def __init__(self, service_id, tosca_obj):
+            pass
+
+        def run(self):
+            return entities
+
+    class Ngsild:
+
+        def __init__(self, json_entities):
+            self.json_entities = json_entities
+
+        def get_ngsild_entities(self):
+            return self.json_entities
+
+    monkeypatch.setattr(routers.aeriOS_json_generator,
+                        'aeriOSContinuumEnitiesGenerator', Generator)
+    monkeypatch.setattr(routers.aeriOS_ngsild, 'aeriOSNgsild', Ngsild)
+    monkeypatch.setattr(routers.outbox, 'publish_fe2data',
+                        lambda service_id: None)
+    return entities
+
+
+def test_service_entities_are_read_whole(cb):
+    current = service_diff.get_service_entities(SERVICE_ID)
+    assert set(current) == set(cb.entities)
+
+
+@pytest.mark.parametrize('failing_type', [
+    'ServiceComponent', 'InfrastructureElementRequirements', 'NetworkPort'
+])
+def test_service_entities_raise_on_failed_read(cb, failing_type):
+    cb.failing_types.add(failing_type)
+    with pytest.raises(CBQueryError):
+        service_diff.get_service_entities(SERVICE_ID)
+
+
+def test_update_writes_only_the_changes(cb, generated):
+    result = routers.run_update_service(SERVICE_ID, tosca_obj=None)
+    assert result['created'] == 1
+    assert result['deleted'] == 0
+    assert result['changedComponents'] == [COMPONENT_ID]
+    assert cb.writes == [('upsert', [COMPONENT_ID, 'urn:ngsi-ld:NetworkPort:p2'])]
+
+
+def test_update_aborts_when_stored_view_is_incomplete(cb, generated):
+    cb.failing_types.add('ServiceComponent')
+    result = routers.run_update_service(SERVICE_ID, tosca_obj=None)
+    assert result['errors']
+    assert not cb.writes
+
+
+def test_attributes_no_longer_generated_are_deleted(cb, generated):
+    ier_id = f'{COMPONENT_ID}:InfrastructureElementRequirements'
+    # Stored by an allocation with a domain pin and a private image
+    cb.entities[ier_id]['domainId'] = 'urn:ngsi-ld:Domain:D1'
+    cb.entities[COMPONENT_ID]['repoPassword'] = 'secret'
+    # Attributes the generator never writes are left alone
+    cb.entities[ier_id]['area'] = {'coordinates': [[0, 0]]}
+    result = routers.run_update_service(SERVICE_ID, tosca_obj=None)
+    assert result['removedAttributes'] == 2
+    assert 'domainId' not in cb.entities[ier_id]
+    assert 'area' in cb.entities[ier_id]
+    assert 'repoPassword' not in cb.entities[COMPONENT_ID]
+    assert ('delete_attr', [f'{ier_id}/domainId']) in cb.writes
+    assert cb.entities[COMPONENT_ID]['serviceComponentStatus'] == \
+        'urn:ngsi-ld:ServiceComponentStatus:Locating'
+
+
+def test_failed_attribute_delete_is_reported(cb, generated):
+    cb.entities[COMPONENT_ID]['repoPassword'] = 'secret'
+    cb.failing_ids.add(COMPONENT_ID)
+    result = routers.run_update_service(SERVICE_ID, tosca_obj=None)
+    assert result['errors'] == [{
+        'entityId': COMPONENT_ID,
+        'error': {
+            'title': 'attributes not deleted',
+            'detail': 'repoPassword'
+        }
+    }]
@@ -0,0 +1,110 @@
+'''
+    Service lifecycle guard: merge identical operations, serialize all others
+'''
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.single_flight import ServiceLifecycleGuard
+
+
+def run_concurrently(guard, calls):
+    '''
+        Start calls while the first one holds the service lock
+        :return results in call order and the order operations ran in
+    '''
+    started = threading.Event()
+    release = threading.Event()
+    applied = []
+
+    def apply(payload):
+        if not applied:
+            started.set()
+            release.wait(5)
+        applied.append(payload)
+        return {'applied': payload}
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        first = executor.submit(guard.run, 's1', calls[0][0], apply,
+                                payload=calls[0][1], **calls[0][2])
+        started.wait(5)
+        others = [
+            executor.submit(guard.run, 's1', operation, apply,
+                            payload=payload, **options)
+            for operation, payload, options in calls[1:]
+        ]
+        # Let the others reach the guard before the first one finishes
+        while sum(guard.stats()['executions'].values()) + sum(
+                guard.stats()['coalesced'].values()) < len(calls):
+            time.sleep(0.01)
+        release.set()
+        return [first.result()] + [other.result() for other in others], applied
+
+
+def test_identical_payloads_are_merged():
+    guard = ServiceLifecycleGuard()
+    results, applied = run_concurrently(guard, [('update', 'A', {}),
+                                                ('update', 'A', {})])
+    assert results == [{'applied': 'A'}, {'applied': 'A'}]
+    assert applied == ['A']
+    assert guard.stats()['coalesced'] == {'update': 1}
+
+
+def test_different_payloads_are_serialized_not_merged():
+    guard = ServiceLifecycleGuard()
+    results, applied = run_concurrently(guard, [('update', 'A', {}),
+                                                ('update', 'B', {})])
+    assert results == [{'applied': 'A'}, {'applied': 'B'}]
+    assert applied == ['A', 'B']
+    assert guard.stats()['executions'] == {'update': 2}
+
+
+def test_coalesce_false_never_merges():
+    guard = ServiceLifecycleGuard()
+    results, applied = run_concurrently(guard, [
+        ('update', 'A', {'coalesce': False}),
+        ('update', 'A', {'coalesce': False})
+    ])
+    assert results == [{'applied': 'A'}, {'applied': 'A'}]
+    assert applied == ['A', 'A']
+    assert guard.stats()['inFlight'] == 0
+
+
+def test_bulk_joins_and_serializes_single_operations():
+    guard = ServiceLifecycleGuard()
+    bulk_started = threading.Event()
+    release = threading.Event()
+    applied = []
+
+    def apply(payload):
+        applied.append(('single', payload))
+        return {'applied': payload}
+
+    def apply_many(calls):
+        bulk_started.set()
+        release.wait(5)
+        applied.append(('bulk', sorted(calls)))
+        return {key: {'applied': kwargs['payload']}
+                for key, kwargs in calls.items()}
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        bulk = executor.submit(guard.run_many, 'allocate', apply_many, {
+            's1': {'payload': 'A'},
+            's2': {'payload': 'B'}
+        })
+        bulk_started.wait(5)
+        # Identical payload joins the bulk, another payload waits for it
+        joined = executor.submit(guard.run, 's1', 'allocate', apply,
+                                 payload='A')
+        late = executor.submit(guard.run, 's2', 'allocate', apply,
+                               payload='C')
+        while guard.stats()['coalesced'].get('allocate') != 1 or guard.stats(
+        )['executions'].get('allocate') != 3:
+            time.sleep(0.01)
+        assert not late.done()
+        release.set()
+        assert bulk.result() == {'s1': {'applied': 'A'},
+                                 's2': {'applied': 'B'}}
+        assert joined.result() == {'applied': 'A'}
+        assert late.result() == {'applied': 'C'}
+    assert applied == [('bulk', ['s1', 's2']), ('single', 'C')]
+    assert guard.stats()['inFlight'] == 0
@@ -0,0 +1,124 @@
+'''
+    Status index: never index unread components, apply only own notifications
+'''
+import asyncio
+import time
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app import routers
+from app.api_clients.cb_client import CBQueryError
+from app.config import STATUS_SUBSCRIPTION_ID
+from app.utils import async_continuum_utils, status_index as status_index_module
+from app.utils.status_index import ServiceStatusIndex, notification_authorized
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:c1'
+RUNNING = 'urn:ngsi-ld:ServiceComponentStatus:Running'
+
+
+def test_load_ignores_unread_components():
+    index = ServiceStatusIndex()
+    index.load(SERVICE_ID, None, index.load_started())
+    assert index.get(SERVICE_ID) is None
+
+
+def test_failed_fallback_read_is_not_indexed(monkeypatch):
+    index = ServiceStatusIndex()
+    index.enabled = True
+    monkeypatch.setattr(async_continuum_utils, 'status_index', index)
+
+    async def exists(service_id):
+        return True
+
+    async def failing_status(service_id):
+        raise CBQueryError('Query failed at offset 0')
+
+    monkeypatch.setattr(async_continuum_utils, 'check_service_exists', exists)
+    monkeypatch.setattr(async_continuum_utils, 'get_service_status',
+                        failing_status)
+    with pytest.raises(CBQueryError):
+        asyncio.run(async_continuum_utils.get_indexed_service_status(SERVICE_ID))
+    assert index.get(SERVICE_ID) is None
+
+
+def test_notification_must_come_from_the_status_subscription(monkeypatch):
+    monkeypatch.setattr(status_index_module, '_notification_token', 'secret')
+    assert notification_authorized({'subscriptionId': STATUS_SUBSCRIPTION_ID},
+                                   'secret')
+    assert not notification_authorized({'subscriptionId': 'urn:other'},
+                                       'secret')
+    assert not notification_authorized({}, 'secret')
+
+
+def test_notification_token(monkeypatch):
+    monkeypatch.setattr(status_index_module, '_notification_token', 'secret')
+    notification = {'subscriptionId': STATUS_SUBSCRIPTION_ID}
+    assert notification_authorized(notification, 'secret')
+    assert not notification_authorized(notification, 'guess')
+    assert not notification_authorized(notification, None)
+    monkeypatch.setattr(status_index_module, '_notification_token', None)
+    assert not notification_authorized(notification, None)
+
+
+def test_random_notification_token_without_configured_one(monkeypatch):
+    subscriptions = []
+
+    class FakeClient:
+
+        def create_subscription(self, subscription):
+            subscriptions.append(subscription)
+            return 201
+
+    monkeypatch.setattr(status_index_module, 'STATUS_NOTIFICATION_URL',
+                        'http://hlo-fe/hlo_fe/notifications')
+    monkeypatch.setattr(status_index_module, 'STATUS_NOTIFICATION_TOKEN', None)
+    monkeypatch.setattr(status_index_module, 'CBClient', FakeClient)
+    monkeypatch.setattr(status_index_module, '_notification_token', None)
+    monkeypatch.setattr(status_index_module.status_index, 'enabled', False)
+    status_index_module.start_status_subscription()
+
+    receiver_info = subscriptions[0]['notification']['endpoint'][
+        'receiverInfo']
+    token = receiver_info[0]['value']
+    assert receiver_info[0]['key'] == status_index_module.NOTIFICATION_TOKEN_HEADER
+    assert len(token) >= 32
+    notification = {'subscriptionId': STATUS_SUBSCRIPTION_ID}
+    assert notification_authorized(notification, token)
+    assert not notification_authorized(notification, None)
+
+
+def test_notification_endpoint_rejects_foreign_notifications(monkeypatch):
+    index = ServiceStatusIndex()
+    index.load(SERVICE_ID, [{
+        'id': COMPONENT_ID,
+        'serviceComponentStatus': 'urn:ngsi-ld:ServiceComponentStatus:Starting'
+    }], time.monotonic())
+    monkeypatch.setattr(routers, 'status_index', index)
+    monkeypatch.setattr(status_index_module, '_notification_token', 'secret')
+    app = FastAPI()
+    app.include_router(routers.router)
+    client = TestClient(app)
+    data = [{'id': COMPONENT_ID, 'serviceComponentStatus': RUNNING}]
+
+    response = client.post('/hlo_fe/notifications',
+                           json={'subscriptionId': 'urn:other', 'data': data})
+    assert response.status_code == 403
+    assert index.get(SERVICE_ID)[0]['serviceComponentStatus'] != RUNNING
+
+    response = client.post('/hlo_fe/notifications',
+                           json={
+                               'subscriptionId': STATUS_SUBSCRIPTION_ID,
+                               'data': data
+                           })
+    assert response.status_code == 403
+    assert index.get(SERVICE_ID)[0]['serviceComponentStatus'] != RUNNING
+
+    response = client.post('/hlo_fe/notifications',
+                           params={'token': 'secret'},
+                           json={
+                               'subscriptionId': STATUS_SUBSCRIPTION_ID,
+                               'data': data
+                           })
+    assert response.status_code == 204
+    assert index.get(SERVICE_ID)[0]['serviceComponentStatus'] == RUNNING
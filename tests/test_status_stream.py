@@ -0,0 +1,110 @@
+'''
+    Status streams: long-polls on terminal services are held, failed watches report errors
+'''
+import asyncio
+import time
+from app.utils import async_continuum_utils, status_stream
+from app.utils.status_stream import ServiceStatusHub, status_etag
+
+SERVICE_ID = 'urn:ngsi-ld:Service:s1'
+COMPONENT_ID = f'{SERVICE_ID}:Component:c1'
+STARTING = 'urn:ngsi-ld:ServiceComponentStatus:Starting'
+FINISHED = 'urn:ngsi-ld:ServiceComponentStatus:Finished'
+
+
+def _components(component_status):
+    return [{
+        'id': COMPONENT_ID,
+        'type': 'ServiceComponent',
+        'serviceComponentStatus': component_status
+    }]
+
+
+def _use_status(monkeypatch, statuses):
+    '''
+    Service status reads return statuses in turn, the last one from then on
+    '''
+    reads = []
+
+    async def get_indexed_service_status(service_id):
+        reads.append(service_id)
+        current = statuses[min(len(reads), len(statuses)) - 1]
+        if isinstance(current, Exception):
+            raise current
+        return current
+
+    monkeypatch.setattr(status_stream, 'status_hub', ServiceStatusHub(0.01))
+    monkeypatch.setattr(status_stream, 'STATUS_STREAM_INTERVAL', 0.01)
+    monkeypatch.setattr(async_continuum_utils, 'get_indexed_service_status',
+                        get_indexed_service_status)
+    return reads
+
+
+def test_long_poll_on_terminal_service_returns_at_once(monkeypatch):
+    reads = _use_status(monkeypatch, [_components(FINISHED)])
+    components = _components(FINISHED)
+    result = asyncio.run(
+        status_stream.wait_for_status_change(SERVICE_ID, components, 5))
+    assert result == components
+    assert not reads
+
+
+def test_long_poll_returns_change(monkeypatch):
+    starting, finished = _components(STARTING), _components(FINISHED)
+    _use_status(monkeypatch, [starting, starting, finished])
+    result = asyncio.run(
+        status_stream.wait_for_status_change(SERVICE_ID, starting, 5))
+    assert result == finished
+
+
+def test_unchanged_long_poll_times_out(monkeypatch):
+    starting = _components(STARTING)
+    _use_status(monkeypatch, [starting])
+    started = time.monotonic()
+    result = asyncio.run(
+        status_stream.wait_for_status_change(SERVICE_ID, starting, 0.2))
+    assert time.monotonic() - started >= 0.2
+    assert status_etag(result) == status_etag(starting)
+
+
+def test_long_polls_share_one_watch(monkeypatch):
+    starting = _components(STARTING)
+    reads = _use_status(monkeypatch, [starting])
+
+    async def long_polls():
+        await asyncio.gather(*[
+            status_stream.wait_for_status_change(SERVICE_ID, starting, 0.1)
+            for _ in range(20)
+        ])
+
+    asyncio.run(long_polls())
+    # One read per watch interval (0.01s) whatever the number of clients
+    assert len(reads) <= 15
+
+
+def test_failed_watch_sends_error_event(monkeypatch):
+    _use_status(monkeypatch, [RuntimeError('CB down')])
+
+    async def collect():
+        return [
+            event
+            async for event in status_stream.stream_service_events(SERVICE_ID)
+        ]
+
+    events = asyncio.run(collect())
+    assert len(events) == 1
+    assert events[0].startswith('event: error\n')
+
+
+def test_terminal_service_stream_ends(monkeypatch):
+    _use_status(monkeypatch, [_components(FINISHED)])
+
+    async def collect():
+        return [
+            event
+            async for event in status_stream.stream_service_events(SERVICE_ID)
+        ]
+
+    events = asyncio.run(collect())
+    assert [event.split('\n')[0] for event in events
+            ] == ['event: status', 'event: end']
@@ -0,0 +1,78 @@
+'''
+    TOSCA cache: resubmitted bodies are served without parsing, invalid ones never cached
+'''
+import json
+import pytest
+import yaml
+from app.app_models import tosca_models
+from app.app_models.tosca_models import TOSCA_JSON, TOSCA_YAML, ToscaCache
+from tests.tosca_documents import tosca_document
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    fresh = ToscaCache(max_entries=2)
+    monkeypatch.setattr(tosca_models, 'tosca_cache', fresh)
+    return fresh
+
+
+def _yaml_body(**changes) -> bytes:
+    document = tosca_document()
+    document.update(changes)
+    return yaml.safe_dump(document).encode()
+
+
+def test_resubmitted_body_is_not_parsed_again(cache, monkeypatch):
+    body = _yaml_body()
+    tosca_obj = tosca_models.validate_tosca(body)
+    assert tosca_obj is not None
+
+    def parse_tosca(tosca_body, media_type=TOSCA_YAML):
+        raise AssertionError('cached body parsed again')
+
+    monkeypatch.setattr(tosca_models, 'parse_tosca', parse_tosca)
+    assert tosca_models.validate_tosca(body) is tosca_obj
+    assert tosca_models.validate_tosca(body.decode()) is tosca_obj
+    assert cache.stats()['hits'] == 2
+
+
+def test_key_includes_media_type():
+    body = json.dumps(tosca_document())
+    assert ToscaCache.key(body, TOSCA_JSON) != ToscaCache.key(body, TOSCA_YAML)
+    assert ToscaCache.key(body, TOSCA_JSON) == ToscaCache.key(
+        body.encode(), TOSCA_JSON)
+
+
+def test_invalid_body_is_not_cached(cache):
+    document = tosca_document()
+    del document['node_templates']
+    assert tosca_models.validate_tosca(yaml.safe_dump(document)) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_dict_bodies_bypass_the_cache(cache):
+    assert tosca_models.validate_tosca(tosca_document()) is not None
+    assert cache.stats() == {
+        'entries': 0,
+        'maxEntries': 2,
+        'hits': 0,
+        'misses': 0
+    }
+
+
+def test_least_recently_used_body_is_evicted(cache):
+    bodies = [_yaml_body(description=f'service {i}') for i in range(3)]
+    first = tosca_models.validate_tosca(bodies[0])
+    tosca_models.validate_tosca(bodies[1])
+    # bodies[0] used again, bodies[1] is now the oldest
+    assert tosca_models.validate_tosca(bodies[0]) is first
+    tosca_models.validate_tosca(bodies[2])
+    assert cache.get(ToscaCache.key(bodies[0])) is first
+    assert cache.get(ToscaCache.key(bodies[1])) is None
+
+
+def test_zero_size_disables_cache():
+    cache = ToscaCache(max_entries=0)
+    key = ToscaCache.key(_yaml_body())
+    cache.put(key, object())
+    assert cache.get(key) is None
@@ -0,0 +1,81 @@
+'''
+    TOSCA request bodies: protobuf (schemas/tosca.proto), json and yaml decode to the same model
+'''
+import json
+import pytest
+import yaml
+from google.protobuf.message import DecodeError
+from app.app_models.py_files import tosca_pb2
+from app.app_models.tosca_models import TOSCA_JSON, TOSCA_PROTOBUF, TOSCA_YAML,\
+    parse_tosca, tosca_media_type, validate_tosca
+from tests.tosca_documents import tosca_document
+
+
+def _protobuf_body() -> bytes:
+    '''
+    tosca_document() as a serialized Tosca message
+    '''
+    tosca = tosca_pb2.Tosca(tosca_definitions_version='tosca_simple_yaml_1_3',
+                            description='Test service')
+    node = tosca.node_templates['web']
+    node.type = 'tosca.nodes.Container.Application'
+    node.isJob = False
+    artifact = node.artifacts['application_image']
+    artifact.file = 'nginx:latest'
+    artifact.repository = 'docker_hub'
+    artifact.type = 'tosca.artifacts.Deployment.Image.Container.Docker'
+    create = node.interfaces['Standard'].create
+    create.implementation = 'application_image'
+    create.inputs.cliArgs.add(key='-a', value='aa')
+    create.inputs.envVars.add(key='URL', value='bb')
+    network = node.requirements.add().network.properties
+    network.exposePorts = True
+    port = network.ports['port1'].properties
+    port.protocol.append('tcp')
+    port.source = 80
+    capabilities = node.requirements.add().host.node_filter.capabilities.add()
+    host = capabilities.capabilities['host'].properties
+    host.cpu_arch.equal = 'x86_64'
+    host.cpu_usage.less_or_equal = 0.4
+    host.mem_size.greater_or_equal = '1'
+    host.realtime.equal = False
+    host.domain_id.equal = 'urn:ngsi-ld:Domain:D1'
+    return tosca.SerializeToString()
+
+
+def test_protobuf_json_and_yaml_decode_to_the_same_tosca():
+    document = tosca_document()
+    from_yaml = parse_tosca(yaml.safe_dump(document), TOSCA_YAML)
+    from_json = parse_tosca(json.dumps(document), TOSCA_JSON)
+    from_protobuf = parse_tosca(_protobuf_body(), TOSCA_PROTOBUF)
+    assert from_json == from_yaml
+    assert from_protobuf == from_yaml
+
+
+def test_protobuf_optional_fields_stay_unset():
+    tosca_obj = parse_tosca(_protobuf_body(), TOSCA_PROTOBUF)
+    properties = tosca_obj.node_templates['web'].requirements[1].host.\
+        node_filter.capabilities[0]['host'].properties
+    assert properties.area is None
+    assert properties.green.greater_or_equal is None
+    artifact = tosca_obj.node_templates['web'].artifacts['application_image']
+    assert artifact.username is None and artifact.password is None
+
+
+def test_invalid_protobuf_body():
+    with pytest.raises(DecodeError):
+        parse_tosca(b'\xff\xff\xff', TOSCA_PROTOBUF)
+    assert validate_tosca(b'\xff\xff\xff', TOSCA_PROTOBUF) is None
+
+
+@pytest.mark.parametrize('content_type, media_type', [
+    (None, TOSCA_YAML),
+    ('application/x-yaml', TOSCA_YAML),
+    ('text/plain', TOSCA_YAML),
+    ('application/json; charset=utf-8', TOSCA_JSON),
+    ('application/tosca+json', TOSCA_JSON),
+    ('application/x-protobuf', TOSCA_PROTOBUF),
+    ('Application/Protobuf', TOSCA_PROTOBUF),
+])
+def test_media_type_of_content_type(content_type, media_type):
+    assert tosca_media_type(content_type) == media_type
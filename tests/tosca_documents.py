@@ -0,0 +1,86 @@
+'''
+    Minimal valid TOSCA allocation request, as the dict a yaml or json body decodes to
+'''
+import copy
+
+_TOSCA = {
+    'tosca_definitions_version': 'tosca_simple_yaml_1_3',
+    'description': 'Test service',
+    'node_templates': {
+        'web': {
+            'type': 'tosca.nodes.Container.Application',
+            'isJob': False,
+            'artifacts': {
+                'application_image': {
+                    'file': 'nginx:latest',
+                    'repository': 'docker_hub',
+                    'type': 'tosca.artifacts.Deployment.Image.Container.Docker'
+                }
+            },
+            'interfaces': {
+                'Standard': {
+                    'create': {
+                        'implementation': 'application_image',
+                        'inputs': {
+                            'cliArgs': [{
+                                '-a': 'aa'
+                            }],
+                            'envVars': [{
+                                'URL': 'bb'
+                            }]
+                        }
+                    }
+                }
+            },
+            'requirements': [{
+                'network': {
+                    'properties': {
+                        'ports': {
+                            'port1': {
+                                'properties': {
+                                    'protocol': ['tcp'],
+                                    'source': 80
+                                }
+                            }
+                        },
+                        'exposePorts': True
+                    }
+                }
+            }, {
+                'host': {
+                    'node_filter': {
+                        'capabilities': [{
+                            'host': {
+                                'properties': {
+                                    'cpu_arch': {
+                                        'equal': 'x86_64'
+                                    },
+                                    'cpu_usage': {
+                                        'less_or_equal': 0.4
+                                    },
+                                    'mem_size': {
+                                        'greater_or_equal': '1'
+                                    },
+                                    'realtime': {
+                                        'equal': False
+                                    },
+                                    'domain_id': {
+                                        'equal': 'urn:ngsi-ld:Domain:D1'
+                                    }
+                                }
+                            }
+                        }],
+                        'properties': None
+                    }
+                }
+            }]
+        }
+    }
+}
+
+
+def tosca_document() -> dict:
+    '''
+        Fresh copy, tests may change it
+    '''
+    return copy.deepcopy(_TOSCA)